@@ -12,6 +12,10 @@ import plotly.graph_objects as go
 from utils.auth import require_login, require_email_whitelist
 from utils.allowed_emails import ALLOWED_EMAILS
 from utils.data_loaders import load_data, load_data_df
+from utils.kpi_engine import company_kpis
+from utils.company_tags import EIGEN_TAG, KLANT_TAG, company_ids_with_tag
+from utils.result_cache import arrow_cache, clear_cache as clear_result_cache
+from utils.profiler import profiler_toggle, profiler_enabled, stage, render_profiler
 
 st.set_page_config(
     page_title="Dunion KPI Dashboard",
@@ -31,6 +35,9 @@ if "access_token" in st.session_state:
         st.session_state.clear()
         st.rerun()
 
+# --- PROFILER (opt-in, zie utils/profiler.py) ---
+profiler_toggle("app")
+
 # --- REST VAN DASHBOARD PAS NA LOGIN ---
 
 st.logo("images/dunion-logo-def_donker-06.png")
@@ -72,12 +79,14 @@ if st.button("🔄 Database Verversen", type="primary", use_container_width=True
 # Cache clear knop
 if st.button("🗑️ Clear Cache", type="secondary", use_container_width=True):
     st.cache_data.clear()
+    clear_result_cache()
     st.success("Cache cleared!")
     st.rerun()
 
 # Also add a cache clearing option in sidebar for debugging
 if st.sidebar.button("🗑️ Clear Cache (Debug)"):
     st.cache_data.clear()
+    clear_result_cache()
     st.rerun()
 
 st.markdown("---")
@@ -111,14 +120,11 @@ with st.container():
     )
     st.markdown('</div>', unsafe_allow_html=True)
 
-# --- OMZET RADIO KNOP ---
-omzet_optie = st.radio("📊 Welke omzet wil je tonen?", options=["Werkelijke omzet (facturen)", "Geplande omzet (offerte)"], index=0, horizontal=True)
-
 filter_primary_tag = None
 if filter_optie == "Eigen bedrijven":
-    filter_primary_tag = "1 | Eigen webshop(s) / bedrijven"
+    filter_primary_tag = EIGEN_TAG
 elif filter_optie == "Klanten":
-    filter_primary_tag = "1 | Externe opdrachten / contracten"
+    filter_primary_tag = KLANT_TAG
 # Voor 'Alle bedrijven' laten we filter_primary_tag op None staan.
 
 st.markdown("""
@@ -141,37 +147,36 @@ engine = create_engine(POSTGRES_URL)
 # Streamlit-extras is optioneel en wordt niet gebruikt in deze app
 
 # --- LOAD DATA ---
-@st.cache_data(ttl=3600)
+# Resultaten staan als Arrow IPC in de gedeelde cache (utils/result_cache.py), per dataversie
+@arrow_cache(tables=["projects"])
+def load_projects():
+    df_projects_raw = load_data_df("projects", columns=["id", "company_id", "archived", "totalinclvat", "name"])
+    df_projects_raw["totalinclvat"] = df_projects_raw["totalinclvat"].fillna(0)
+    return df_projects_raw
+
+@arrow_cache(tables=["companies"])
+def load_companies():
+    return load_data_df("companies", columns=["id", "companyname", "tag_names"])
+
 def load_base_data():
     """Load base data that doesn't change often"""
-    df_projects_raw = load_data_df("projects", columns=["id", "company_id", "archived", "totalinclvat", "name"])
-    if not isinstance(df_projects_raw, pd.DataFrame):
-        df_projects_raw = pd.concat(list(df_projects_raw), ignore_index=True)
-    df_projects_raw["totalinclvat"] = pd.to_numeric(df_projects_raw["totalinclvat"], errors="coerce").fillna(0)
-    
-    df_companies = load_data_df("companies", columns=["id", "companyname", "tag_names"])
-    if not isinstance(df_companies, pd.DataFrame):
-        df_companies = pd.concat(list(df_companies), ignore_index=True)
-    
-    return df_projects_raw, df_companies
-
-df_projects_raw, df_companies = load_base_data()
-
-# Helperfunctie voor exacte tag match (alleen primaire tag)
-def bedrijf_heeft_tag(tag_string, filter_primary_tag):
-    if not isinstance(tag_string, str):
-        return False
-    tags = [t.strip() for t in tag_string.split(",")]
-    return filter_primary_tag in tags
-
-if filter_primary_tag:
-    df_companies = df_companies[df_companies["tag_names"].apply(lambda x: bedrijf_heeft_tag(x, filter_primary_tag))]
-elif filter_optie == "Alle bedrijven":
-    # Neem alleen bedrijven mee met geldige tags (behalve lege tags)
-    df_companies = df_companies[
-        (df_companies["tag_names"].notna()) &
-        (df_companies["tag_names"].str.strip() != "")
-    ]
+    return load_projects(), load_companies()
+
+with stage("Projecten en bedrijven laden") as s:
+    df_projects_raw, df_companies = load_base_data()
+    s["df"] = df_companies
+
+with stage("Bedrijven filteren op tag") as s:
+    if filter_primary_tag:
+        # Exacte tag match via de tag-index (utils/company_tags.py): een set-lookup per bedrijf
+        df_companies = df_companies[df_companies["id"].isin(company_ids_with_tag(filter_primary_tag))]
+    elif filter_optie == "Alle bedrijven":
+        # Neem alleen bedrijven mee met geldige tags (behalve lege tags)
+        df_companies = df_companies[
+            (df_companies["tag_names"].notna()) &
+            (df_companies["tag_names"].str.strip() != "")
+        ]
+    s["df"] = df_companies
 
 # --- 📅 Periode Filter (Form + Commit-knop) ---
 from datetime import datetime, timedelta, date
@@ -229,64 +234,57 @@ if len(bedrijf_ids) == 0:
     st.warning("Geen bedrijven gevonden voor deze filterkeuze.")
     st.stop()
 
-@st.cache_data(ttl=3600)
-def load_employees_and_projectlines():
-    """Load employees and projectlines data"""
-    df_employees = load_data_df("employees", columns=["id", "firstname", "lastname"])
-    if not isinstance(df_employees, pd.DataFrame):
-        df_employees = pd.concat(list(df_employees), ignore_index=True)
-    
-    df_projectlines = load_data_df("projectlines_per_company", columns=["id", "bedrijf_id", "offerprojectbase_id", "amount", "amountwritten", "sellingprice", "unit_searchname", "createdon_date"])
-    if not isinstance(df_projectlines, pd.DataFrame):
-        df_projectlines = pd.concat(list(df_projectlines), ignore_index=True)
-    
-    return df_employees, df_projectlines
+@arrow_cache(tables=["employees"])
+def load_employees():
+    return load_data_df("employees", columns=["id", "firstname", "lastname"])
+
+@arrow_cache(tables=["projectlines_per_company"])
+def load_projectlines(bedrijf_ids):
+    """Projectlines van de geselecteerde bedrijven (filter in de database)"""
+    return load_data_df(
+        "projectlines_per_company",
+        columns=["id", "bedrijf_id", "offerprojectbase_id", "amount", "amountwritten", "sellingprice", "unit_searchname", "createdon_date"],
+        filters={"bedrijf_id": bedrijf_ids},
+    )
 
-df_employees, df_projectlines = load_employees_and_projectlines()
-# Load invoices with date filtering in SQL (like werkverdeling.py)
+def load_employees_and_projectlines(bedrijf_ids):
+    """Load employees and the projectlines of the selected companies"""
+    return load_employees(), load_projectlines(bedrijf_ids)
+
+with stage("Medewerkers en projectlines laden") as s:
+    df_employees, df_projectlines = load_employees_and_projectlines(bedrijf_ids)
+    s["df"] = df_projectlines
+# Load invoices with date and company filtering in SQL
 from utils.data_loaders import get_engine
 engine = get_engine()
 
-@st.cache_data(ttl=300)
+@arrow_cache(tables=["invoices"])
 def load_filtered_invoices(start_date_str, end_date_str, bedrijf_ids):
-    # Convert bedrijf_ids to tuple for hashable cache key
-    bedrijf_ids_tuple = tuple(sorted(bedrijf_ids)) if bedrijf_ids else ()
-    
-    invoices_query = f"""
-    SELECT id, company_id, fase, totalpayed, status_searchname, number, date_date, reportdate_date, subject
-    FROM invoices 
-    WHERE reportdate_date BETWEEN '{start_date_str}' AND '{end_date_str}'
-    """
-    df_invoices = pd.read_sql(invoices_query, engine)
-    df_invoices = df_invoices[df_invoices["company_id"].isin(bedrijf_ids)]
+    # Periode en bedrijven als bind-parameters: company_id = ANY(:ids), reportdate_date tussen start en eind
+    df_invoices = load_data_df(
+        "invoices",
+        columns=["id", "company_id", "fase", "totalpayed", "status_searchname", "number", "date_date", "reportdate_date", "subject"],
+        filters={"company_id": bedrijf_ids},
+        date_range={"reportdate_date": (start_date_str, end_date_str)},
+    )
     
-    # Convert totalpayed to numeric
-    df_invoices['totalpayed'] = pd.to_numeric(df_invoices['totalpayed'], errors='coerce').fillna(0)
+    # totalpayed is al float64 via het schema-register
+    df_invoices['totalpayed'] = df_invoices['totalpayed'].fillna(0)
     
     return df_invoices
 
-@st.cache_data(ttl=300)
 def load_filtered_projectlines(start_date_str, end_date_str, bedrijf_ids):
-    """Load and filter projectlines based on date and company"""
-    # Convert bedrijf_ids to tuple for hashable cache key
-    bedrijf_ids_tuple = tuple(sorted(bedrijf_ids)) if bedrijf_ids else ()
-    
-    # Filter projectlines op unit "uur" en bedrijf_ids
-    df_projectlines_uren = df_projectlines[
-        (df_projectlines["unit_searchname"] == "uur") &
-        (df_projectlines["bedrijf_id"].isin(bedrijf_ids))
-    ].copy()
+    """Load and filter projectlines based on date (bedrijven zijn al in de database gefilterd)"""
+    # Filter projectlines op unit "uur"
+    df_projectlines_uren = df_projectlines[df_projectlines["unit_searchname"] == "uur"].copy()
     
     # Filter projectlines op geselecteerde periode (als createdon_date beschikbaar is)
     if 'createdon_date' in df_projectlines_uren.columns:
-        # Convert createdon_date to datetime
-        df_projectlines_uren['createdon_date'] = pd.to_datetime(df_projectlines_uren['createdon_date'], errors='coerce')
-        
-        # Filter only records with createdon_date in the selected period
+        # createdon_date is al date32 (eenmalig geparsed bij ingestie), dus direct vergelijken
         df_projectlines_with_date = df_projectlines_uren[
             (df_projectlines_uren['createdon_date'].notna()) &
-            (df_projectlines_uren['createdon_date'] >= pd.to_datetime(start_date_str)) &
-            (df_projectlines_uren['createdon_date'] <= pd.to_datetime(end_date_str))
+            (df_projectlines_uren['createdon_date'] >= date.fromisoformat(start_date_str)) &
+            (df_projectlines_uren['createdon_date'] <= date.fromisoformat(end_date_str))
         ]
         
         # Include records without createdon_date (no date filtering for these)
@@ -300,10 +298,12 @@ def load_filtered_projectlines(start_date_str, end_date_str, bedrijf_ids):
     
     return df_projectlines_filtered
 
-df_invoices = load_filtered_invoices(start_date_str, end_date_str, bedrijf_ids)
-df_projectlines_filtered = load_filtered_projectlines(start_date_str, end_date_str, bedrijf_ids)
-
-# Date filtering is now done in SQL query above
+with stage("Facturen laden") as s:
+    df_invoices = load_filtered_invoices(start_date_str, end_date_str, bedrijf_ids)
+    s["df"] = df_invoices
+with stage("Projectlines filteren op periode") as s:
+    df_projectlines_filtered = load_filtered_projectlines(start_date_str, end_date_str, bedrijf_ids)
+    s["df"] = df_projectlines_filtered
 
 
 # --- DATA PREP ---
@@ -312,177 +312,86 @@ if 'bedrijf_id' not in df_projectlines.columns and 'company_id' in df_projectlin
     df_projectlines = df_projectlines.rename(columns={'company_id': 'bedrijf_id'})
 if 'companyname' not in df_companies.columns and 'bedrijf_naam' in df_companies.columns:
     df_companies = df_companies.rename(columns={'bedrijf_naam': 'companyname'})
-for col in ["amountwritten", "sellingprice"]:
-    if col in df_projectlines.columns:
-        df_projectlines[col] = pd.to_numeric(df_projectlines[col], errors="coerce")
-
-# Bereken totaal uren per bedrijf met datumfilter via projectlines
-# Filter projectlines op unit "uur" en bedrijf_ids
-df_projectlines_uren = df_projectlines[
-    (df_projectlines["unit_searchname"] == "uur") &
-    (df_projectlines["bedrijf_id"].isin(bedrijf_ids))
-].copy()
-
-# Filter projectlines op geselecteerde periode (als createdon_date beschikbaar is)
-if 'createdon_date' in df_projectlines_uren.columns:
-    # Debug: Toon voorbeelden van createdon_date voordat conversie
-    st.write(f"🔍 DEBUG: Voorbeelden createdon_date (voor conversie):")
-    sample_dates = df_projectlines_uren['createdon_date'].head(5).tolist()
-    st.write(sample_dates)
-    
-    df_projectlines_uren['createdon_date'] = pd.to_datetime(df_projectlines_uren['createdon_date'], errors='coerce')
-    
-    # Debug: Toon voorbeelden na conversie
-    st.write(f"🔍 DEBUG: Voorbeelden createdon_date (na conversie):")
-    sample_dates_after = df_projectlines_uren['createdon_date'].head(5).tolist()
-    st.write(sample_dates_after)
-    
-    # Debug: Toon hoeveel null values
-    null_count = df_projectlines_uren['createdon_date'].isna().sum()
-    st.write(f"🔍 DEBUG: Null values na conversie: {null_count}")
-    
-    # Alleen records met createdon_date filteren op periode
-    df_projectlines_with_date = df_projectlines_uren[
-        (df_projectlines_uren['createdon_date'].notna()) &
-        (df_projectlines_uren['createdon_date'] >= start_datetime) &
-        (df_projectlines_uren['createdon_date'] <= end_datetime)
-    ]
-    # Records zonder createdon_date toevoegen (geen datum filtering)
-    df_projectlines_without_date = df_projectlines_uren[df_projectlines_uren['createdon_date'].isna()]
-    # Combineer beide
-    df_projectlines_filtered = pd.concat([df_projectlines_with_date, df_projectlines_without_date], ignore_index=True)
-    
-    st.write(f"🔍 DEBUG: Projectlines met datum in periode: {len(df_projectlines_with_date)}")
-    st.write(f"🔍 DEBUG: Projectlines zonder datum: {len(df_projectlines_without_date)}")
-    st.write(f"🔍 DEBUG: Totaal projectlines na filtering: {len(df_projectlines_filtered)}")
-else:
-    # Geen createdon_date kolom, gebruik alle projectlines
-    df_projectlines_filtered = df_projectlines_uren
-    st.write(f"🔍 DEBUG: Geen createdon_date kolom, gebruik alle {len(df_projectlines_filtered)} projectlines")
-
-# Bereken totaal uren per bedrijf
-df_projectlines_filtered["amountwritten"] = pd.to_numeric(df_projectlines_filtered["amountwritten"], errors="coerce")
-uren_per_bedrijf = df_projectlines_filtered.groupby("bedrijf_id")["amountwritten"].sum().reset_index()
-uren_per_bedrijf.columns = ["bedrijf_id", "totaal_uren"]
-
-# Debug informatie - ALTIJD TONEN om te zien wat er gebeurt
-with st.expander("🔍 Debug: Data Filtering Info"):
-    st.write(f"**Start datum:** {start_d.strftime('%Y-%m-%d')}")
-    st.write(f"**Eind datum:** {end_d.strftime('%Y-%m-%d')}")
-    st.write(f"**Bedrijf IDs na filtering:** {len(bedrijf_ids)} bedrijven")
-    
-    # Debug na data loading
-    st.write("**Data counts na filtering:**")
-    st.write(f"- Invoices: {len(df_invoices)} records")
-    st.write(f"- Projectlines (uren): {len(df_projectlines_filtered)} records")
-    st.write(f"- Projectlines (totaal): {len(df_projectlines)} records")
-    
-    # Debug projectlines dates
-    if 'createdon_date' in df_projectlines_filtered.columns:
-        st.write("**Projectlines date info:**")
-        records_with_date = df_projectlines_filtered['createdon_date'].notna().sum()
-        records_without_date = df_projectlines_filtered['createdon_date'].isna().sum()
-        st.write(f"- Records met createdon_date: {records_with_date}")
-        st.write(f"- Records zonder createdon_date: {records_without_date}")
-        if records_with_date > 0:
-            st.write(f"- Min date: {df_projectlines_filtered['createdon_date'].min()}")
-            st.write(f"- Max date: {df_projectlines_filtered['createdon_date'].max()}")
-    
-    # Debug invoice dates
-    if len(df_invoices) > 0:
-        st.write("**Invoice date range:**")
-        st.write(f"- Min date: {df_invoices['reportdate_date'].min()}")
-        st.write(f"- Max date: {df_invoices['reportdate_date'].max()}")
-        # Convert to numeric first, then sum
-        total_amount = pd.to_numeric(df_invoices['totalpayed'], errors='coerce').sum()
-        st.write(f"- Total invoice amount: €{total_amount:,.2f}")
-    
-    # Debug: Laat ook zien wat er in de RAW data zit (zonder filtering)
-    st.write("**RAW data (zonder datum filtering):**")
-    df_invoices_raw = load_data_df("invoices", columns=["id", "company_id", "fase", "totalpayed", "status_searchname", "number", "date_date", "reportdate_date", "subject"])
-    if not isinstance(df_invoices_raw, pd.DataFrame):
-        df_invoices_raw = pd.concat(list(df_invoices_raw), ignore_index=True)
-    df_invoices_raw = df_invoices_raw[df_invoices_raw["company_id"].isin(bedrijf_ids)]
-    
-    if 'reportdate_date' in df_invoices_raw.columns:
-        df_invoices_raw['reportdate_date'] = pd.to_datetime(df_invoices_raw['reportdate_date'], errors='coerce')
-        st.write(f"- RAW invoices: {len(df_invoices_raw)} records")
-        if len(df_invoices_raw) > 0:
-            st.write(f"- RAW invoice date range: {df_invoices_raw['reportdate_date'].min()} tot {df_invoices_raw['reportdate_date'].max()}")
-            total_raw = pd.to_numeric(df_invoices_raw['totalpayed'], errors='coerce').sum()
-            st.write(f"- RAW total amount: €{total_raw:,.2f}")
-    
-    if len(df_invoices) == 0:
-        st.warning("⚠️ Geen facturen gevonden voor deze periode!")
-    if len(df_projectlines_filtered) == 0:
-        st.warning("⚠️ Geen projectlines gevonden voor deze periode!")
-
-# === PROJECTLINES UREN LOGICA ===
-# We gebruiken nu projectlines amountwritten voor accurate uren data
-
-# Bereken totaal gefactureerd per bedrijf uit gefilterde data
-# Gebruik de gefilterde invoices (df_invoices) in plaats van alle invoices
-st.write(f"🔍 DEBUG: df_invoices voor factuurbedrag berekening: {len(df_invoices)} records")
-if len(df_invoices) > 0:
-    st.write(f"🔍 DEBUG: df_invoices kolommen: {df_invoices.columns.tolist()}")
-    st.write(f"🔍 DEBUG: df_invoices company_id unieke waarden: {df_invoices['company_id'].nunique()}")
-    st.write(f"🔍 DEBUG: df_invoices totalpayed sample: {df_invoices['totalpayed'].head(5).tolist()}")
-
-factuurbedrag_per_bedrijf = df_invoices.groupby("company_id")["totalpayed"].sum().reset_index()
-factuurbedrag_per_bedrijf.rename(columns={"company_id": "bedrijf_id", "totalpayed": "totalpayed"}, inplace=True)
-
-# Ensure totalpayed is numeric
-factuurbedrag_per_bedrijf["totalpayed"] = pd.to_numeric(factuurbedrag_per_bedrijf["totalpayed"], errors="coerce").fillna(0)
-
-st.write(f"🔍 DEBUG: factuurbedrag_per_bedrijf: {len(factuurbedrag_per_bedrijf)} records")
-if len(factuurbedrag_per_bedrijf) > 0:
-    st.write(f"🔍 DEBUG: factuurbedrag_per_bedrijf sample: {factuurbedrag_per_bedrijf.head(5).to_dict('records')}")
-
-# Bereken geplande omzet per bedrijf (op basis van offertes/projecten)
-geplande_omzet_per_bedrijf = df_projects_raw.groupby("company_id")["totalinclvat"].sum().reset_index()
-geplande_omzet_per_bedrijf.rename(columns={"company_id": "bedrijf_id", "totalinclvat": "geplande_omzet"}, inplace=True)
-
-# Zorg dat beide DataFrames een kolom 'bedrijf_id' hebben vóór de merge
-if 'company_id' in uren_per_bedrijf.columns:
-    uren_per_bedrijf = uren_per_bedrijf.rename(columns={'company_id': 'bedrijf_id'})
-if 'company_id' in factuurbedrag_per_bedrijf.columns:
-    factuurbedrag_per_bedrijf = factuurbedrag_per_bedrijf.rename(columns={'company_id': 'bedrijf_id'})
-
-# Filter uren_per_bedrijf en factuurbedrag_per_bedrijf op bedrijf_ids (voor zekerheid, SQL kan breder zijn)
-uren_per_bedrijf = uren_per_bedrijf[uren_per_bedrijf["bedrijf_id"].isin(bedrijf_ids)]
-factuurbedrag_per_bedrijf = factuurbedrag_per_bedrijf[factuurbedrag_per_bedrijf["bedrijf_id"].isin(bedrijf_ids)]
-
-# Combineer stats per bedrijf
-st.write(f"🔍 DEBUG: uren_per_bedrijf: {len(uren_per_bedrijf)} records")
-st.write(f"🔍 DEBUG: factuurbedrag_per_bedrijf: {len(factuurbedrag_per_bedrijf)} records")
-
-bedrijfsstats = uren_per_bedrijf.merge(factuurbedrag_per_bedrijf, on="bedrijf_id", how="outer")
-bedrijfsstats = bedrijfsstats.merge(df_companies[["id", "companyname"]], left_on="bedrijf_id", right_on="id", how="left")
-bedrijfsstats = bedrijfsstats.drop(columns=[col for col in ['id'] if col in bedrijfsstats.columns])
-bedrijfsstats["totaal_uren"] = pd.to_numeric(bedrijfsstats["totaal_uren"], errors="coerce").fillna(0)
-bedrijfsstats["totalpayed"] = pd.to_numeric(bedrijfsstats["totalpayed"], errors="coerce").fillna(0)
-
-st.write(f"🔍 DEBUG: bedrijfsstats na merge: {len(bedrijfsstats)} records")
-if len(bedrijfsstats) > 0:
-    st.write(f"🔍 DEBUG: bedrijfsstats kolommen: {bedrijfsstats.columns.tolist()}")
-    st.write(f"🔍 DEBUG: bedrijfsstats totalpayed sample: {bedrijfsstats['totalpayed'].head(5).tolist()}")
-    st.write(f"🔍 DEBUG: bedrijfsstats totalpayed sum: {bedrijfsstats['totalpayed'].sum()}")
-
-# Voeg geplande omzet toe aan bedrijfsstats VOORDAT tarief_per_uur wordt berekend
-bedrijfsstats = bedrijfsstats.merge(geplande_omzet_per_bedrijf, on="bedrijf_id", how="left")
-bedrijfsstats["geplande_omzet"] = pd.to_numeric(bedrijfsstats["geplande_omzet"], errors="coerce").fillna(0)
-
-# Dynamische tariefberekening afhankelijk van omzet_optie
-if omzet_optie == "Werkelijke omzet (facturen)":
-    bedrijfsstats["tarief_per_uur"] = bedrijfsstats["totalpayed"].div(bedrijfsstats["totaal_uren"].replace(0, pd.NA)).fillna(0).infer_objects(copy=False)
-else:
-    bedrijfsstats["tarief_per_uur"] = bedrijfsstats["geplande_omzet"].div(bedrijfsstats["totaal_uren"].replace(0, pd.NA)).fillna(0)
-
-# Filter bedrijfsstats op bedrijf_ids (voor absolute veiligheid)
-bedrijfsstats = bedrijfsstats[bedrijfsstats["bedrijf_id"].isin(bedrijf_ids)]
+
+# KPI's per bedrijf uit de gedeelde KPI-engine (utils/kpi_engine.py); een nieuwe periode is een lookup in de KPI-kubus
+with stage("KPI's per bedrijf (KPI-engine)") as s:
+    bedrijf_kpis = company_kpis(start_date_str, end_date_str, bedrijf_ids)
+    # Alleen bedrijven met uren of facturen in de periode, zoals voorheen na de groupby's
+    bedrijf_kpis = bedrijf_kpis[(bedrijf_kpis["totaal_uren"] != 0) | (bedrijf_kpis["totalpayed"] != 0)]
+    s["df"] = bedrijf_kpis
+
+# Debug informatie: alleen met de profiler aan, zodat de extra query's anders niet draaien
+if profiler_enabled():
+    with st.expander("🔍 Debug: Data Filtering Info"):
+        st.write(f"**Start datum:** {st.session_state.period_start.strftime('%Y-%m-%d')}")
+        st.write(f"**Eind datum:** {st.session_state.period_end.strftime('%Y-%m-%d')}")
+        st.write(f"**Bedrijf IDs na filtering:** {len(bedrijf_ids)} bedrijven")
+
+        # Debug na data loading
+        st.write("**Data counts na filtering:**")
+        st.write(f"- Invoices: {len(df_invoices)} records")
+        st.write(f"- Projectlines (uren): {len(df_projectlines_filtered)} records")
+        st.write(f"- Projectlines (totaal): {len(df_projectlines)} records")
+
+        # Debug projectlines dates
+        if 'createdon_date' in df_projectlines_filtered.columns:
+            st.write("**Projectlines date info:**")
+            records_with_date = df_projectlines_filtered['createdon_date'].notna().sum()
+            records_without_date = df_projectlines_filtered['createdon_date'].isna().sum()
+            st.write(f"- Records met createdon_date: {records_with_date}")
+            st.write(f"- Records zonder createdon_date: {records_without_date}")
+            if records_with_date > 0:
+                st.write(f"- Min date: {df_projectlines_filtered['createdon_date'].min()}")
+                st.write(f"- Max date: {df_projectlines_filtered['createdon_date'].max()}")
+
+        # Debug invoice dates
+        if len(df_invoices) > 0:
+            st.write("**Invoice date range:**")
+            st.write(f"- Min date: {df_invoices['reportdate_date'].min()}")
+            st.write(f"- Max date: {df_invoices['reportdate_date'].max()}")
+            total_amount = df_invoices['totalpayed'].sum()
+            st.write(f"- Total invoice amount: €{total_amount:,.2f}")
+
+        # Ter vergelijking de facturen zonder datumfilter: alleen aggregaten, niet de hele tabel
+        st.write("**RAW data (zonder datum filtering):**")
+        with stage("Debug: facturen zonder datumfilter") as s:
+            df_invoices_raw = load_data_df(
+                "invoices",
+                filters={"company_id": bedrijf_ids},
+                aggregates={
+                    "aantal": ("count", "*"),
+                    "min_datum": ("min", "reportdate_date"),
+                    "max_datum": ("max", "reportdate_date"),
+                    "totaal": ("sum", "totalpayed"),
+                },
+                typed=False,
+            )
+            s["df"] = df_invoices_raw
+        raw = df_invoices_raw.iloc[0]
+        st.write(f"- RAW invoices: {raw['aantal']} records")
+        if raw["aantal"]:
+            st.write(f"- RAW invoice date range: {raw['min_datum']} tot {raw['max_datum']}")
+            st.write(f"- RAW total amount: €{float(raw['totaal'] or 0):,.2f}")
+
+        if len(df_invoices) == 0:
+            st.warning("⚠️ Geen facturen gevonden voor deze periode!")
+        if len(df_projectlines_filtered) == 0:
+            st.warning("⚠️ Geen projectlines gevonden voor deze periode!")
+
+# === BEDRIJFSSTATS ===
+# Uren, gefactureerd, geplande omzet en beide tarieven per bedrijf komen kant-en-klaar uit de
+# KPI-engine; het omzet-fragment kiest een tarief zonder de rest te herberekenen
+with stage("Bedrijfsstats samenvoegen") as s:
+    bedrijfsstats = bedrijf_kpis[["bedrijf_id", "totaal_uren", "totalpayed", "geplande_omzet", "tarief_werkelijk", "tarief_gepland"]]
+    bedrijfsstats = bedrijfsstats.merge(df_companies[["id", "companyname"]], left_on="bedrijf_id", right_on="id", how="left")
+    bedrijfsstats = bedrijfsstats.drop(columns=["id"])
+    s["df"] = bedrijfsstats
 
 # --- KPI CARDS ---
-col1, col2, col3, col4 = st.columns(4)
+# Alles hierboven hangt af van bedrijfstype en periode en draait alleen bij een wijziging daarvan
+# opnieuw (de loads komen uit de gedeelde cache). De omzetkeuze en de bedrijfsselectie hieronder
+# zitten in eigen fragments: een klik daar draait alleen dat fragment opnieuw.
+col1, col2, col3 = st.columns(3)
 with col1:
     # Filter bedrijven op basis van gefilterde data
     bedrijven_in_periode = len(bedrijfsstats[bedrijfsstats["totaal_uren"] > 0])
@@ -492,33 +401,12 @@ with col2:
     projecten_in_periode = len(df_projectlines_filtered["offerprojectbase_id"].unique()) if not df_projectlines_filtered.empty else 0
     st.metric("📋 Opdrachten", projecten_in_periode)
 with col3:
-    if omzet_optie == "Werkelijke omzet (facturen)":
-        omzet = pd.to_numeric(bedrijfsstats["totalpayed"], errors="coerce").sum()
-        st.write(f"🔍 DEBUG: KPI berekening - omzet_optie: {omzet_optie}")
-        st.write(f"🔍 DEBUG: KPI berekening - bedrijfsstats totalpayed sum: {omzet}")
-        st.write(f"🔍 DEBUG: KPI berekening - bedrijfsstats records: {len(bedrijfsstats)}")
-        st.metric("💶 Totale Werkelijke Omzet", f"€ {omzet:,.0f}")
-    else:
-        omzet = pd.to_numeric(bedrijfsstats["geplande_omzet"], errors="coerce").sum()
-        st.write(f"🔍 DEBUG: KPI berekening - omzet_optie: {omzet_optie}")
-        st.write(f"🔍 DEBUG: KPI berekening - bedrijfsstats geplande_omzet sum: {omzet}")
-        st.metric("💶 Totale Geplande Omzet", f"€ {omzet:,.0f}")
-with col4:
     # Filter projectlines op basis van gefilterde projecten
     projectlines_in_periode = len(df_projectlines_filtered) if not df_projectlines_filtered.empty else 0
     st.metric("⏰ Projectregels", projectlines_in_periode)
 
 st.markdown("---")
 
-# Zet totaalomzet op basis van geselecteerde omzet_optie
-if omzet_optie == "Werkelijke omzet (facturen)":
-    bedrijfsstats["totaalomzet"] = bedrijfsstats["totalpayed"]
-else:
-    bedrijfsstats["totaalomzet"] = bedrijfsstats["geplande_omzet"]
-
-# Zorg dat totaalomzet numeriek is
-bedrijfsstats["totaalomzet"] = pd.to_numeric(bedrijfsstats["totaalomzet"], errors="coerce").fillna(0)
-
 # --- SIMPELE KPI'S & LEUKE INZICHTEN ---
 st.markdown("""
 <style>
@@ -537,11 +425,38 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-colA, colB = st.columns(2)
+@st.fragment
+def omzet_sectie(bedrijfsstats: pd.DataFrame):
+    """Omzet-KPI, tarieven, top/bottom 10 en whales; de omzetkeuze draait alleen dit fragment opnieuw."""
+    # --- OMZET RADIO KNOP ---
+    omzet_optie = st.radio(
+        "📊 Welke omzet wil je tonen?",
+        options=["Werkelijke omzet (facturen)", "Geplande omzet (offerte)"],
+        index=0,
+        horizontal=True,
+        key="omzet_optie",
+    )
+
+    stats = bedrijfsstats.copy()
+    # Zet totaalomzet en tarief op basis van geselecteerde omzet_optie
+    if omzet_optie == "Werkelijke omzet (facturen)":
+        stats["totaalomzet"] = stats["totalpayed"]
+        stats["tarief_per_uur"] = stats["tarief_werkelijk"]
+        omzet = pd.to_numeric(stats["totalpayed"], errors="coerce").sum()
+        st.metric("💶 Totale Werkelijke Omzet", f"€ {omzet:,.0f}")
+    else:
+        stats["totaalomzet"] = stats["geplande_omzet"]
+        stats["tarief_per_uur"] = stats["tarief_gepland"]
+        omzet = pd.to_numeric(stats["geplande_omzet"], errors="coerce").sum()
+        st.metric("💶 Totale Geplande Omzet", f"€ {omzet:,.0f}")
 
-# Hoogste tarief per uur (bedrijf)
-if isinstance(bedrijfsstats, pd.DataFrame) and "tarief_per_uur" in bedrijfsstats.columns:
-    df_tarief = bedrijfsstats[bedrijfsstats["tarief_per_uur"] > 0]
+    # Zorg dat totaalomzet numeriek is
+    stats["totaalomzet"] = pd.to_numeric(stats["totaalomzet"], errors="coerce").fillna(0)
+
+    colA, colB = st.columns(2)
+    df_tarief = stats[stats["tarief_per_uur"] > 0]
+
+    # Hoogste tarief per uur (bedrijf)
     if not df_tarief.empty:
         hoogste = df_tarief.sort_values(by="tarief_per_uur", ascending=False).iloc[0]  # type: ignore
         naam_hoog = str(hoogste["companyname"]) if pd.notna(hoogste["companyname"]) else "-"
@@ -549,12 +464,8 @@ if isinstance(bedrijfsstats, pd.DataFrame) and "tarief_per_uur" in bedrijfsstats
         colA.metric("Hoogste tarief per uur (bedrijf)", naam_hoog, f"€ {tarief_hoog:.2f}")
     else:
         colA.metric("Hoogste tarief per uur (bedrijf)", "-", "€ 0.00")
-else:
-    colA.metric("Hoogste tarief per uur (bedrijf)", "-", "€ 0.00")
 
-# Laagste tarief per uur (bedrijf)
-if isinstance(bedrijfsstats, pd.DataFrame) and "tarief_per_uur" in bedrijfsstats.columns:
-    df_tarief = bedrijfsstats[bedrijfsstats["tarief_per_uur"] > 0]
+    # Laagste tarief per uur (bedrijf)
     if not df_tarief.empty:
         laagste = df_tarief.sort_values(by="tarief_per_uur", ascending=True).iloc[0]  # type: ignore
         naam_laag = str(laagste["companyname"]) if pd.notna(laagste["companyname"]) else "-"
@@ -562,113 +473,101 @@ if isinstance(bedrijfsstats, pd.DataFrame) and "tarief_per_uur" in bedrijfsstats
         colB.metric("Laagste tarief per uur (bedrijf)", naam_laag, f"€ {tarief_laag:.2f}")
     else:
         colB.metric("Laagste tarief per uur (bedrijf)", "-", "€ 0.00")
-else:
-    colB.metric("Laagste tarief per uur (bedrijf)", "-", "€ 0.00")
-
-# --- BAR CHART ---
-st.subheader("📊 Tarief per uur per bedrijf")
-if not isinstance(bedrijfsstats, pd.DataFrame):
-    chart_data = pd.DataFrame(bedrijfsstats)
-else:
-    chart_data = bedrijfsstats.copy()
-assert isinstance(chart_data, pd.DataFrame), "chart_data moet een DataFrame zijn"
-chart_data = chart_data[chart_data["tarief_per_uur"] > 0].sort_values(by="tarief_per_uur", ascending=False)  # type: ignore
-fig = px.bar(
-    chart_data,
-    x="companyname",
-    y="tarief_per_uur",
-    labels={"companyname": "Bedrijf", "tarief_per_uur": "Tarief per uur"},
-    title="Tarief per uur per bedrijf",
-    height=400
-)
-fig.update_layout(xaxis_tickangle=-45, margin=dict(l=40, r=20, t=60, b=120))
-st.plotly_chart(fig, use_container_width=True)
-
-# --- TOP 5 & BOTTOM 5 ---
-st.markdown("### 🔝 Top 10 bedrijven – Hoog tarief per uur")
-top5 = chart_data.head(10)[["companyname", "tarief_per_uur"]].copy()
-top5["tarief_per_uur"] = pd.Series(top5["tarief_per_uur"]).apply(lambda x: f"€ {float(x):,.2f}")
-top5.columns = ["Bedrijfsnaam", "Tarief per Uur (€)"]
-st.dataframe(top5, use_container_width=True)
-
-st.markdown("### 📉 Bottom 10 bedrijven – Laag tarief per uur")
-bottom5 = chart_data.sort_values(by="tarief_per_uur").head(10)[["companyname", "tarief_per_uur"]].copy()
-bottom5["tarief_per_uur"] = pd.Series(bottom5["tarief_per_uur"]).apply(lambda x: f"€ {float(x):,.2f}")
-bottom5.columns = ["Bedrijfsnaam", "Tarief per Uur (€)"]
-st.dataframe(bottom5, use_container_width=True)
-
-# --- ZOEK & FACTUREN ---
-st.markdown("---")
-st.subheader("🔍 Selecteer een bedrijf voor details en facturen")
-bedrijf_opties = bedrijfsstats["companyname"].dropna().unique().tolist()
-bedrijf_naam_selectie = st.selectbox("Kies een bedrijf:", bedrijf_opties)
-bedrijf_id_selectie = bedrijfsstats.loc[bedrijfsstats["companyname"] == bedrijf_naam_selectie, "bedrijf_id"].iloc[0] if bedrijf_naam_selectie else None
-
-if bedrijf_naam_selectie:
-    st.write(f"🔍 DEBUG: Geselecteerd bedrijf: {bedrijf_naam_selectie}")
-    st.write(f"🔍 DEBUG: bedrijf_id_selectie: {bedrijf_id_selectie}")
-    
-    # Debug: toon alle bedrijfsstats voor dit bedrijf
-    bedrijf_stats = bedrijfsstats[bedrijfsstats["companyname"] == bedrijf_naam_selectie]
-    st.write(f"🔍 DEBUG: bedrijf_stats records: {len(bedrijf_stats)}")
-    if len(bedrijf_stats) > 0:
-        st.write(f"🔍 DEBUG: bedrijf_stats data: {bedrijf_stats.to_dict('records')}")
-    
-    display_df = bedrijfsstats[bedrijfsstats["companyname"] == bedrijf_naam_selectie][["bedrijf_id", "companyname", "totalpayed", "totaal_uren", "tarief_per_uur"]].copy()
-    assert isinstance(display_df, pd.DataFrame), "display_df moet een DataFrame zijn"
-    
-    st.write(f"🔍 DEBUG: display_df voor formatting: {display_df.to_dict('records')}")
-    
-    display_df = display_df.rename(columns={
-        "bedrijf_id": "Bedrijf ID",
-        "companyname": "Bedrijfsnaam",
-        "totalpayed": "Totaal Gefactureerd (€)",
-        "totaal_uren": "Totaal Uren",
-        "tarief_per_uur": "Tarief per Uur (€)"
-    })
-    display_df["Totaal Gefactureerd (€)"] = display_df["Totaal Gefactureerd (€)"].apply(lambda x: f"€ {float(x):,.2f}")
-    display_df["Tarief per Uur (€)"] = display_df["Tarief per Uur (€)"].apply(lambda x: f"€ {float(x):,.2f}")
-    st.dataframe(display_df, use_container_width=True)
-
-# --- FACTUREN PER BEDRIJF ---
-st.markdown("---")
-st.subheader("📄 Facturen van geselecteerd bedrijf")
-if bedrijf_naam_selectie and bedrijf_id_selectie is not None:
-    facturen_bedrijf = df_invoices[(df_invoices["company_id"] == bedrijf_id_selectie) & (df_invoices["status_searchname"] == "Verzonden")].copy()
-    if not facturen_bedrijf.empty:
-        facturen_bedrijf["totalpayed"] = pd.to_numeric(facturen_bedrijf["totalpayed"], errors="coerce")
-        display_columns = ["number", "reportdate_date", "status_searchname", "totalpayed", "subject"]
-        display_df = facturen_bedrijf[display_columns].copy()
-        assert isinstance(display_df, pd.DataFrame), "display_df moet een DataFrame zijn"
-        display_df.columns = ["Factuurnummer", "Datum", "Status", "Bedrag (€)", "Onderwerp"]
-        display_df["Bedrag (€)"] = display_df["Bedrag (€)"].apply(lambda x: f"€ {float(x):,.2f}" if pd.notna(x) else "€ 0.00")
-        st.dataframe(display_df, use_container_width=True)
-    else:
-        st.info(f"Geen facturen gevonden voor {bedrijf_naam_selectie}.")
 
-# --- FOOTER ---
+    # --- BAR CHART ---
+    st.subheader("📊 Tarief per uur per bedrijf")
+    chart_data = df_tarief.sort_values(by="tarief_per_uur", ascending=False)  # type: ignore
+    fig = px.bar(
+        chart_data,
+        x="companyname",
+        y="tarief_per_uur",
+        labels={"companyname": "Bedrijf", "tarief_per_uur": "Tarief per uur"},
+        title="Tarief per uur per bedrijf",
+        height=400
+    )
+    fig.update_layout(xaxis_tickangle=-45, margin=dict(l=40, r=20, t=60, b=120))
+    st.plotly_chart(fig, use_container_width=True)
 
+    # --- TOP 5 & BOTTOM 5 ---
+    st.markdown("### 🔝 Top 10 bedrijven – Hoog tarief per uur")
+    top5 = chart_data.head(10)[["companyname", "tarief_per_uur"]].copy()
+    top5["tarief_per_uur"] = pd.Series(top5["tarief_per_uur"]).apply(lambda x: f"€ {float(x):,.2f}")
+    top5.columns = ["Bedrijfsnaam", "Tarief per Uur (€)"]
+    st.dataframe(top5, use_container_width=True)
+
+    st.markdown("### 📉 Bottom 10 bedrijven – Laag tarief per uur")
+    bottom5 = chart_data.sort_values(by="tarief_per_uur").head(10)[["companyname", "tarief_per_uur"]].copy()
+    bottom5["tarief_per_uur"] = pd.Series(bottom5["tarief_per_uur"]).apply(lambda x: f"€ {float(x):,.2f}")
+    bottom5.columns = ["Bedrijfsnaam", "Tarief per Uur (€)"]
+    st.dataframe(bottom5, use_container_width=True)
+
+    # --- WHALES PIE CHART: OMZETVERDELING PER BEDRIJF ---
+    st.markdown("---")
+    st.subheader("🐋 Onze 'whales': bedrijven met het grootste deel van de omzet")
+    omzet_per_bedrijf = stats[["companyname", "totaalomzet"]].copy()
+    omzet_per_bedrijf = omzet_per_bedrijf.groupby("companyname", dropna=False)["totaalomzet"].sum().reset_index()
+    omzet_per_bedrijf = omzet_per_bedrijf.sort_values(by="totaalomzet", ascending=False)
+    top10 = omzet_per_bedrijf.head(10)
+    rest = pd.to_numeric(omzet_per_bedrijf[10:]["totaalomzet"], errors="coerce").sum()
+    labels = top10["companyname"].tolist()
+    values = top10["totaalomzet"].tolist()
+    if rest > 0:
+        labels.append("Overig")
+        values.append(rest)
+
+    fig_pie = go.Figure(data=[go.Pie(labels=labels, values=values, hole=0.4, textinfo='label+percent', hovertemplate='%{label}: €%{value:,.0f}<extra></extra>')])
+    fig_pie.update_layout(title="Omzetverdeling: top 10 bedrijven vs. rest", height=400, margin=dict(l=40, r=20, t=60, b=40))
+    st.plotly_chart(fig_pie, use_container_width=True)
+
+with stage("Omzet-sectie tekenen"):
+    omzet_sectie(bedrijfsstats)
+
+@st.fragment
+def factuur_drilldown(bedrijfsstats: pd.DataFrame, df_invoices: pd.DataFrame):
+    """Details en facturen van één bedrijf; een andere selectie draait alleen dit fragment opnieuw."""
+    # --- ZOEK & FACTUREN ---
+    st.markdown("---")
+    st.subheader("🔍 Selecteer een bedrijf voor details en facturen")
+    bedrijf_opties = bedrijfsstats["companyname"].dropna().unique().tolist()
+    bedrijf_naam_selectie = st.selectbox("Kies een bedrijf:", bedrijf_opties, key="factuur_bedrijf")
+    bedrijf_id_selectie = bedrijfsstats.loc[bedrijfsstats["companyname"] == bedrijf_naam_selectie, "bedrijf_id"].iloc[0] if bedrijf_naam_selectie else None
+
+    if bedrijf_naam_selectie:
+        bedrijf_stats = bedrijfsstats[bedrijfsstats["companyname"] == bedrijf_naam_selectie]
+
+        # Los van de omzetkeuze: beide tarieven naast elkaar, zodat dit fragment daar niet van afhangt
+        display_df = bedrijf_stats[["bedrijf_id", "companyname", "totalpayed", "totaal_uren", "tarief_werkelijk", "tarief_gepland"]].copy()
+        assert isinstance(display_df, pd.DataFrame), "display_df moet een DataFrame zijn"
 
+        display_df = display_df.rename(columns={
+            "bedrijf_id": "Bedrijf ID",
+            "companyname": "Bedrijfsnaam",
+            "totalpayed": "Totaal Gefactureerd (€)",
+            "totaal_uren": "Totaal Uren",
+            "tarief_werkelijk": "Tarief per Uur (€)",
+            "tarief_gepland": "Gepland Tarief per Uur (€)"
+        })
+        for kolom in ["Totaal Gefactureerd (€)", "Tarief per Uur (€)", "Gepland Tarief per Uur (€)"]:
+            display_df[kolom] = display_df[kolom].apply(lambda x: f"€ {float(x):,.2f}")
+        st.dataframe(display_df, use_container_width=True)
 
-# --- WHALES PIE CHART: OMZETVERDELING PER BEDRIJF ---
-st.markdown("---")
-st.subheader("🐋 Onze 'whales': bedrijven met het grootste deel van de omzet")
-omzet_per_bedrijf = bedrijfsstats[["companyname", "totaalomzet"]].copy()
-omzet_per_bedrijf = omzet_per_bedrijf.groupby("companyname", dropna=False)["totaalomzet"].sum().reset_index()
-omzet_per_bedrijf = omzet_per_bedrijf.sort_values(by="totaalomzet", ascending=False)
-top10 = omzet_per_bedrijf.head(10)
-rest = pd.to_numeric(omzet_per_bedrijf[10:]["totaalomzet"], errors="coerce").sum()
-labels = top10["companyname"].tolist()
-values = top10["totaalomzet"].tolist()
-if rest > 0:
-    labels.append("Overig")
-    values.append(rest)
-omzet_label = "Omzet (€)"
-y_col = "totaalomzet"
-
-fig_pie = go.Figure(data=[go.Pie(labels=labels, values=values, hole=0.4, textinfo='label+percent', hovertemplate='%{label}: €%{value:,.0f}<extra></extra>')])
-fig_pie.update_layout(title="Omzetverdeling: top 10 bedrijven vs. rest", height=400, margin=dict(l=40, r=20, t=60, b=40))
-st.plotly_chart(fig_pie, use_container_width=True)
+    # --- FACTUREN PER BEDRIJF ---
+    st.markdown("---")
+    st.subheader("📄 Facturen van geselecteerd bedrijf")
+    if bedrijf_naam_selectie and bedrijf_id_selectie is not None:
+        facturen_bedrijf = df_invoices[(df_invoices["company_id"] == bedrijf_id_selectie) & (df_invoices["status_searchname"] == "Verzonden")].copy()
+        if not facturen_bedrijf.empty:
+            display_columns = ["number", "reportdate_date", "status_searchname", "totalpayed", "subject"]
+            display_df = facturen_bedrijf[display_columns].copy()
+            assert isinstance(display_df, pd.DataFrame), "display_df moet een DataFrame zijn"
+            display_df.columns = ["Factuurnummer", "Datum", "Status", "Bedrag (€)", "Onderwerp"]
+            display_df["Bedrag (€)"] = display_df["Bedrag (€)"].apply(lambda x: f"€ {float(x):,.2f}" if pd.notna(x) else "€ 0.00")
+            st.dataframe(display_df, use_container_width=True)
+        else:
+            st.info(f"Geen facturen gevonden voor {bedrijf_naam_selectie}.")
+
+with stage("Factuur-drilldown tekenen"):
+    factuur_drilldown(bedrijfsstats, df_invoices)
 
 # --- BEDRIJVEN MET MEESTE UREN: BAR CHART ---
 st.markdown("---")
@@ -697,44 +596,46 @@ st.plotly_chart(fig_uren, use_container_width=True)
 # Gebruik projectlines amountwritten voor zowel geplande als werkelijk gewerkte uren
 # (in de toekomst kunnen we echte urenregistratie data toevoegen voor werkelijk gewerkte uren)
 
-# Bereken geplande uren per project uit projectlines (amountwritten)
-df_planned_uren = df_projectlines_filtered.groupby(
-    ["offerprojectbase_id", "bedrijf_id"], dropna=False
-).agg(
-    geplande_uren=("amountwritten", "sum")
-).reset_index()
-
-# Voor nu gebruiken we dezelfde data voor "werkelijk gewerkte uren" 
-# (in de toekomst kunnen we dit vervangen door echte urenregistratie data)
-df_werkelijk_uren = df_planned_uren.copy()
-df_werkelijk_uren.columns = ["offerprojectbase_id", "bedrijf_id", "geschreven_uren"]
-
-# Merge geplande en werkelijk gewerkte uren
-df_proj_agg = df_planned_uren.merge(df_werkelijk_uren, on=["offerprojectbase_id", "bedrijf_id"], how="outer")
-df_proj_agg["geplande_uren"] = df_proj_agg["geplande_uren"].fillna(0)
-df_proj_agg["geschreven_uren"] = df_proj_agg["geschreven_uren"].fillna(0)
-
-# Voeg projectnaam toe
-if "id" in df_projects_raw.columns and "name" in df_projects_raw.columns:
-    df_proj_agg = df_proj_agg.merge(
-        df_projects_raw[["id", "name"]], left_on="offerprojectbase_id", right_on="id", how="left"
-    )
+with stage("Overschrijdingen berekenen") as s:
+    # Bereken geplande uren per project uit projectlines (amountwritten)
+    df_planned_uren = df_projectlines_filtered.groupby(
+        ["offerprojectbase_id", "bedrijf_id"], dropna=False
+    ).agg(
+        geplande_uren=("amountwritten", "sum")
+    ).reset_index()
+
+    # Voor nu gebruiken we dezelfde data voor "werkelijk gewerkte uren"
+    # (in de toekomst kunnen we dit vervangen door echte urenregistratie data)
+    df_werkelijk_uren = df_planned_uren.copy()
+    df_werkelijk_uren.columns = ["offerprojectbase_id", "bedrijf_id", "geschreven_uren"]
+
+    # Merge geplande en werkelijk gewerkte uren
+    df_proj_agg = df_planned_uren.merge(df_werkelijk_uren, on=["offerprojectbase_id", "bedrijf_id"], how="outer")
+    df_proj_agg["geplande_uren"] = df_proj_agg["geplande_uren"].fillna(0)
+    df_proj_agg["geschreven_uren"] = df_proj_agg["geschreven_uren"].fillna(0)
+
+    # Voeg projectnaam toe
+    if "id" in df_projects_raw.columns and "name" in df_projects_raw.columns:
+        df_proj_agg = df_proj_agg.merge(
+            df_projects_raw[["id", "name"]], left_on="offerprojectbase_id", right_on="id", how="left"
+        )
 
-# Voeg bedrijfsnaam toe
-if "id" in df_companies.columns and "companyname" in df_companies.columns:
-    df_proj_agg = df_proj_agg.merge(
-        df_companies[["id", "companyname"]], left_on="bedrijf_id", right_on="id", how="left", suffixes=("", "_bedrijf")
-    )
+    # Voeg bedrijfsnaam toe
+    if "id" in df_companies.columns and "companyname" in df_companies.columns:
+        df_proj_agg = df_proj_agg.merge(
+            df_companies[["id", "companyname"]], left_on="bedrijf_id", right_on="id", how="left", suffixes=("", "_bedrijf")
+        )
 
-# Bereken overschrijding
-df_proj_agg["overschrijding_uren"] = df_proj_agg["geschreven_uren"] - df_proj_agg["geplande_uren"]
-df_proj_agg["overschrijding_pct"] = (
-    (df_proj_agg["overschrijding_uren"] / df_proj_agg["geplande_uren"].replace(0, pd.NA)) * 100
-).fillna(0)
+    # Bereken overschrijding
+    df_proj_agg["overschrijding_uren"] = df_proj_agg["geschreven_uren"] - df_proj_agg["geplande_uren"]
+    df_proj_agg["overschrijding_pct"] = (
+        (df_proj_agg["overschrijding_uren"] / df_proj_agg["geplande_uren"].replace(0, pd.NA)) * 100
+    ).fillna(0)
 
-# Filter alleen projecten met overschrijding
-df_overschrijding = df_proj_agg[df_proj_agg["overschrijding_uren"] > 0].copy()
-df_overschrijding = df_overschrijding.sort_values("overschrijding_uren", ascending=False)
+    # Filter alleen projecten met overschrijding
+    df_overschrijding = df_proj_agg[df_proj_agg["overschrijding_uren"] > 0].copy()
+    df_overschrijding = df_overschrijding.sort_values("overschrijding_uren", ascending=False)
+    s["df"] = df_overschrijding
 
 # Toon tabel
 st.markdown("### 🚨 Opdrachten met overschrijding van geplande uren")
@@ -763,3 +664,5 @@ st.markdown("""
     Dunion Dashboard © 2025
 </div>
 """, unsafe_allow_html=True)
+
+render_profiler()
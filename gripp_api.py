@@ -10,12 +10,24 @@ from dotenv import load_dotenv
 from typing import Callable
 from sqlalchemy import create_engine
 from sqlalchemy import text
-from sqlalchemy import inspect
-import tempfile
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.gripp_schema import flatten_gripp_frame, enforce_schema, add_row_hash, month_key, ROW_HASH_COLUMN
+from utils.pg_copy import encode_binary_copy
+from utils.migrations import (
+    migrate_table, analyze_tables, create_shadow_table, build_shadow_indexes, swap_shadow_table,
+    PARTITIONED_TABLES, ROLLUP_TABLES, is_partitioned, ensure_partitions,
+)
+from utils.data_versions import bump_versions
+from utils.company_tags import company_tag_frame, write_company_tags
+from utils.kpi_rollup import ROLLUP_SOURCES, rollups_exist, ensure_rollups, capture_changed_keys, refresh_changed_keys
 
 # === Configuratieparameters ===
 load_dotenv()
 FORCE_REFRESH = "--refresh" in sys.argv
+BINARY_COPY = "--csv-copy" not in sys.argv  # Binary COPY standaard; CSV als expliciete terugval
+FULL_REFRESH = "--full-refresh" in sys.argv  # Laden via schaduwtabel + atomaire swap i.p.v. merges
+LOAD_MAX_WORKERS = int(os.getenv("LOAD_MAX_WORKERS", "4"))  # Aantal tabellen dat tegelijk geschreven wordt
 MOCK_MODE = False  # Zet op False voor live API-verzoeken
 PROJECTLINES_CACHE_PATH = "data/projectlines_per_company.parquet"
 
@@ -33,9 +45,24 @@ MAX_CACHE_AGE_MINUTES = 30
 CACHE_DIR = "data"
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# Velden die company.get opvraagt (gedeeld met de Arrow-ingestie in gripp_arrow.py)
+COMPANY_FIELDS = [
+    "id", "companyname", "legalname", "customernumber", "email", "phone", "website",
+    "invoiceaddress_street", "tags", "invoiceaddress_streetnumber", "invoiceaddress_zipcode", "invoiceaddress_city",
+    "invoiceaddress_country", "vatnumber", "cocnumber",
+    "accountmanager", "createdon", "updatedon",
+    "visitingaddress_street", "visitingaddress_streetnumber", "visitingaddress_zipcode", "visitingaddress_city"
+]
+
 
 datasets = {}
 
+# Per-run cache van tabelmetadata (zie get_table_meta)
+_TABLE_META = {}
+
+# Gedeelde engine voor de database-fase (zie get_load_engine)
+_load_engine = None
+
 def filter_active_projects_only(projects_df: pd.DataFrame) -> pd.DataFrame:
     """Filtert alleen niet-gearchiveerde projecten (actief)."""
     return pd.DataFrame(projects_df[projects_df["archived"] == False].copy())
@@ -268,14 +295,9 @@ def filter_tasks(df: pd.DataFrame) -> pd.DataFrame:
     cols = [c for c in keep_cols if c in df.columns]
     return pd.DataFrame(df[cols].copy())
 
-def flatten_dict_column(df: pd.DataFrame) -> pd.DataFrame:
-    for col in df.columns:
-        is_dict_series = df[col].apply(lambda x: isinstance(x, dict))
-        if bool(is_dict_series.any()):
-            expanded = df[col].apply(pd.Series)
-            expanded.columns = [f"{col}_{subcol}" for subcol in expanded.columns]
-            df = df.drop(columns=[col]).join(expanded)
-    return pd.DataFrame(df)
+def flatten_dict_column(df: pd.DataFrame, method: str | None = None) -> pd.DataFrame:
+    """Flat alle dict-kolommen in één kolomsgewijze stap (zie utils/gripp_schema.py)."""
+    return flatten_gripp_frame(df, method)
 
 def is_cache_fresh():
     if not os.path.exists(CACHE_PATH):
@@ -432,13 +454,7 @@ def fetch_gripp_companies():
                     [],
                     {
                         "paging": {"firstresult": start, "maxresults": max_results},
-                        "fields": [
-                            "id", "companyname", "legalname", "customernumber", "email", "phone", "website",
-                            "invoiceaddress_street", "tags", "invoiceaddress_streetnumber", "invoiceaddress_zipcode", "invoiceaddress_city",
-                            "invoiceaddress_country", "vatnumber", "cocnumber",
-                            "accountmanager", "createdon", "updatedon",
-                            "visitingaddress_street", "visitingaddress_streetnumber", "visitingaddress_zipcode", "visitingaddress_city"
-                        ]
+                        "fields": COMPANY_FIELDS
                     }
                 ]
             }]
@@ -752,196 +768,285 @@ def safe_to_sql(df: pd.DataFrame, table_name: str):
             df = df.dropna(subset=["bedrijf_id"])
 
     print(f"🚀 Bulk insert '{table_name}' via staging COPY, rows: {df.shape[0]}")
-    
-    if not POSTGRES_URL:
-        raise ValueError("POSTGRES_URL is not set")
-    temp_engine = create_engine(f"{POSTGRES_URL}?options=-c statement_timeout=600000", pool_pre_ping=True, pool_recycle=300)
-    
-    # === FIX: Controleer of de doeltabel bestaat en maak deze aan indien nodig ===
-    with temp_engine.connect() as connection:
-        inspector = inspect(connection)
-        if not inspector.has_table(table_name):
-            print(f"⚠️ Hoofdtabel '{table_name}' bestaat niet. Deze wordt nu aangemaakt...")
-            # Maak de tabel aan op basis van de DataFrame-structuur (alleen de header)
-            df.head(0).to_sql(table_name, connection, if_exists='replace', index=False)
-            print(f"✅ Hoofdtabel '{table_name}' is aangemaakt.")
-            staging_table = f"{table_name}_staging"
-            print(f"⚠️ Staging table '{staging_table}' wordt ook aangemaakt omdat '{table_name}' nieuw is.")
-            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {staging_table} (LIKE {table_name} INCLUDING ALL);"))
-            print(f"✅ Staging table '{staging_table}' aangemaakt.")
-    # === EINDE FIX ===
-
-    # Voor grote datasets (>10.000 records): verwerk in batches
-    batch_size = 2000  # Verkleind van 5000 naar 2000 om timeouts te voorkomen
-    if len(df) > batch_size:
-        print(f"📦 Grote dataset gedetecteerd ({len(df)} records), verwerk in batches van {batch_size}")
-        
-        # Verwerk in batches
+
+    # Eén verbinding uit de gedeelde load-pool voor de hele tabel; elke batch is een eigen transactie
+    with get_load_engine().connect() as conn:
+        # Catalogus één keer per tabel per run; alle batches hergebruiken deze metadata
+        with conn.begin():
+            meta = get_table_meta(conn, table_name, df.head(0))
+        db_columns = meta["columns"]
+        if meta["merge"] in ("upsert", "delete_insert") or FULL_REFRESH:
+            df = add_row_hash(df)
+
+        # Kolommen één keer per tabel uitlijnen op de volgorde in de database
+        df = _align_columns(df, db_columns)
+
+        if meta["partition_key"]:
+            # Maandpartities voor alle datums in deze load vooraf aanmaken (één keer per tabel)
+            with conn.begin():
+                ensure_partitions(conn, table_name, month_key(df[meta["partition_key"]]).dropna().unique())
+
+        if FULL_REFRESH and meta["partition_key"]:
+            print(f"ℹ️ '{table_name}' is gepartitioneerd: alleen de geraakte partities worden bijgewerkt (geen schaduwtabel).")
+        elif FULL_REFRESH:
+            _load_full_refresh(conn, df, meta)
+            return len(df)
+
+        # Voor grote datasets: verwerk in batches
+        batch_size = 2000  # Verkleind van 5000 naar 2000 om timeouts te voorkomen
+        n_batches = (len(df) - 1) // batch_size + 1
+        if n_batches > 1:
+            print(f"📦 Grote dataset gedetecteerd ({len(df)} records), verwerk in batches van {batch_size}")
         for i in range(0, len(df), batch_size):
-            batch_df = df.iloc[i:i+batch_size].copy()  # Maak een echte kopie
-            print(f"📦 Verwerk batch {i//batch_size + 1}/{(len(df)-1)//batch_size + 1} ({len(batch_df)} records)")
-            _process_batch(batch_df, table_name, temp_engine)
-        
-        print(f"✅ '{table_name}' up-to-date met batch processing.")
-    else:
-        # Kleine dataset: verwerk in één keer
-        _process_batch(df, table_name, temp_engine)
-    
-    # Cleanup
-    temp_engine.dispose()
+            batch_df = df.iloc[i:i+batch_size]
+            if n_batches > 1:
+                print(f"📦 Verwerk batch {i//batch_size + 1}/{n_batches} ({len(batch_df)} records)")
+            _process_batch(conn, batch_df, meta)
+        if n_batches > 1:
+            print(f"✅ '{table_name}' up-to-date met batch processing.")
+    return len(df)
+
+
+def get_load_engine():
+    """Gedeelde engine voor de database-fase; de pool is groot genoeg voor LOAD_MAX_WORKERS parallelle tabellen."""
+    global _load_engine
+    if _load_engine is None:
+        if not POSTGRES_URL:
+            raise ValueError("POSTGRES_URL is not set")
+        _load_engine = create_engine(
+            f"{POSTGRES_URL}?options=-c statement_timeout=600000",
+            pool_pre_ping=True, pool_recycle=300, pool_size=LOAD_MAX_WORKERS, max_overflow=0,
+        )
+    return _load_engine
 
 
-def _process_batch(df: pd.DataFrame, table_name: str, temp_engine):
-    """Helper functie om een batch data te verwerken."""
-    # Forceer alle *_date kolommen naar datetime.date vóór export (geen string conversie)
-    for col in df.columns:
-        if col.endswith('_date') or col.endswith('on_date'):
-            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv') as tmp:
+def write_tables(jobs: dict):
+    """
+    Schrijft onafhankelijke tabellen ({tabelnaam: DataFrame}) parallel met begrensde concurrency
+    (LOAD_MAX_WORKERS) en rapporteert de doorvoer per tabel. De fase duurt zo lang als de traagste tabel.
+    """
+    def run(table_name, df):
+        start = pytime.perf_counter()
+        rows = safe_to_sql(df, table_name) or 0
+        if rows:
+            # Alleen na een geslaagde load: de dashboards verversen dan precies deze tabel(len)
+            with get_load_engine().begin() as conn:
+                bump_versions(conn, versioned_tables(conn, table_name))
+        return table_name, rows, pytime.perf_counter() - start
+
+    get_load_engine()  # Eén keer aanmaken vóór de threads starten
+    phase_start = pytime.perf_counter()
+    stats = []
+    with ThreadPoolExecutor(max_workers=LOAD_MAX_WORKERS) as executor:
+        futures = [executor.submit(run, name, df) for name, df in jobs.items() if df is not None]
+        for future in as_completed(futures):
+            table_name, rows, seconds = future.result()
+            stats.append((table_name, rows, seconds))
+            print(f"✅ Finished writing '{table_name}': {rows} rijen in {seconds:.1f}s ({rows / max(seconds, 1e-6):,.0f} rijen/s)")
+
+    # Planner-statistieken verversen voor de geladen tabellen; rollups aanmaken of na een
+    # volledige refresh (schaduwtabellen, geen merges) volledig opnieuw opbouwen
+    with get_load_engine().begin() as conn:
+        analyze_tables(conn, [name for name, rows, _ in stats if rows])
+        if ensure_rollups(conn, rebuild=FULL_REFRESH):
+            bump_versions(conn, ROLLUP_TABLES)
+
+    print(f"\n📊 Database-fase klaar in {pytime.perf_counter() - phase_start:.1f}s (som per tabel: {sum(s[2] for s in stats):.1f}s)")
+    for table_name, rows, seconds in sorted(stats, key=lambda s: -s[2]):
+        print(f"   {table_name:<26} {rows:>8} rijen  {seconds:6.1f}s  {rows / max(seconds, 1e-6):>10,.0f} rijen/s")
+    get_load_engine().dispose()
+
+
+def versioned_tables(conn, table_name: str) -> list:
+    """De tabel zelf plus de KPI-rollups die in dezelfde merges bijgewerkt worden."""
+    meta = _TABLE_META.get(table_name, {})
+    return [table_name, *ROLLUP_TABLES] if meta.get("rollup") else [table_name]
+
+
+def get_table_meta(conn, table_name: str, template: pd.DataFrame | None = None) -> dict:
+    """
+    Metadata van een doeltabel (kolommen, types, constraints, merge-strategie), één keer per run
+    uit de catalogus gehaald en daarna uit _TABLE_META geserveerd. Draait eerst de migratie van de
+    tabel; template is de lege DataFrame waarvan de structuur van nieuwe tabellen/kolommen komt.
+    """
+    if table_name in _TABLE_META:
+        return _TABLE_META[table_name]
+
+    # Per transactie een eigen TEMP staging table (zie _create_temp_staging)
+    staging_table = f"tmp_{table_name}_staging"
+    # DDL (PK, indexes, nieuwe kolommen) is van utils/migrations.py
+    migrate_table(conn, table_name, template)
+
+    # Check of er een primary key of unieke constraint is op de id kolom
+    result = conn.execute(text("""
+        SELECT COUNT(*)
+        FROM pg_constraint
+        WHERE conrelid = CAST(:table_name AS regclass)
+        AND contype IN ('p', 'u')
+        AND pg_get_constraintdef(oid) LIKE '%id%';
+    """), {"table_name": table_name})
+    has_unique_id = (result.scalar() or 0) > 0
+
+    # Tabellen met een unieke id en de expliciet genoemde feitentabellen worden geüpsert;
+    # gepartitioneerde tabellen hebben geen unieke id (de sleutel bevat de datum) en krijgen delete+insert
+    partition_key = PARTITIONED_TABLES.get(table_name) if is_partitioned(conn, table_name) else None
+    upsert = has_unique_id or table_name in ["invoices", "urenregistratie", "projectlines_per_company"]
+    merge = "delete_insert" if partition_key else "upsert" if upsert else "ignore"
+
+    result = conn.execute(text("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_name = :table_name
+        ORDER BY ordinal_position;
+    """), {"table_name": table_name})
+    column_types = {row[0]: row[1] for row in result}
+
+    meta = {
+        "table": table_name,
+        "staging_table": staging_table,
+        "columns": list(column_types),
+        "column_types": column_types,
+        "has_unique_id": has_unique_id,
+        "merge": merge,
+        "partition_key": partition_key,
+        # Incrementeel bijhouden zodra de rolluptabellen bestaan (eerste keer: volledig via write_tables)
+        "rollup": table_name in ROLLUP_SOURCES and rollups_exist(conn),
+    }
+    _TABLE_META[table_name] = meta
+    return meta
+
+
+def _align_columns(df: pd.DataFrame, db_columns: list) -> pd.DataFrame:
+    """Zet de DataFrame-kolommen in de volgorde van de database; ontbrekende kolommen worden None."""
+    if not db_columns:
+        return df
+    df = df.copy()
+    # Forced alignment: voeg ontbrekende db_columns toe als None (incl. bedrijf_id)
+    for col in db_columns:
+        if col not in df.columns:
+            df[col] = None
+    return df[db_columns]
+
+
+def _copy_source(df: pd.DataFrame, meta: dict, target: str):
+    """COPY-statement plus in-memory buffer voor df naar target: binary waar mogelijk, anders CSV."""
+    column_list = ", ".join(df.columns)
+    if BINARY_COPY and meta["column_types"]:
         try:
-            # ✅ Haal kolommen op uit staging table
-            with temp_engine.begin() as conn:
-                staging_table = f"{table_name}_staging"
-                
-                # Controleer of hoofdtabel bestaat
-                inspector = inspect(conn)
-                if not inspector.has_table(table_name):
-                    print(f"⚠️ Hoofdtabel '{table_name}' bestaat niet. Deze wordt nu aangemaakt...")
-                    # Maak de hoofdtabel aan op basis van de DataFrame-structuur
-                    df.head(0).to_sql(table_name, conn, if_exists='replace', index=False)
-                    print(f"✅ Hoofdtabel '{table_name}' is aangemaakt.")
-                
-                # Zorg dat staging table bestaat (LIKE main table)
-                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {staging_table} (LIKE {table_name} INCLUDING ALL);"))
-                try:
-                    result = conn.execute(text(f"""
-                        SELECT column_name
-                        FROM information_schema.columns
-                        WHERE table_name = '{staging_table}'
-                        ORDER BY ordinal_position;
-                    """))
-                    db_columns = [row[0] for row in result]
-                except Exception as e:
-                    print(f"⚠️ Timeout bij ophalen kolomnamen van {staging_table}, gebruik DataFrame-kolommen als fallback: {e}")
-                    db_columns = list(df.columns)
-
-            # Forced alignment: voeg ontbrekende db_columns toe als None
-            for col in db_columns:
-                if col not in df.columns:
-                    df[col] = None
-
-            # Veilige fallback: expliciet bedrijf_id vullen met None indien niet aanwezig
-            if "bedrijf_id" not in df.columns:
-                df.loc[:, "bedrijf_id"] = None
-
-            # Filter DataFrame kolommen en zorg voor juiste volgorde
-            # FIX: Zorg dat de kolommen in dezelfde volgorde staan als in de database
-            available_cols = [col for col in db_columns if col in df.columns]
-            filtered_df = df[available_cols].reindex(columns=available_cols)
-
-            # Export naar CSV met float_format om .0 te verwijderen
-            filtered_df.to_csv(tmp.name, index=False, header=True, float_format='%.0f')
-            tmp.flush()
-
-            # Nieuwe verbinding voor de COPY operatie
-            with temp_engine.begin() as conn:
-                # staging_table is al bepaald
-                with open(tmp.name, 'r') as f:
-                    conn.connection.cursor().copy_expert(f"COPY {staging_table} FROM STDIN WITH CSV HEADER", f)
-
-                # Check of er een unieke constraint is op de id kolom
-                has_unique_constraint = False
-                try:
-                    result = conn.execute(text(f"""
-                        SELECT COUNT(*) 
-                        FROM pg_constraint 
-                        WHERE conrelid = '{table_name}'::regclass 
-                        AND contype = 'u' 
-                        AND pg_get_constraintdef(oid) LIKE '%id%';
-                    """))
-                    constraint_count = result.scalar()
-                    has_unique_constraint = constraint_count is not None and constraint_count > 0
-                except:
-                    pass
-
-                if has_unique_constraint or table_name in ["invoices", "urenregistratie"]:
-                    # Gebruik ON CONFLICT als er een unieke constraint is of voor expliciet genoemde tabellen
-                    columns = [col for col in filtered_df.columns if col != "id"]
-                    set_clause = ", ".join([f"{col} = EXCLUDED.{col}" for col in columns])
-                    insert_cols = ", ".join(filtered_df.columns)
-                    select_cols = ", ".join(filtered_df.columns)
-                    
-                    merge_sql = f'''
+            # Binair formaat direct uit de getypeerde kolommen: geen tekstconversie, geen afronding
+            buffer = encode_binary_copy(df, meta["column_types"])
+            return f"COPY {target} ({column_list}) FROM STDIN WITH (FORMAT binary)", buffer
+        except ValueError as e:
+            print(f"⚠️ Binary COPY niet mogelijk voor '{meta['table']}', terugval op CSV: {e}")
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=True)
+    buffer.seek(0)
+    return f"COPY {target} ({column_list}) FROM STDIN WITH CSV HEADER", buffer
+
+
+def _load_full_refresh(conn, df: pd.DataFrame, meta: dict):
+    """
+    Volledige refresh: alles in één COPY naar een schaduwtabel, daarna PK/indexes bouwen,
+    ANALYZE en in één rename-transactie inwisselen. Geen per-batch merges; lezers zien nooit
+    een half geladen tabel.
+    """
+    table_name = meta["table"]
+    start = pytime.perf_counter()
+    with conn.begin():
+        shadow = create_shadow_table(conn, table_name)
+        copy_sql, buffer = _copy_source(df, meta, shadow)
+        conn.connection.cursor().copy_expert(copy_sql, buffer)
+    with conn.begin():
+        build_shadow_indexes(conn, table_name, shadow)
+        conn.execute(text(f"ANALYZE {shadow}"))
+    with conn.begin():
+        swap_shadow_table(conn, table_name, shadow)
+    print(f"🔁 '{table_name}' volledig ververst via schaduwtabel ({len(df)} rijen, {pytime.perf_counter() - start:.1f}s)")
+
+
+def _process_batch(conn, df: pd.DataFrame, meta: dict):
+    """COPY een batch via een in-memory buffer in staging en merge die in één transactie."""
+    # *_date kolommen zijn al bij ingestie eenmalig geparsed naar date32 (enforce_schema)
+    table_name, staging_table = meta["table"], meta["staging_table"]
+    copy_sql, buffer = _copy_source(df, meta, staging_table)
+    try:
+        with conn.begin():
+            _create_temp_staging(conn, meta)
+            conn.connection.cursor().copy_expert(copy_sql, buffer)
+
+            mode = _merge_staging(conn, meta, list(df.columns))
+            print(f"✅ '{table_name}' batch up-to-date met {mode}.")
+    except Exception as e:
+        print(f"❌ Fout bij uploaden van batch voor '{table_name}': {e}")
+        raise
+
+
+def _merge_staging(conn, meta: dict, columns: list) -> str:
+    """
+    Merge de staging table in de hoofdtabel en houdt de KPI-rollups bij voor de cellen die
+    de merge raakt (zelfde transactie); geeft de merge-strategie terug voor logging.
+    """
+    if not meta.get("rollup"):
+        return _merge_rows(conn, meta, columns)
+    capture_changed_keys(conn, meta, columns)
+    mode = _merge_rows(conn, meta, columns)
+    return f"{mode}, {refresh_changed_keys(conn)} bedrijven in KPI-rollups bijgewerkt"
+
+
+def _merge_rows(conn, meta: dict, columns: list) -> str:
+    """Merge de staging table in de hoofdtabel volgens de gecachte merge-strategie; geeft die terug voor logging."""
+    table_name, staging_table = meta["table"], meta["staging_table"]
+    insert_cols = ", ".join(columns)
+    if meta["merge"] == "delete_insert":
+        # Alleen gewijzigde rijen verwijderen (een rij kan van maand wisselen) en daarna alles
+        # zonder huidige versie invoegen; Postgres routeert de inserts naar de juiste partitie
+        hash_filter = (
+            f"AND {table_name}.{ROW_HASH_COLUMN} IS DISTINCT FROM s.{ROW_HASH_COLUMN}"
+            if ROW_HASH_COLUMN in columns else ""
+        )
+        conn.execute(text(f"DELETE FROM {table_name} USING {staging_table} s WHERE {table_name}.id = s.id {hash_filter};"))
+        result = conn.execute(text(f'''
 INSERT INTO {table_name} ({insert_cols})
-SELECT {select_cols} FROM {staging_table}
-ON CONFLICT (id) DO UPDATE SET {set_clause};
-'''
-                    conn.execute(text(merge_sql))
-                    print(f"✅ '{table_name}' batch up-to-date met ON CONFLICT merge.")
-                else:
-                    if table_name == "urenregistratie" or table_name == "invoices":
-                        # Direct COPY naar hoofdtabel zonder staging merge
-                        with open(tmp.name, 'r') as f:
-                            conn.connection.cursor().copy_expert(
-                                f"COPY {table_name} FROM STDIN WITH CSV HEADER", f
-                            )
-                        print(f"✅ '{table_name}' batch direct geCOPY'd zonder staging merge.")
-                    else:
-                        # Voor normale tabellen: gebruik INSERT IGNORE, behalve voor projectlines_per_company
-                        if table_name == "projectlines_per_company":
-                            # Voor projectlines: overschrijf bestaande rijen met nieuwe company info
-                            columns = [col for col in filtered_df.columns if col != "id"]
-                            set_clause = ", ".join([f"{col} = EXCLUDED.{col}" for col in columns])
-                            insert_cols = ", ".join(filtered_df.columns)
-                            select_cols = ", ".join(filtered_df.columns)
-                            insert_sql = f'''
+SELECT {insert_cols} FROM {staging_table} s
+WHERE NOT EXISTS (SELECT 1 FROM {table_name} t WHERE t.id = s.id);
+'''))
+        return f"delete+insert ({result.rowcount} rijen nieuw/gewijzigd)"
+    if meta["merge"] == "upsert":
+        # Bestaande rijen overschrijven (o.a. nieuwe company info bij projectlines)
+        set_clause = ", ".join([f"{col} = EXCLUDED.{col}" for col in columns if col != "id"])
+        # Alleen rijen waarvan de content-hash veranderd is worden herschreven
+        where_clause = (
+            f"WHERE {table_name}.{ROW_HASH_COLUMN} IS DISTINCT FROM EXCLUDED.{ROW_HASH_COLUMN}"
+            if ROW_HASH_COLUMN in columns else ""
+        )
+        result = conn.execute(text(f'''
 INSERT INTO {table_name} ({insert_cols})
-SELECT {select_cols} FROM {staging_table}
-ON CONFLICT (id) DO UPDATE SET {set_clause};
-'''
-                            conn.execute(text(insert_sql))
-                            print(f"✅ '{table_name}' batch up-to-date met ON CONFLICT UPDATE.")
-                        else:
-                            # Voor andere tabellen: gebruik INSERT IGNORE
-                            insert_cols = ", ".join(filtered_df.columns)
-                            select_cols = ", ".join(filtered_df.columns)
-                            insert_sql = f'''
+SELECT {insert_cols} FROM {staging_table}
+ON CONFLICT (id) DO UPDATE SET {set_clause}
+{where_clause};
+'''))
+        return f"ON CONFLICT merge ({result.rowcount} rijen nieuw/gewijzigd)"
+    conn.execute(text(f'''
 INSERT INTO {table_name} ({insert_cols})
-SELECT {select_cols} FROM {staging_table}
+SELECT {insert_cols} FROM {staging_table}
 ON CONFLICT DO NOTHING;
-'''
-                            conn.execute(text(insert_sql))
-                            print(f"✅ '{table_name}' batch up-to-date met INSERT IGNORE.")
-                
-                # Staging table legen na succesvolle merge
-                try:
-                    # Probeer eerst TRUNCATE met timeout
-                    conn.execute(text(f"SET statement_timeout = '30s'; TRUNCATE {staging_table};"))
-                    print(f"✅ Staging table '{staging_table}' geleegd.")
-                except Exception as e:
-                    print(f"⚠️ TRUNCATE faalde, probeer DELETE: {e}")
-                    try:
-                        # Fallback: DELETE met timeout
-                        conn.execute(text(f"SET statement_timeout = '30s'; DELETE FROM {staging_table};"))
-                        print(f"✅ Staging table '{staging_table}' geleegd via DELETE.")
-                    except Exception as e2:
-                        print(f"⚠️ Kon staging table niet legen (niet kritiek): {e2}")
-                        # Niet kritiek, staging wordt bij volgende run overschreven
-                
-        except Exception as e:
-            print(f"❌ Fout bij uploaden van batch voor '{table_name}': {e}")
-            raise
-        finally:
-            if os.path.exists(tmp.name):
-                os.unlink(tmp.name)
-
-def convert_date_columns(df):
-    for col in df.columns:
-        if col.endswith('_date') or col.endswith('on_date'):
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-            # Zet altijd om naar date (alleen de datum-component)
-            df[col] = df[col].dt.date
-    return df
+'''))
+    return "INSERT IGNORE"
+
+
+def _create_temp_staging(conn, meta: dict):
+    """
+    Sessie-lokale staging table die bij COMMIT/ROLLBACK verdwijnt: geen TRUNCATE achteraf,
+    geen WAL voor de staging-rijen en gelijktijdige loads van dezelfde tabel zitten elkaar niet in de weg.
+    """
+    conn.execute(text(
+        f"CREATE TEMP TABLE {meta['staging_table']} (LIKE {meta['table']} INCLUDING DEFAULTS) ON COMMIT DROP;"
+    ))
+
+
+def convert_date_columns(df, table_name: str = ""):
+    """Zet *_date kolommen om naar date32; kolommen die al getypeerd zijn worden niet opnieuw geparsed."""
+    return enforce_schema(df, table_name)
 
 def main():
     # Test PostgreSQL-verbinding
@@ -953,80 +1058,46 @@ def main():
         print("❌ Fout bij verbinden met Supabase PostgreSQL:", e)
 
     # Ophalen en sanitiseren van datasets (alle fetch en clean eerst, vóór verwerking)
-    projects_raw = fetch_gripp_projects()
-    # Flatten dict-kolommen in projects_raw
-    for col in projects_raw.columns:
-        if projects_raw[col].apply(lambda x: isinstance(x, dict)).any():
-            expanded = projects_raw[col].apply(pd.Series)
-            expanded.columns = [f"{col}_{subcol}" for subcol in expanded.columns]
-            projects_raw = projects_raw.drop(columns=[col]).join(expanded)
+    # Alle geneste Gripp-objecten worden in één kolomsgewijze stap geflat per endpoint-schema
+    projects_raw = flatten_gripp_frame(fetch_gripp_projects(), "project.get")
     print("[DEBUG] Eerste 3 projecten:")
     print(projects_raw.head(3).to_dict())
-    employees_raw = fetch_gripp_employees()
-    companies_raw = fetch_gripp_companies()
-    tasktypes_raw = fetch_gripp_tasktypes()
-    tasks_raw = fetch_gripp_tasks()  # <-- NIEUW
-    hours_raw = fetch_gripp_hours_data()
-
-    # === FIX: Flatten de 'task' kolom in urenregistratie ===
-    if 'task' in hours_raw.columns:
-        print("🔧 Flattening 'task' data in urenregistratie...")
-        hours_raw['task_id'] = hours_raw['task'].apply(
-            lambda x: x.get('id') if isinstance(x, dict) else None
-        )
-        hours_raw['task_searchname'] = hours_raw['task'].apply(
-            lambda x: x.get('searchname') if isinstance(x, dict) else None
-        )
-    invoices_raw = fetch_gripp_invoices()
-    # Forceer flatten voor alle kolommen die dicts kunnen bevatten
-    for col in invoices_raw.columns:
-        if invoices_raw[col].apply(lambda x: isinstance(x, dict)).any():
-            expanded = invoices_raw[col].apply(pd.Series)
-            expanded.columns = [f"{col}_{subcol}" for subcol in expanded.columns]
-            invoices_raw = invoices_raw.drop(columns=[col]).join(expanded)
-    # Kopieer date_date zoals voorheen
-    if not invoices_raw.empty and 'date' in invoices_raw.columns:
-        invoices_raw['date_date'] = invoices_raw['date']
-        invoices_raw['date_date'] = pd.to_datetime(invoices_raw['date_date'], errors='coerce').dt.date
-    #invoicelines_raw = fetch_gripp_invoicelines()
-
-    # Eerst datasets in dictionary plaatsen zodat fetch_gripp_projectlines er toegang toe heeft
-    # Flatten company data in projects voordat filtering
-    if not projects_raw.empty and 'company' in projects_raw.columns:
-        print("🔢 [DEBUG] Flattening company data in projects...")
-        projects_raw['company_id'] = projects_raw['company'].apply(
-            lambda x: x.get('id') if isinstance(x, dict) else x
-        )
-        projects_raw['company_searchname'] = projects_raw['company'].apply(
-            lambda x: x.get('searchname') if isinstance(x, dict) else x
-        )
+    employees_raw = flatten_gripp_frame(fetch_gripp_employees(), "employee.get")
+    companies_raw = flatten_gripp_frame(fetch_gripp_companies(), "company.get")
+    tasktypes_raw = flatten_gripp_frame(fetch_gripp_tasktypes(), "tasktype.get")
+    tasks_raw = flatten_gripp_frame(fetch_gripp_tasks(), "task.get")  # <-- NIEUW
+    hours_raw = flatten_gripp_frame(fetch_gripp_hours_data(), "hour.get")
+    invoices_raw = flatten_gripp_frame(fetch_gripp_invoices(), "invoice.get")
+    #invoicelines_raw = flatten_gripp_frame(fetch_gripp_invoicelines(), "invoiceline.get")
+
+    if not projects_raw.empty and 'company_id' in projects_raw.columns:
         print(f"🔢 [DEBUG] Sample company_id's: {projects_raw['company_id'].head(5).tolist()}")
         print(f"🔢 [DEBUG] Sample company_searchname's: {projects_raw['company_searchname'].head(5).tolist()}")
-    
-    datasets["gripp_projects"] = filter_projects(projects_raw)
-    datasets["gripp_employees"] = filter_employees(employees_raw)
-    datasets["gripp_companies"] = filter_companies(companies_raw)
-    datasets["gripp_tasktypes"] = filter_tasktypes(tasktypes_raw)
-    datasets["gripp_tasks"] = filter_tasks(tasks_raw) # <-- NIEUW
-    datasets["gripp_hours_data"] = filter_hours(hours_raw)
-    datasets["gripp_invoices"] = filter_invoices(invoices_raw)
+
+    # Eerst datasets in dictionary plaatsen zodat fetch_gripp_projectlines er toegang toe heeft
+    # Na filtering direct de compacte types uit het schema-register afdwingen
+    datasets["gripp_projects"] = enforce_schema(filter_projects(projects_raw), "projects")
+    datasets["gripp_employees"] = enforce_schema(filter_employees(employees_raw), "employees")
+    datasets["gripp_companies"] = enforce_schema(filter_companies(companies_raw), "companies")
+    # Tags genormaliseerd uit de gestructureerde lijst; filter_companies maakt er tekst van
+    datasets["gripp_company_tags"] = company_tag_frame(companies_raw)
+    datasets["gripp_tasktypes"] = enforce_schema(filter_tasktypes(tasktypes_raw), "tasktypes")
+    datasets["gripp_tasks"] = enforce_schema(filter_tasks(tasks_raw), "tasks") # <-- NIEUW
+    datasets["gripp_hours_data"] = enforce_schema(filter_hours(hours_raw), "urenregistratie")
+    datasets["gripp_invoices"] = enforce_schema(filter_invoices(invoices_raw), "invoices")
     
     # Nu projectlines ophalen (nadat projects beschikbaar zijn)
-    projectlines_raw = fetch_gripp_projectlines()
+    # unit, product, createdon, updatedon, amountwritten en offerprojectbase worden hier in één keer geflat
+    projectlines_raw = enforce_schema(
+        flatten_gripp_frame(fetch_gripp_projectlines(), "offerprojectline.get"), "projectlines_per_company"
+    )
     print(f"🔢 [DEBUG] Aantal projectlines direct uit API: {len(projectlines_raw)}")
     
     # Voeg bedrijfsinformatie toe aan projectlines
     if not projectlines_raw.empty:
         print(f"🔢 [DEBUG] Projectlines kolommen: {projectlines_raw.columns.tolist()}")
         
-        # Gebruik offerprojectbase kolom (bevat dictionaries met ID's)
-        if 'offerprojectbase' in projectlines_raw.columns:
-            print(f"🔢 [DEBUG] Sample offerprojectbase waarden: {projectlines_raw['offerprojectbase'].head(5).tolist()}")
-            
-            # Extraheer ID's uit de dictionaries
-            projectlines_raw['offerprojectbase_id'] = projectlines_raw['offerprojectbase'].apply(
-                lambda x: x.get('id') if isinstance(x, dict) else x
-            )
+        if 'offerprojectbase_id' in projectlines_raw.columns:
             print(f"🔢 [DEBUG] Sample offerprojectbase_id waarden: {projectlines_raw['offerprojectbase_id'].head(5).tolist()}")
             
             projectlines_raw = projectlines_raw.merge(
@@ -1048,107 +1119,38 @@ def main():
         else:
             print("⚠️ offerprojectbase kolom niet gevonden")
 
-    # === FIX: Flatten de 'unit' kolom in projectlines ===
-    if 'unit' in projectlines_raw.columns:
-        print("🔧 Flattening 'unit' data in projectlines...")
-        projectlines_raw['unit_id'] = projectlines_raw['unit'].apply(
-            lambda x: x.get('id') if isinstance(x, dict) else None
-        )
-        projectlines_raw['unit_searchname'] = projectlines_raw['unit'].apply(
-            lambda x: x.get('searchname') if isinstance(x, dict) else None
-        )
-
-    # === Toevoegen: Flatten de 'product' kolom in projectlines ===
-    if 'product' in projectlines_raw.columns:
-        print("🔧 Flattening 'product' data in projectlines...")
-        projectlines_raw['product_id'] = projectlines_raw['product'].apply(
-            lambda x: x.get('id') if isinstance(x, dict) else None
-        )
-        projectlines_raw['product_searchname'] = projectlines_raw['product'].apply(
-            lambda x: x.get('searchname') if isinstance(x, dict) else None
-        )
-    
-    # === FIX: Flatten de 'createdon' kolom in projectlines ===
-    if 'createdon' in projectlines_raw.columns:
-        print("🔧 Flattening 'createdon' data in projectlines...")
-        projectlines_raw['createdon_date'] = projectlines_raw['createdon'].apply(
-            lambda x: x.get('date') if isinstance(x, dict) else None
-        )
-        projectlines_raw['createdon_timezone_type'] = projectlines_raw['createdon'].apply(
-            lambda x: x.get('timezone_type') if isinstance(x, dict) else None
-        )
-        projectlines_raw['createdon_timezone'] = projectlines_raw['createdon'].apply(
-            lambda x: x.get('timezone') if isinstance(x, dict) else None
-        )
-    
-    # === FIX: Flatten de 'updatedon' kolom in projectlines ===
-    if 'updatedon' in projectlines_raw.columns:
-        print("🔧 Flattening 'updatedon' data in projectlines...")
-        projectlines_raw['updatedon_date'] = projectlines_raw['updatedon'].apply(
-            lambda x: x.get('date') if isinstance(x, dict) else None
-        )
-        projectlines_raw['updatedon_timezone_type'] = projectlines_raw['updatedon'].apply(
-            lambda x: x.get('timezone_type') if isinstance(x, dict) else None
-        )
-        projectlines_raw['updatedon_timezone'] = projectlines_raw['updatedon'].apply(
-            lambda x: x.get('timezone') if isinstance(x, dict) else None
-        )
-    
-    # === FIX: Flatten de 'amountwritten' kolom in projectlines ===
-    if 'amountwritten' in projectlines_raw.columns:
-        print("🔧 Flattening 'amountwritten' data in projectlines...")
-        projectlines_raw['amountwritten'] = projectlines_raw['amountwritten'].apply(
-            lambda x: x.get('value') if isinstance(x, dict) else x
-        )
-    
-    datasets["gripp_projectlines"] = projectlines_raw
+    # bedrijf_id komt pas na de merge binnen; opnieuw afdwingen is goedkoop voor al getypeerde kolommen
+    datasets["gripp_projectlines"] = enforce_schema(projectlines_raw, "projectlines_per_company")
     #datasets["gripp_invoicelines"] = filter_invoicelines(invoicelines_raw)
 
     # Gebruik direct de verrijkte projectlines uit de fetch
     combined_projectlines = datasets["gripp_projectlines"]
 
-    # Converteer date kolommen vóór database-write
+    # Date kolommen zijn al bij ingestie geparsed (enforce_schema)
+    jobs = {}
     if combined_projectlines is not None:
-        print("⏳ Writing 'projectlines_per_company' to the database...")
-        combined_projectlines = convert_date_columns(combined_projectlines)
         print(f"🔢 [DEBUG] Aantal projectlines die naar de database gaan: {len(combined_projectlines.drop_duplicates(subset='id'))}")
-        safe_to_sql(combined_projectlines.drop_duplicates(subset="id"), "projectlines_per_company")
-        print("✅ Finished writing 'projectlines_per_company'.")
+        jobs["projectlines_per_company"] = combined_projectlines.drop_duplicates(subset="id")
     if datasets.get("gripp_projects") is not None:
-        print("⏳ Writing 'projects' to the database...")
         cleaned_projects = datasets["gripp_projects"].drop_duplicates(subset="id")
         print("[DEBUG] Voor safe_to_sql: eerste 10 projecten met phase_searchname:")
         print(cleaned_projects[['id', 'name', 'phase_searchname']].head(10))
-        safe_to_sql(cleaned_projects, "projects")
-        print("✅ Finished writing 'projects'.")
+        jobs["projects"] = cleaned_projects
     if datasets.get("gripp_employees") is not None:
-        print("⏳ Writing 'employees' to the database...")
-        safe_to_sql(datasets["gripp_employees"].drop_duplicates(subset="id"), "employees")
-        print("✅ Finished writing 'employees'.")
+        jobs["employees"] = datasets["gripp_employees"].drop_duplicates(subset="id")
     if datasets.get("gripp_companies") is not None:
-        print("⏳ Writing 'companies' to the database...")
-        safe_to_sql(datasets["gripp_companies"].drop_duplicates(subset="id"), "companies")
-        print("✅ Finished writing 'companies'.")
+        jobs["companies"] = datasets["gripp_companies"].drop_duplicates(subset="id")
     if datasets.get("gripp_tasktypes") is not None:
-        print("⏳ Writing 'tasktypes' to the database...")
-        safe_to_sql(datasets["gripp_tasktypes"].drop_duplicates(subset="id"), "tasktypes")
-        print("✅ Finished writing 'tasktypes'.")
+        jobs["tasktypes"] = datasets["gripp_tasktypes"].drop_duplicates(subset="id")
     if datasets.get("gripp_tasks") is not None: # <-- NIEUW
-        print("⏳ Writing 'tasks' to the database...")
-        safe_to_sql(datasets["gripp_tasks"].drop_duplicates(subset="id"), "tasks") # <-- NIEUW
-        print("✅ Finished writing 'tasks'.")
+        jobs["tasks"] = datasets["gripp_tasks"].drop_duplicates(subset="id")
     if datasets.get("gripp_hours_data") is not None:
-        print("⏳ Writing 'urenregistratie' to the database...")
-        hours_data = convert_date_columns(datasets["gripp_hours_data"].drop_duplicates(subset="id"))
-        safe_to_sql(hours_data, "urenregistratie")
-        print("✅ Finished writing 'urenregistratie'.")
+        jobs["urenregistratie"] = datasets["gripp_hours_data"].drop_duplicates(subset="id")
     
     if datasets.get("gripp_invoices") is not None:
-        print("⏳ Writing 'invoices' to the database...")
         invoices_df = datasets["gripp_invoices"].drop_duplicates(subset="id").copy()
 
         # Zet geneste kolommen in JSON (veilige serialisatie)
-        import numpy as np
         json_cols = ["tags"]
         def safe_json_serialize(x):
             if isinstance(x, str):
@@ -1164,23 +1166,21 @@ def main():
         for col in json_cols:
             if col in invoices_df.columns:
                 invoices_df[col] = invoices_df[col].apply(safe_json_serialize)
-
-        # Gebruik safe_to_sql voor consistente verwerking
-        safe_to_sql(invoices_df, "invoices")
-        print("✅ Finished writing 'invoices'.")
+        jobs["invoices"] = invoices_df
     #if datasets.get("gripp_invoicelines") is not None:
-        #safe_to_sql(datasets["gripp_invoicelines"].drop_duplicates(subset="id"), "invoicelines")
+        #jobs["invoicelines"] = datasets["gripp_invoicelines"].drop_duplicates(subset="id")
 
-    # Debug: inspecteer de inhoud en het type van de kolom 'phase_id' en 'phase_searchname'
+    # De tabellen zijn onafhankelijk: parallel schrijven over één gedeelde pool
+    print(f"⏳ Writing {len(jobs)} tabellen naar de database (max {LOAD_MAX_WORKERS} tegelijk)...")
+    write_tables(jobs)
+    if "companies" in jobs:
+        with get_load_engine().begin() as conn:
+            write_company_tags(conn, datasets["gripp_company_tags"], jobs["companies"]["id"])
+        get_load_engine().dispose()
+
+    # Debug: inspecteer de inhoud van de kolom 'phase_id' en 'phase_searchname'
     print("[DEBUG] Eerste 10 waarden van 'phase_id' en 'phase_searchname':")
     print(projects_raw[['phase_id', 'phase_searchname']].head(10))
-    print("[DEBUG] Type-overzicht van 'phase_id':")
-    print(projects_raw['phase_id'].apply(type).value_counts())
-    # Verrijk projects_raw met phase_searchname (direct uit dict)
-    if (not projects_raw.empty) and ('phase' in projects_raw.columns):
-        projects_raw['phase_searchname'] = projects_raw['phase'].apply(
-            lambda x: x.get('searchname') if isinstance(x, dict) else None
-        )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,278 @@
+"""
+Arrow-native ingestie: Gripp JSON-pagina's -> Arrow-tabellen -> COPY ... FROM STDIN.
+
+Alternatief voor main() in gripp_api.py zonder pandas in het hete pad: pagina's worden
+direct Arrow-tabellen, geneste objecten worden kolomsgewijs uitgepakt en getypeerd via
+het schema-register, en de rijen worden als CSV-stroom in de staging table gezet.
+
+Gebruik: python gripp_arrow.py [--refresh]
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time as pytime
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from gripp_api import (
+    BASE_URL, HEADERS, CACHE_DIR, LOAD_MAX_WORKERS, MAX_CACHE_AGE_MINUTES, FORCE_REFRESH, COMPANY_FIELDS,
+    post_with_rate_limit_handling, get_load_engine, get_table_meta, versioned_tables, _merge_staging, _create_temp_staging,
+    filter_projects, filter_employees, filter_companies, filter_tasktypes, filter_tasks,
+    filter_hours, filter_invoices,
+)
+from utils.gripp_schema import GRIPP_ENDPOINTS, flatten_arrow_table, enforce_arrow_schema, add_row_hash_arrow
+from utils.migrations import analyze_tables, ensure_partitions, ROLLUP_TABLES
+from utils.data_versions import bump_versions
+from utils.kpi_rollup import ensure_rollups
+from utils.company_tags import write_company_tags
+
+# Rijen per CSV-chunk in de COPY-stroom
+COPY_CHUNK_ROWS = 2000
+
+# (tabel, methode, paginagrootte, watchdog, velden, filterfunctie) in dezelfde schrijfvolgorde als main()
+ARROW_TABLES = [
+    ("projects", "project.get", 100, 50, None, filter_projects),
+    ("employees", "employee.get", 250, 50, None, filter_employees),
+    ("companies", "company.get", 100, 50, COMPANY_FIELDS, filter_companies),
+    ("tasktypes", "tasktype.get", 100, 50, None, filter_tasktypes),
+    ("tasks", "task.get", 100, 1000, ["id", "type"], filter_tasks),
+    ("urenregistratie", "hour.get", 100, 50, None, filter_hours),
+    ("invoices", "invoice.get", 100, 50, None, filter_invoices),
+]
+
+
+def _page_to_table(rows: list, method: str) -> pa.Table:
+    # Velden die soms scalar en soms een object zijn (bv. amountwritten) eerst gelijktrekken
+    for col, key in GRIPP_ENDPOINTS.get(method, {}).get("scalar_key", {}).items():
+        for row in rows:
+            value = row.get(col)
+            if value is not None and not isinstance(value, dict):
+                row[col] = {key: value}
+    return pa.Table.from_pylist(rows)
+
+
+def fetch_gripp_arrow(method: str, max_results: int = 100, watchdog: int = 50, fields: list | None = None) -> pa.Table:
+    """Haalt alle pagina's van een Gripp-methode op als één Arrow-tabel (met parquet-cache)."""
+    cache_path = os.path.join(CACHE_DIR, f"{method.replace('.', '_')}.arrow.parquet")
+    if not FORCE_REFRESH and os.path.exists(cache_path):
+        modified = datetime.fromtimestamp(os.path.getmtime(cache_path))
+        if datetime.now() - modified < timedelta(minutes=MAX_CACHE_AGE_MINUTES):
+            return pq.read_table(cache_path)
+
+    pages = []
+    start = 0
+    while watchdog > 0:
+        options = {"paging": {"firstresult": start, "maxresults": max_results}}
+        if fields:
+            options["fields"] = fields
+        payload = [{"id": 1, "method": method, "params": [[], options]}]
+        pytime.sleep(0.1)
+        response = post_with_rate_limit_handling(BASE_URL, headers=HEADERS, json=payload)
+        response.raise_for_status()
+        result = response.json()[0].get("result", {})
+        rows = result.get("rows", [])
+        if rows:
+            pages.append(_page_to_table(rows, method))
+        if not result.get("more_items_in_collection", False):
+            break
+        start = result.get("next_start", start + max_results)
+        watchdog -= 1
+
+    if not pages:
+        return pa.table({})
+    # Pagina's kunnen verschillende typen afleiden (null vs struct, int vs float)
+    table = pa.concat_tables(pages, promote_options="permissive")
+    pq.write_table(table, cache_path)
+    print(f"📥 {method}: {table.num_rows} rijen opgehaald in {len(pages)} pagina's")
+    return table
+
+
+def _join_list_field(column: pa.ChunkedArray, field: str) -> pa.Array:
+    """Zet een list<struct> kolom om naar komma-gescheiden tekst van één subveld (zoals tag_ids/tag_names)."""
+    arr = column.combine_chunks()
+    if not pa.types.is_struct(arr.type.value_type):
+        return pa.nulls(len(arr), pa.string())
+    values = pc.cast(arr.values.field(field), pa.string())
+    as_lists = pa.ListArray.from_arrays(arr.offsets, values, mask=arr.is_null())
+    return pc.binary_join(as_lists, ",")
+
+
+def _drop_duplicate_ids(table: pa.Table) -> pa.Table:
+    """Arrow-variant van drop_duplicates(subset='id'): de eerste rij per id blijft staan."""
+    if "id" not in table.column_names:
+        return table
+    row_numbers = table.append_column("_row", pa.array(np.arange(table.num_rows)))
+    first = row_numbers.group_by("id", use_threads=False).aggregate([("_row", "min")])
+    return table.take(pa.array(np.sort(first.column("_row_min").to_numpy())))
+
+
+def prepare_arrow_table(raw: pa.Table, method: str, table_name: str, filter_fn) -> pa.Table:
+    """Flat, typeer en projecteer een ruwe Gripp-tabel naar de kolommen van de doeltabel."""
+    table = flatten_arrow_table(raw, method)
+    if table_name == "companies" and "tags" in table.column_names:
+        tags = table.column("tags")
+        table = table.append_column("tag_ids", _join_list_field(tags, "id"))
+        table = table.append_column("tag_names", _join_list_field(tags, "searchname"))
+    # De pandas-filters op een lege frame bepalen de kolomselectie; zo blijft er één definitie
+    keep = [c for c in filter_fn(table.slice(0, 0).to_pandas()).columns if c in table.column_names]
+    table = table.select(keep)
+    return _drop_duplicate_ids(enforce_arrow_schema(table, table_name))
+
+
+def prepare_company_tags(raw: pa.Table) -> pd.DataFrame:
+    """Eén rij per (bedrijf, tag) uit de list<struct> kolom tags, kolomsgewijs via de list-offsets."""
+    empty = pd.DataFrame(columns=["company_id", "tag_id", "tag_name"])
+    table = flatten_arrow_table(raw, "company.get")
+    if "tags" not in table.column_names or "id" not in table.column_names:
+        return empty
+    tags = table.column("tags").combine_chunks()
+    if not pa.types.is_struct(tags.type.value_type):
+        return empty
+    values = pc.list_flatten(tags)
+    frame = pa.table({
+        "company_id": pc.take(table.column("id"), pc.list_parent_indices(tags)),
+        "tag_id": pc.cast(values.field("id"), pa.int64()),
+        "tag_name": pc.cast(values.field("searchname"), pa.string()),
+    })
+    return frame.to_pandas().dropna().drop_duplicates(subset=["company_id", "tag_id"])
+
+
+def prepare_projectlines(projects: pa.Table) -> pa.Table:
+    """Projectlines met bedrijf_id/bedrijf_naam via een Arrow hash-join op de projecten."""
+    raw = fetch_gripp_arrow("offerprojectline.get", max_results=100, watchdog=200)
+    if raw.num_rows == 0:
+        return raw
+    lines = flatten_arrow_table(raw, "offerprojectline.get")
+    if "offerprojectbase_id" not in lines.column_names:
+        print("⚠️ offerprojectbase kolom niet gevonden")
+        return enforce_arrow_schema(lines, "projectlines_per_company")
+    idx = lines.column_names.index("offerprojectbase_id")
+    lines = lines.set_column(idx, "offerprojectbase_id", pc.cast(lines.column(idx), pa.int64()))
+    # Join vóór het categorie-typeren: Arrow-joins ondersteunen geen dictionary-kolommen
+    lookup = projects.select(["id", "company_id", "company_searchname"]).rename_columns(
+        ["offerprojectbase_id", "bedrijf_id", "bedrijf_naam"]
+    )
+    lines = lines.join(lookup, keys="offerprojectbase_id", join_type="left outer")
+    return _drop_duplicate_ids(enforce_arrow_schema(lines, "projectlines_per_company"))
+
+
+class _ArrowCsvStream:
+    """Bestand-achtig object dat een Arrow-tabel chunk voor chunk als CSV aan copy_expert levert."""
+
+    def __init__(self, table: pa.Table, chunk_rows: int = COPY_CHUNK_ROWS):
+        self._chunks = self._iter_csv(table, chunk_rows)
+        self._buffer = b""
+
+    @staticmethod
+    def _iter_csv(table: pa.Table, chunk_rows: int):
+        for i, batch in enumerate(table.to_batches(max_chunksize=chunk_rows)):
+            sink = pa.BufferOutputStream()
+            pacsv.write_csv(batch, sink, write_options=pacsv.WriteOptions(include_header=(i == 0)))
+            yield sink.getvalue().to_pybytes()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _align_to_db(table: pa.Table, db_types: dict) -> pa.Table:
+    """Projecteer op de databasekolommen en maak Arrow-typen COPY-vriendelijk."""
+    table = table.select([c for c in db_types if c in table.column_names])
+    nested = [f.name for f in table.schema if pa.types.is_nested(f.type)]
+    if nested:
+        print(f"⚠️ Kolommen {nested} kunnen niet via CSV worden geschreven en worden overgeslagen.")
+        table = table.drop_columns(nested)
+    for idx, name in enumerate(table.column_names):
+        column = table.column(idx)
+        if pa.types.is_dictionary(column.type):
+            column = pc.cast(column, pa.string())
+        elif pa.types.is_floating(column.type) and db_types[name] in ("bigint", "integer", "smallint"):
+            # Integer-kolommen (door to_sql aangemaakt) accepteren geen '12.0'
+            column = pc.cast(pc.round(column), pa.int64())
+        else:
+            continue
+        table = table.set_column(idx, name, column)
+    return table
+
+
+def _months(column: pa.ChunkedArray) -> list:
+    """Unieke 'YYYY-MM' waarden van een date32-kolom, voor het aanmaken van maandpartities."""
+    months = pc.unique(pc.strftime(pc.cast(column, pa.timestamp("s")), format="%Y-%m"))
+    return [m for m in months.to_pylist() if m is not None]
+
+
+def copy_arrow_table(table: pa.Table, table_name: str, load_engine):
+    """Streamt een Arrow-tabel via COPY in de staging table en merget die in de hoofdtabel."""
+    if table.num_rows == 0:
+        print(f"⚠️ Geen data om naar '{table_name}' te schrijven. Sla over.")
+        return
+    if "bedrijf_id" in table.column_names:
+        missing = table.filter(pc.is_null(table.column("bedrijf_id")))
+        if missing.num_rows:
+            print(f"⚠️ {missing.num_rows} rows missen 'bedrijf_id'. ID's: {missing.column('id').to_pylist()[:10]}...")
+            table = table.filter(pc.is_valid(table.column("bedrijf_id")))
+
+    with load_engine.begin() as conn:
+        meta = get_table_meta(conn, table_name, table.slice(0, 0).to_pandas())
+        staging_table = meta["staging_table"]
+        if meta["merge"] in ("upsert", "delete_insert"):
+            table = add_row_hash_arrow(table)
+        if meta["partition_key"] in table.column_names:
+            ensure_partitions(conn, table_name, _months(table.column(meta["partition_key"])))
+        table = _align_to_db(table, meta["column_types"])
+        columns = table.column_names
+        start = pytime.perf_counter()
+        _create_temp_staging(conn, meta)
+        conn.connection.cursor().copy_expert(
+            f"COPY {staging_table} ({', '.join(columns)}) FROM STDIN WITH CSV HEADER",
+            _ArrowCsvStream(table),
+        )
+        mode = _merge_staging(conn, meta, columns)
+        # Zelfde transactie: de NOTIFY gaat pas uit als de merge gecommit is
+        bump_versions(conn, versioned_tables(conn, table_name))
+    elapsed = pytime.perf_counter() - start
+    print(f"✅ '{table_name}': {table.num_rows} rijen via Arrow COPY + {mode} in {elapsed:.1f}s")
+
+
+def main_arrow():
+    tables = {}
+    company_tags = None
+    for table_name, method, max_results, watchdog, fields, filter_fn in ARROW_TABLES:
+        raw = fetch_gripp_arrow(method, max_results=max_results, watchdog=watchdog, fields=fields)
+        tables[table_name] = prepare_arrow_table(raw, method, table_name, filter_fn) if raw.num_rows else raw
+        if table_name == "companies" and raw.num_rows:
+            company_tags = prepare_company_tags(raw)
+    # De join heeft de getypeerde projecten nodig
+    if tables["projects"].num_rows:
+        tables = {"projectlines_per_company": prepare_projectlines(tables["projects"]), **tables}
+
+    # Onafhankelijke tabellen parallel over de gedeelde load-pool van gripp_api
+    load_engine = get_load_engine()
+    with ThreadPoolExecutor(max_workers=LOAD_MAX_WORKERS) as executor:
+        futures = [executor.submit(copy_arrow_table, table, name, load_engine) for name, table in tables.items()]
+        for future in as_completed(futures):
+            future.result()
+    with load_engine.begin() as conn:
+        analyze_tables(conn, [name for name, table in tables.items() if table.num_rows])
+        if ensure_rollups(conn):
+            bump_versions(conn, ROLLUP_TABLES)
+        if company_tags is not None:
+            write_company_tags(conn, company_tags, tables["companies"].column("id").to_pylist())
+    load_engine.dispose()
+
+
+if __name__ == "__main__":
+    main_arrow()
@@ -15,6 +15,9 @@ from dotenv import load_dotenv
 from utils.auth import require_login, require_email_whitelist
 from utils.allowed_emails import ALLOWED_EMAILS
 from utils.data_loaders import load_data, load_data_df
+from utils.kpi_engine import company_kpis
+from utils.company_tags import EIGEN_TAG, KLANT_TAG, company_ids_with_tag
+from utils.profiler import profiler_toggle, stage, render_profiler
 
 st.set_page_config(
     page_title="Customer-analysis",
@@ -36,6 +39,9 @@ if "access_token" in st.session_state:
 
 st.logo("images/dunion-logo-def_donker-06.png")
 
+# --- PROFILER (opt-in, zie utils/profiler.py) ---
+profiler_toggle("projectrendement")
+
 st.title("projectrendement")
 
 st.markdown("## 🔎 Filter bedrijven op type")
@@ -46,15 +52,9 @@ filter_keuze = st.radio(
     horizontal=True
 )
 
-def bedrijf_heeft_tag(tag_string, filter_primary_tag):
-    if not isinstance(tag_string, str):
-        return False
-    tags = [t.strip() for t in tag_string.split(",")]
-    return filter_primary_tag in tags
-
-# Tags logica
-eigen_tag = "1 | Eigen webshop(s) / bedrijven"
-klant_tag = "1 | Externe opdrachten / contracten"
+# Tags logica (tag -> bedrijf-id's uit company_tags, zie utils/company_tags.py)
+eigen_tag = EIGEN_TAG
+klant_tag = KLANT_TAG
 
 from sqlalchemy import create_engine
 from dotenv import load_dotenv
@@ -72,150 +72,48 @@ omzet_optie = st.radio("📊 Welke omzet wil je tonen?", options=["Werkelijke om
 # Alle projecten worden altijd getoond (gearchiveerd + niet gearchiveerd)
 toon_archived = "Ja, ook gearchiveerde projecten"
 
-# --- DATA EXACT ZOALS IN app.py ---
-df_projects_raw = load_data_df("projects", columns=["id", "company_id", "archived", "totalinclvat"])
-if not isinstance(df_projects_raw, pd.DataFrame):
-    df_projects_raw = pd.concat(list(df_projects_raw), ignore_index=True)
-# --- Geplande omzet per bedrijf toevoegen direct na conversie naar DataFrame
-df_projects_raw["totalinclvat"] = pd.to_numeric(df_projects_raw["totalinclvat"], errors="coerce").fillna(0)
-
-# === ARCHIVEER FILTERING OP PROJECTEN ===
-# Alle projecten worden altijd meegenomen (gearchiveerd + niet gearchiveerd)
-df_projects_filtered = df_projects_raw.copy()
-
-# Geplande omzet per bedrijf op basis van gefilterde projecten
-geplande_omzet_per_bedrijf = df_projects_filtered.groupby("company_id")["totalinclvat"].sum().reset_index()
-geplande_omzet_per_bedrijf.rename(columns={"company_id": "bedrijf_id", "totalinclvat": "geplande_omzet"}, inplace=True)
-df_companies = load_data_df("companies", columns=["id", "companyname", "tag_names"])
-if not isinstance(df_companies, pd.DataFrame):
-    df_companies = pd.concat(list(df_companies), ignore_index=True)
+with stage("Bedrijven laden") as s:
+    df_companies = load_data_df("companies", columns=["id", "companyname", "tag_names"])
+    if not isinstance(df_companies, pd.DataFrame):
+        df_companies = pd.concat(list(df_companies), ignore_index=True)
+    s["df"] = df_companies
 
 filter_primary_tag = None
-if filter_keuze == "Eigen bedrijven":
-    filter_primary_tag = eigen_tag
-    df_companies = df_companies[df_companies["tag_names"].apply(lambda x: bedrijf_heeft_tag(x, filter_primary_tag))]
-elif filter_keuze == "Klanten":
-    filter_primary_tag = klant_tag
-    df_companies = df_companies[df_companies["tag_names"].apply(lambda x: bedrijf_heeft_tag(x, filter_primary_tag))]
-# Bij 'Alle bedrijven' nemen we alle bedrijven met een tag
-elif filter_keuze == "Alle bedrijven":
-    df_companies = df_companies[df_companies["tag_names"].notnull()]
+with stage("Bedrijven filteren op tag") as s:
+    if filter_keuze == "Eigen bedrijven":
+        filter_primary_tag = eigen_tag
+        df_companies = df_companies[df_companies["id"].isin(company_ids_with_tag(filter_primary_tag))]
+    elif filter_keuze == "Klanten":
+        filter_primary_tag = klant_tag
+        df_companies = df_companies[df_companies["id"].isin(company_ids_with_tag(filter_primary_tag))]
+    # Bij 'Alle bedrijven' nemen we alle bedrijven met een tag
+    elif filter_keuze == "Alle bedrijven":
+        df_companies = df_companies[df_companies["tag_names"].notnull()]
+    s["df"] = df_companies
 
 bedrijf_ids = df_companies["id"].tolist()
 # Debug: Toon filtering resultaat
 st.info(f"✅ Filtering actief: {len(bedrijf_ids)} bedrijven geselecteerd na filtering op '{filter_keuze}'.")
-df_employees = load_data_df("employees", columns=["id", "firstname", "lastname"])
-if not isinstance(df_employees, pd.DataFrame):
-    df_employees = pd.concat(list(df_employees), ignore_index=True)
-# --- Projectlines laden ---
-df_projectlines = load_data_df("projectlines_per_company", columns=["id", "bedrijf_id", "amountwritten", "sellingprice", "amount", "unit_searchname", "hidefortimewriting", "offerprojectbase_id"])
-if not isinstance(df_projectlines, pd.DataFrame):
-    df_projectlines = pd.concat(list(df_projectlines), ignore_index=True)
-df_projectlines = df_projectlines[df_projectlines["bedrijf_id"].isin(bedrijf_ids)]
-
-# --- Filter projectlines op project_id's van zichtbare projecten ---
-project_ids = df_projects_filtered["id"].unique().tolist()
-if "offerprojectbase_id" in df_projectlines.columns:
-    df_projectlines = df_projectlines[df_projectlines["offerprojectbase_id"].isin(project_ids)].copy()
-# Filter alleen urenregels voor analyses van uren
-df_projectlines_uren = df_projectlines[
-    (df_projectlines["unit_searchname"].str.lower() == "uur") &
-    (df_projectlines["hidefortimewriting"] == False)
-].copy()
-# Laat alle regels staan voor omzetanalyses
-df_invoices = load_data_df("invoices", columns=["id", "company_id", "fase", "totalpayed", "status_searchname", "number", "date_date", "subject"])
-if not isinstance(df_invoices, pd.DataFrame):
-    df_invoices = pd.concat(list(df_invoices), ignore_index=True)
-df_invoices = df_invoices[df_invoices["company_id"].isin(bedrijf_ids)]
-
-# Kolomhernoemingen en numerieke conversies
-if 'bedrijf_id' not in df_projectlines.columns and 'company_id' in df_projectlines.columns:
-    df_projectlines = df_projectlines.rename(columns={'company_id': 'bedrijf_id'})
 if 'companyname' not in df_companies.columns and 'bedrijf_naam' in df_companies.columns:
     df_companies = df_companies.rename(columns={'bedrijf_naam': 'companyname'})
-for col in ["amountwritten", "sellingprice"]:
-    if col in df_projectlines.columns:
-        df_projectlines[col] = pd.to_numeric(df_projectlines[col], errors="coerce")
 
-#
-# Bereken totaal uren per bedrijf direct in SQL (zoals in app.py) maar gefilterd op uur
-# Alle uren worden altijd meegenomen (ook van gearchiveerde projecten)
-uren_per_bedrijf = load_data_df("projectlines_per_company", columns=["bedrijf_id", "SUM(CAST(amountwritten AS FLOAT)) as totaal_uren"], where="unit_searchname ILIKE 'uur'", group_by="bedrijf_id")
-uren_per_bedrijf.columns = ["bedrijf_id", "totaal_uren"]
-uren_per_bedrijf = uren_per_bedrijf[uren_per_bedrijf["bedrijf_id"].isin(bedrijf_ids)]
-
-# Bereken totaal gefactureerd per bedrijf direct in SQL
-# Neem alle invoices mee, niet alleen fase='Factuur'
-factuurbedrag_per_bedrijf = load_data_df("invoices", columns=["company_id", "SUM(CAST(totalpayed AS FLOAT)) as totalpayed"], group_by="company_id")
-factuurbedrag_per_bedrijf = factuurbedrag_per_bedrijf.rename(columns={"company_id": "bedrijf_id"})
-factuurbedrag_per_bedrijf = factuurbedrag_per_bedrijf[factuurbedrag_per_bedrijf["bedrijf_id"].isin(bedrijf_ids)]
-
-# Zorg dat beide DataFrames een kolom 'bedrijf_id' hebben vóór de merge
-if 'company_id' in uren_per_bedrijf.columns:
-    uren_per_bedrijf = uren_per_bedrijf.rename(columns={'company_id': 'bedrijf_id'})
-if 'company_id' in factuurbedrag_per_bedrijf.columns:
-    factuurbedrag_per_bedrijf = factuurbedrag_per_bedrijf.rename(columns={'company_id': 'bedrijf_id'})
-
- # Combineer stats per bedrijf
-bedrijfsstats = uren_per_bedrijf.merge(factuurbedrag_per_bedrijf, on="bedrijf_id", how="outer")
+# KPI's per bedrijf all-time uit de gedeelde KPI-engine (utils/kpi_engine.py), dezelfde als in app.py.
+# Alle uren ('uur', ook van gearchiveerde projecten), alle invoices (niet alleen fase='Factuur') en alle projecten;
+# gemiddeld_tarief en verwachte_opbrengst uit één scan van projectlines. Per dataversie gecachet.
+with stage("KPI's per bedrijf (KPI-engine)") as s:
+    bedrijfsstats = company_kpis(company_ids=bedrijf_ids)
+    s["df"] = bedrijfsstats
 bedrijfsstats = bedrijfsstats.merge(df_companies[["id", "companyname"]], left_on="bedrijf_id", right_on="id", how="left")
-bedrijfsstats = bedrijfsstats.drop(columns=[col for col in ['id'] if col in bedrijfsstats.columns])
-bedrijfsstats["totaal_uren"] = bedrijfsstats["totaal_uren"].fillna(0)
-bedrijfsstats["totalpayed"] = bedrijfsstats["totalpayed"].fillna(0)
-# Voeg geplande_omzet toe aan bedrijfsstats en vul NaN met 0
-bedrijfsstats = bedrijfsstats.merge(geplande_omzet_per_bedrijf, on="bedrijf_id", how="left")
-bedrijfsstats["geplande_omzet"] = bedrijfsstats["geplande_omzet"].fillna(0)
-# Zorg dat totalpayed en totaal_uren numeriek zijn vóór deling
-bedrijfsstats["totalpayed"] = pd.to_numeric(bedrijfsstats["totalpayed"], errors="coerce").fillna(0)
-bedrijfsstats["totaal_uren"] = pd.to_numeric(bedrijfsstats["totaal_uren"], errors="coerce").fillna(0)
-# Dynamische berekening tarief_per_uur op basis van omzet_optie
+bedrijfsstats = bedrijfsstats.drop(columns=["id"])
+# Tarief per uur op basis van omzet_optie
 if omzet_optie == "Werkelijke omzet (facturen)":
-    bedrijfsstats["tarief_per_uur"] = bedrijfsstats["totalpayed"].div(bedrijfsstats["totaal_uren"].replace(0, pd.NA)).fillna(0)
+    bedrijfsstats["tarief_per_uur"] = bedrijfsstats["tarief_werkelijk"]
 else:
-    bedrijfsstats["tarief_per_uur"] = bedrijfsstats["geplande_omzet"].div(bedrijfsstats["totaal_uren"].replace(0, pd.NA)).fillna(0)
-
-# --- Pas filtering toe op bedrijfsstats direct na merge ---
-bedrijfsstats = bedrijfsstats[bedrijfsstats["bedrijf_id"].isin(bedrijf_ids)].copy()
-
-#
-# Bereken gemiddeld tarief per klant (bedrijf) -- alleen op urenregels
-df_projectlines_uren["sellingprice"] = pd.to_numeric(df_projectlines_uren["sellingprice"], errors="coerce")
-df_projectlines_uren = df_projectlines_uren[df_projectlines_uren["sellingprice"].notna()]
-gemiddeld_tarief_per_klant = df_projectlines_uren.groupby('bedrijf_id')["sellingprice"].mean().reset_index()
-gemiddeld_tarief_per_klant.columns = ["bedrijf_id", "gemiddeld_tarief"]
-bedrijfsstats = bedrijfsstats.merge(gemiddeld_tarief_per_klant, on="bedrijf_id", how="left")
-
-# Nu kun je bedrijfsstats gebruiken voor verdere analyses en visualisaties, net als in app.py
-# De rest van de analyses en visualisaties kun je nu baseren op bedrijfsstats
-# ... bestaande analyses en visualisaties ...
+    bedrijfsstats["tarief_per_uur"] = bedrijfsstats["tarief_gepland"]
 
 # Filter bedrijven met daadwerkelijk gewerkte uren
 bedrijfsstats = bedrijfsstats[bedrijfsstats["totaal_uren"] > 0].copy()
 
-# === Alleen uren van projectonderdelen met unit_searchname == 'uur' ===
-df_projectlines_unit = load_data_df("projectlines_per_company", columns=["id", "bedrijf_id", "amountwritten", "unit_searchname"])
-if not isinstance(df_projectlines_unit, pd.DataFrame):
-    df_projectlines_unit = pd.concat(list(df_projectlines_unit), ignore_index=True)
-df_projectlines_unit = df_projectlines_unit[df_projectlines_unit["bedrijf_id"].isin(bedrijf_ids)]
-df_projectlines_uur = df_projectlines_unit[df_projectlines_unit["unit_searchname"].str.lower() == "uur"].copy()
-uren_per_bedrijf_uur = df_projectlines_uur.groupby("bedrijf_id")["amountwritten"].sum().reset_index()
-uren_per_bedrijf_uur.columns = ["bedrijf_id", "totaal_uren_uur"]
-
-# Merge deze gefilterde uren met bedrijfsstats
-bedrijfsstats = bedrijfsstats.merge(uren_per_bedrijf_uur, on="bedrijf_id", how="left")
-
-# Bereken rendement per uur per bedrijf (voor backward compatibility, maar niet meer gebruiken)
-bedrijfsstats["rendement_per_uur"] = (
-    bedrijfsstats["totalpayed"] / bedrijfsstats["totaal_uren"]
-).round(2)
-
-
-
-# Voeg werkelijke omzet toe aan projects via een merge
-df_projects_filtered = df_projects_filtered.merge(bedrijfsstats, left_on="company_id", right_on="bedrijf_id", how="left")
-df_projects_filtered["werkelijke_opbrengst"] = df_projects_filtered["totalpayed"].fillna(0)
-df_projects_filtered["totaal_uren"] = df_projects_filtered["totaal_uren"].fillna(0)
-
 
 # Sorteer en filter op tarief_per_uur, hoogste eerst, filter 0 en NaN
 df_rend = bedrijfsstats.copy()
@@ -361,27 +259,8 @@ st.plotly_chart(fig_treemap, use_container_width=True)
 
 # === Extra inzichten: Percentage tijdsbesteding en ROI-ratio ===
 
-# 1. Percentage tijdsbesteding per bedrijf
+# % tijdsbesteding, verwachte opbrengst (sellingprice * amount) en realisatie-marge komen uit de KPI-engine
 totale_uren_all = bedrijfsstats["totaal_uren"].sum()
-bedrijfsstats["% tijdsbesteding"] = (bedrijfsstats["totaal_uren"] / totale_uren_all * 100).round(1)
-
-#
-#
-# 2. Verwachte opbrengst berekenen: kostprijs * amount
-# Gebruik df_projectlines (alle regels) voor omzetanalyses
-df_projectlines["sellingprice"] = pd.to_numeric(df_projectlines["sellingprice"], errors="coerce")
-df_projectlines["amount"] = pd.to_numeric(df_projectlines["amount"], errors="coerce")
-df_projectlines["verwachte_opbrengst"] = df_projectlines["sellingprice"] * df_projectlines["amount"]
-
-verwachte_opbrengst_per_bedrijf = df_projectlines.groupby("bedrijf_id")["verwachte_opbrengst"].sum().reset_index()  # type: ignore
-verwachte_opbrengst_per_bedrijf.columns = ["bedrijf_id", "verwachte_opbrengst"]
-
-bedrijfsstats = bedrijfsstats.merge(verwachte_opbrengst_per_bedrijf, on="bedrijf_id", how="left").copy()
-
- # Verbeterde realisatie-marge berekening
-bedrijfsstats["realisatie_marge"] = (
-    (bedrijfsstats["totalpayed"] - bedrijfsstats["verwachte_opbrengst"]) / bedrijfsstats["verwachte_opbrengst"]
-).round(2)
 
 # Filter: enkel bedrijven met valide verwachte_opbrengst > 0
 bedrijfsstats = bedrijfsstats[
@@ -616,6 +495,8 @@ if st.button("Genereer AI-advies"):
     advies_output = genereer_advies(advies_prompt)
     st.info(advies_output)
 
+render_profiler()
+
 st.markdown("""
 <hr style="margin-top: 2em; margin-bottom: 0.5em; border: none; border-top: 1px solid #eee;" />
 <div style="text-align: center; color: #888; font-size: 1em; margin-bottom: 0.5em;">
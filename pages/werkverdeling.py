@@ -8,6 +8,12 @@ from utils.auth import require_login, require_email_whitelist
 from utils.allowed_emails import ALLOWED_EMAILS
 from datetime import datetime, timedelta, date
 import ast
+from utils.gripp_live import fetch_live_hours
+from utils.gripp_schema import enforce_schema, month_key
+from utils.data_loaders import build_query
+from utils.result_cache import arrow_cache
+from utils.data_versions import current_versions
+from utils.profiler import profiler_toggle, stage, render_profiler
 
 # --- 1. PAGE CONFIG & AUTHENTICATION ---
 st.set_page_config(
@@ -27,6 +33,9 @@ if "access_token" in st.session_state:
         st.rerun()
 st.logo("images/dunion-logo-def_donker-06.png")
 
+# --- PROFILER (opt-in, zie utils/profiler.py) ---
+profiler_toggle("werkverdeling")
+
 # --- 2. DATABASE CONNECTION & BASE DATA LOADING ---
 @st.cache_resource
 def get_engine():
@@ -40,8 +49,10 @@ def get_engine():
 
 
 # --- Base Data Loading ---
-@st.cache_data(ttl=3600)
-def load_base_data():
+# Geen TTL: de dataversies (utils/data_versions.py) zitten in de cachesleutel, dus de cache
+# blijft geldig tot de loader deze tabellen echt bijwerkt
+@st.cache_data
+def load_base_data(versions):
     df_employees = pd.read_sql("SELECT id, firstname, lastname FROM employees", engine)
     df_employees['fullname'] = df_employees['firstname'] + ' ' + df_employees['lastname']
     df_companies = pd.read_sql("SELECT id, companyname FROM companies", engine)
@@ -49,56 +60,70 @@ def load_base_data():
     return df_employees, df_companies, df_tasktypes
 
 engine = get_engine()
-df_employees, df_companies, df_tasktypes = load_base_data()
+with stage("Medewerkers, bedrijven en taaktypes laden") as s:
+    df_employees, df_companies, df_tasktypes = load_base_data(current_versions(["employees", "companies", "tasktypes"]))
+    s["df"] = df_employees
 
-@st.cache_data(ttl=300)
+@arrow_cache(tables=["urenregistratie", "projects"])
 def load_filtered_data(project_ids, start_date, end_date):
     """
-    Loads all necessary data in a memory-efficient way based on the user's filter selection.
+    Loads the hour registrations from the warehouse based on the user's filter selection.
     This is the core data loading function for the page.
     """
     if not project_ids:
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        return pd.DataFrame()
 
-    # Define filters
-    date_filter = f"u.date_date BETWEEN '{start_date.strftime('%Y-%m-%d')}' AND '{end_date.strftime('%Y-%m-%d')}'"
+    # Define filters (bind-parameters; projecten als één array-parameter)
+    filters = {"status_searchname": "Gefiatteerd"}
     # Handle the 'all projects' case
-    if len(project_ids) == pd.read_sql("SELECT COUNT(DISTINCT id) FROM projects WHERE archived = FALSE", engine).iloc[0,0]:
-         project_filter = "1=1"
-    else:
-        project_filter = f"u.offerprojectbase_id IN ({','.join(map(str, project_ids))})"
-
-    # 1. Get all relevant hour registrations and IDs from the fact table
-    main_query = f"""
-    SELECT
-        u.employee_id,
-        u.task_id,
-        u.offerprojectbase_id,
-        u.amount,
-        u.date_date,
-        u.description
-    FROM urenregistratie u
-    WHERE u.status_searchname = 'Gefiatteerd' AND {project_filter} AND {date_filter}
+    if len(project_ids) != pd.read_sql("SELECT COUNT(DISTINCT id) FROM projects WHERE archived = FALSE", engine).iloc[0,0]:
+        filters["offerprojectbase_id"] = list(project_ids)
+
+    # Get all relevant hour registrations and IDs from the fact table
+    main_query = build_query(
+        "urenregistratie",
+        columns=["id", "employee_id", "task_id", "offerprojectbase_id", "amount", "date_date", "description"],
+        filters=filters,
+        date_range={"date_date": (start_date, end_date)},
+    )
+    return enforce_schema(pd.read_sql(main_query, engine), "urenregistratie")
+
+
+@st.cache_data(ttl=60)
+def load_live_hours(project_ids, day):
+    """
+    Fetches only today's hour registrations straight from Gripp (small, filtered call).
+    Errors are raised, not returned: st.cache_data does not cache exceptions, so a failed
+    fetch is retried on the next run instead of showing an empty result for 60 seconds.
     """
-    df_uren_base = pd.read_sql(main_query, engine)
+    return fetch_live_hours(list(project_ids), day)
 
-    if df_uren_base.empty:
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
-    # 2. Get the unique dimension IDs from our base data
-    relevant_employee_ids = df_uren_base['employee_id'].dropna().unique()
-    relevant_task_ids = df_uren_base['task_id'].dropna().unique()
-    relevant_project_ids = df_uren_base['offerprojectbase_id'].dropna().unique()
+def merge_live_hours(df_uren_base, df_live):
+    """
+    Unions the warehouse hours with today's live rows; live rows win on duplicate ids.
+    The warehouse rows are all 'Gefiatteerd'; status_searchname is kept so the unapproved
+    live hours can be shown separately.
+    """
+    if df_live.empty:
+        return df_uren_base
+    df_uren_base = df_uren_base.assign(status_searchname="Gefiatteerd")
+    df_live = df_live[df_uren_base.columns.intersection(df_live.columns)]
+    combined = pd.concat([df_uren_base, df_live], ignore_index=True)
+    return combined.drop_duplicates(subset="id", keep="last").reset_index(drop=True)
+
 
-    # 3. Use cached base data for employees, companies, and tasktypes
+@st.cache_data
+def load_dimensions(employee_ids, task_ids, project_ids, versions):
+    """Loads the employee, project and task dimensions for the given IDs."""
     # Employees, companies, and tasktypes are already loaded and cached
     # Only filter employees to relevant ones
-    df_employees_filtered = df_employees[df_employees['id'].isin(relevant_employee_ids)].copy()
+    df_employees_filtered = df_employees[df_employees['id'].isin(employee_ids)].copy()
 
-    df_projects_raw = pd.read_sql(f"SELECT id, name, company_id FROM projects WHERE id IN ({','.join(map(str, relevant_project_ids))})", engine)
+    df_projects_raw = pd.read_sql(build_query("projects", columns=["id", "name", "company_id"], filters={"id": list(project_ids)}), engine)
     df_projects = df_projects_raw.merge(df_companies, left_on='company_id', right_on='id', how='left').rename(columns={'id_x': 'project_id'})
 
-    df_tasks_raw = pd.read_sql(f"SELECT id, type FROM tasks WHERE id IN ({','.join(map(str, relevant_task_ids))})", engine)
+    df_tasks_raw = pd.read_sql(build_query("tasks", columns=["id", "type"], filters={"id": list(task_ids)}), engine)
     def extract_tasktype_id(type_data):
         if pd.isna(type_data) or not isinstance(type_data, str): return None
         try: return ast.literal_eval(type_data).get('id')
@@ -109,7 +134,7 @@ def load_filtered_data(project_ids, start_date, end_date):
     df_tasks['tasktype_id'] = pd.to_numeric(df_tasks['tasktype_id'], downcast='integer', errors='coerce')
     df_tasks = df_tasks.merge(df_tasktypes, left_on='tasktype_id', right_on='id', how='left').rename(columns={'id_x': 'task_id', 'searchname': 'task_name'})
 
-    return df_uren_base, df_employees_filtered, df_projects, df_tasks
+    return df_employees_filtered, df_projects, df_tasks
 
 # --- Load the data ---
 # df_employees, df_projects, df_tasks = load_base_data() # This line is removed
@@ -163,8 +188,17 @@ with st.container(border=True):
         )
         st.caption("Periode aanpassen via het hoofd-dashboard.")
 
+        live_mode = st.toggle(
+            "⚡ Live uren van vandaag",
+            key="werkverdeling_live_mode",
+            help="Haalt de urenregels van vandaag direct uit Gripp op (ook nog niet gefiatteerde uren), zonder de database te verversen."
+        )
+
     with filter_col2:
-        project_options = pd.read_sql("SELECT id, name FROM projects WHERE archived = FALSE", engine).sort_values('name').to_dict('records')
+        with stage("Projectopties laden") as s:
+            df_project_options = pd.read_sql("SELECT id, name FROM projects WHERE archived = FALSE", engine)
+            s["df"] = df_project_options
+        project_options = df_project_options.sort_values('name').to_dict('records')
         project_id_to_obj = {p['id']: p for p in project_options}
         all_project_ids = [p['id'] for p in project_options]
 
@@ -216,13 +250,47 @@ with st.container(border=True):
 # Separate block for dynamic content
 if project_ids:
     # --- Nieuwe, efficiënte datalaadstrategie ---
-    df_uren, df_employees, df_projects_filtered, df_tasks = load_filtered_data(project_ids, start_date, end_date)
+    with stage("Urenregistraties laden") as s:
+        df_uren = load_filtered_data(project_ids, start_date, end_date)
+        s["df"] = df_uren
+
+    # Live modus: vul de warehouse-data aan met de uren van vandaag uit Gripp
+    today = date.today()
+    if live_mode and start_date.date() <= today <= end_date.date():
+        with stage("Live uren ophalen (Gripp)") as s:
+            try:
+                df_live = load_live_hours(tuple(sorted(project_ids)), today)
+            except Exception as e:
+                st.warning(f"⚠️ Live uren konden niet worden opgehaald: {e}")
+                df_live = pd.DataFrame()
+            df_uren = merge_live_hours(df_uren, df_live)
+            s["df"] = df_live
+        if not df_live.empty:
+            st.caption(f"⚡ Live modus: {len(df_live)} urenregels van vandaag direct uit Gripp toegevoegd.")
+    elif live_mode:
+        st.caption("⚡ Live modus heeft geen effect: vandaag valt buiten de analyseperiode.")
+
     if df_uren.empty:
         st.warning("Geen urenregistraties gevonden voor de geselecteerde criteria.")
+        render_profiler()
         st.stop()
 
+    with stage("Medewerkers, projecten en taken laden") as s:
+        df_employees, df_projects_filtered, df_tasks = load_dimensions(
+            tuple(sorted(df_uren['employee_id'].dropna().unique())),
+            tuple(sorted(df_uren['task_id'].dropna().unique())),
+            tuple(sorted(df_uren['offerprojectbase_id'].dropna().unique())),
+            current_versions(["employees", "companies", "tasktypes", "projects", "tasks"]),
+        )
+        s["df"] = df_projects_filtered
+
     # --- KPIs ---
     total_hours = df_uren['amount'].sum()
+    # Alleen in live modus kunnen er nog niet gefiatteerde uren (van vandaag) tussen zitten
+    if 'status_searchname' in df_uren.columns:
+        unapproved_hours = df_uren.loc[df_uren['status_searchname'] != 'Gefiatteerd', 'amount'].sum()
+    else:
+        unapproved_hours = 0
     active_employees = df_uren['employee_id'].nunique()
     tasks_done = df_uren['task_id'].nunique()
     avg_hours_per_project = total_hours / len(project_ids) if project_ids and total_hours > 0 else 0
@@ -231,6 +299,8 @@ if project_ids:
         st.markdown("##### Hoofdcijfers")
         kpi_col1, kpi_col2, kpi_col3, kpi_col4 = st.columns(4)
         kpi_col1.metric("Totaal Uren", f"{total_hours:,.2f}")
+        if unapproved_hours:
+            kpi_col1.caption(f"⚡ waarvan {unapproved_hours:,.2f} uur live en nog niet gefiatteerd")
         kpi_col2.metric("Actieve Medewerkers", active_employees)
         kpi_col3.metric("Unieke Taken", tasks_done)
         kpi_col4.metric("Gem. Uur/Project", f"{avg_hours_per_project:,.2f}")
@@ -317,7 +387,7 @@ if project_ids:
         # Data voorbereiden
         df_maand_taak = df_uren.copy()
         df_maand_taak = df_maand_taak.merge(df_tasks[['task_id', 'task_name']], left_on='task_id', right_on='task_id', how='left')
-        df_maand_taak['maand'] = pd.to_datetime(df_maand_taak['date_date']).dt.strftime('%Y-%m')
+        df_maand_taak['maand'] = month_key(df_maand_taak['date_date'])
 
         # Groeperen per maand en taaktype
         pivot = (
@@ -349,7 +419,7 @@ if project_ids:
     with st.container(border=True):
         st.header("📈 Trend: Urenontwikkeling per Medewerker")
         df_trend = df_uren.copy().merge(df_employees[['id', 'fullname']], left_on='employee_id', right_on='id', how='left')
-        df_trend['maand'] = pd.to_datetime(df_trend['date_date']).dt.strftime('%Y-%m')
+        df_trend['maand'] = month_key(df_trend['date_date'])
         trend_pivot = (
             df_trend.groupby(['maand', 'fullname'])['amount']
             .sum()
@@ -393,6 +463,8 @@ if project_ids:
 else:
     st.info("📂 Selecteer één of meer projecten om de analyse te starten.")
 
+render_profiler()
+
 
 # Footer
 st.markdown("""
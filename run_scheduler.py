@@ -1,32 +1,53 @@
+import json
 import schedule
 import time
-from gripp_api import fetch_gripp_invoices, fetch_gripp_projects, fetch_gripp_employees, fetch_gripp_companies, fetch_gripp_hours_data, upload_uren_to_supabase
-from datetime import datetime
-from sqlalchemy import create_engine
-import os
-from dotenv import load_dotenv
+import numpy as np
+from gripp_api import (
+    fetch_gripp_invoices, fetch_gripp_projects, fetch_gripp_employees, fetch_gripp_companies, fetch_gripp_hours_data,
+    filter_invoices, filter_projects, filter_employees, filter_companies, filter_hours,
+    flatten_gripp_frame, enforce_schema, safe_to_sql, get_load_engine,
+)
+from datetime import datetime, timezone
+from utils.history import write_history
+from utils.data_versions import bump_versions
+
+# Bron -> (Gripp-methode, filter, tabel in het schema-register); historie komt in gripp_<tabel>_history
+HISTORY_SOURCES = {
+    "invoices": (fetch_gripp_invoices, "invoice.get", filter_invoices),
+    "projects": (fetch_gripp_projects, "project.get", filter_projects),
+    "employees": (fetch_gripp_employees, "employee.get", filter_employees),
+    "companies": (fetch_gripp_companies, "company.get", filter_companies),
+    "urenregistratie": (fetch_gripp_hours_data, "hour.get", filter_hours),
+}
 
-load_dotenv()
-POSTGRES_URL = os.getenv("POSTGRES_URL")
-engine = create_engine(POSTGRES_URL)
 
 def job():
     print(f"\n⏰ Running data fetch: {datetime.now()}")
     datasets = {
-        "gripp_invoices": fetch_gripp_invoices(),
-        "gripp_projects": fetch_gripp_projects(),
-        "gripp_employees": fetch_gripp_employees(),
-        "gripp_companies": fetch_gripp_companies(),
-        "gripp_hours_data": fetch_gripp_hours_data(),
+        table_name: enforce_schema(filter_fn(flatten_gripp_frame(fetch_fn(), method)), table_name)
+        for table_name, (fetch_fn, method, filter_fn) in HISTORY_SOURCES.items()
     }
+    if "tags" in datasets["invoices"].columns:
+        # Lijst-kolom: als JSON-tekst in de historie, net als in invoices
+        datasets["invoices"]["tags"] = datasets["invoices"]["tags"].map(
+            lambda x: json.dumps(list(x)) if isinstance(x, (list, np.ndarray)) else x
+        )
 
-    if not datasets["gripp_hours_data"].empty:
-        upload_uren_to_supabase(datasets["gripp_hours_data"].to_dict("records"))
+    if not datasets["urenregistratie"].empty:
+        if safe_to_sql(datasets["urenregistratie"].drop_duplicates(subset="id"), "urenregistratie"):
+            with get_load_engine().begin() as conn:
+                bump_versions(conn, ["urenregistratie"])
 
-    for name, df in datasets.items():
-        df["snapshot_timestamp"] = datetime.now()
-        df.to_sql(name, engine, if_exists="append", index=False)
-        print(f"✅ {name}: {len(df)} rows opgeslagen.")
+    # Alleen gewijzigde rijen krijgen een nieuwe versie; één runmoment voor alle tabellen
+    run_at = datetime.now(timezone.utc)
+    with get_load_engine().begin() as conn:
+        for table_name, df in datasets.items():
+            if df.empty:
+                print(f"⚠️ {table_name}: geen data, historie niet bijgewerkt.")
+                continue
+            write_history(conn, table_name, df, run_at)
+        bump_versions(conn, [f"gripp_{table_name}_history" for table_name, df in datasets.items() if not df.empty])
+    print("✅ Historie bijgewerkt.")
 
 if __name__ == "__main__":
-    job()
\ No newline at end of file
+    job()
@@ -0,0 +1,85 @@
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+
+from utils.data_loaders import build_query
+
+
+def _render(query):
+    compiled = query.compile(dialect=postgresql.dialect())
+    return " ".join(str(compiled).split()), compiled.params
+
+
+def test_filters_and_date_range_are_bind_parameters():
+    sql, params = _render(build_query(
+        "invoices",
+        columns=["id", "totalpayed"],
+        filters={"company_id": [3, 1.0, np.int64(2), None], "status_searchname": "Betaald", "fase": None},
+        date_range={"reportdate_date": ("2024-01-01", date(2024, 3, 31))},
+    ))
+    assert sql == (
+        "SELECT id, totalpayed FROM invoices "
+        "WHERE company_id = ANY (%(company_id_0)s::BIGINT[]) "
+        "AND status_searchname = %(status_searchname_1)s "
+        "AND fase IS NULL "
+        "AND CAST(reportdate_date AS DATE) >= %(reportdate_date_start)s "
+        "AND CAST(reportdate_date AS DATE) <= %(reportdate_date_end)s"
+    )
+    # NaN/None vallen weg, id's uit float-kolommen worden weer gehele getallen
+    assert params == {
+        "company_id_0": [3, 1, 2],
+        "status_searchname_1": "Betaald",
+        "reportdate_date_start": date(2024, 1, 1),
+        "reportdate_date_end": date(2024, 3, 31),
+    }
+
+
+def test_text_list_open_date_bound_aggregates_order_and_limit():
+    sql, params = _render(build_query(
+        "urenregistratie",
+        filters={"status_searchname": ("Gefiatteerd", "Concept")},
+        date_range={"date_date": (None, "2024-02-29")},
+        aggregates={"totaal_uren": ("sum", "amount"), "regels": ("count", "*")},
+        group_by=["employee_id"],
+        order_by=["-totaal_uren"],
+        limit=10,
+    ))
+    assert sql == (
+        "SELECT employee_id, sum(amount) AS totaal_uren, count(*) AS regels FROM urenregistratie "
+        "WHERE status_searchname = ANY (%(status_searchname_0)s::TEXT[]) "
+        "AND CAST(date_date AS DATE) <= %(date_date_end)s "
+        "GROUP BY employee_id ORDER BY totaal_uren DESC LIMIT %(row_limit)s"
+    )
+    assert params == {"status_searchname_0": ["Gefiatteerd", "Concept"], "date_date_end": date(2024, 2, 29), "row_limit": 10}
+
+
+def test_identifiers_are_validated():
+    with pytest.raises(ValueError):
+        build_query("invoices", columns=["id; DROP TABLE invoices"])
+    with pytest.raises(ValueError):
+        build_query("invoices", aggregates={"x": ("median", "totalpayed")})
+
+
+load_dotenv()
+POSTGRES_URL = os.getenv("POSTGRES_URL")
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="POSTGRES_URL is not set")
+def test_date_range_on_legacy_text_column():
+    # Tabel zoals de oude loader hem aanmaakte: reportdate_date als TEXT
+    engine = create_engine(POSTGRES_URL)
+    with engine.connect() as conn, conn.begin() as transaction:
+        conn.execute(text("CREATE TEMP TABLE invoices (id BIGINT, company_id BIGINT, reportdate_date TEXT)"))
+        conn.execute(text("""
+            INSERT INTO invoices VALUES (1, 1, '2024-01-15 00:00:00.000000'), (2, 1, '2024-02-01'), (3, 2, NULL)
+        """))
+        query = build_query("invoices", columns=["id"], filters={"company_id": [1, 2]},
+                            date_range={"reportdate_date": ("2024-01-01", "2024-01-31")})
+        assert [r[0] for r in conn.execute(query)] == [1]
+        transaction.rollback()
+    engine.dispose()
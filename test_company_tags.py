@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from utils.company_tags import company_tag_frame, EIGEN_TAG, KLANT_TAG
+
+
+def test_company_tag_frame_one_row_per_company_tag():
+    companies = pd.DataFrame({
+        "id": [1, 2, 3, 4, 5],
+        "tags": [
+            [{"id": 10, "searchname": EIGEN_TAG}, {"id": 20, "searchname": "2 | Webshop"}],
+            # Uit de parquet-cache komen lijsten terug als numpy-arrays; dubbele tag telt één keer
+            np.array([{"id": 30, "searchname": KLANT_TAG}, {"id": 30, "searchname": KLANT_TAG}], dtype=object),
+            [],
+            None,
+            # Onvolledige tags (geen id of geen dict) vallen weg
+            [{"searchname": "zonder id"}, "kapot", {"id": 40, "searchname": "Leverancier"}],
+        ],
+    })
+
+    frame = company_tag_frame(companies)
+
+    assert list(frame.columns) == ["company_id", "tag_id", "tag_name"]
+    assert [tuple(r) for r in frame.itertuples(index=False)] == [
+        (1, 10, EIGEN_TAG),
+        (1, 20, "2 | Webshop"),
+        (2, 30, KLANT_TAG),
+        (5, 40, "Leverancier"),
+    ]
+
+
+def test_company_tag_frame_without_tags_column():
+    frame = company_tag_frame(pd.DataFrame({"id": [1], "tag_names": [EIGEN_TAG]}))
+
+    assert frame.empty
+    assert list(frame.columns) == ["company_id", "tag_id", "tag_name"]
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+import utils.duckdb_store as store
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    """Store in een tijdelijke map met een vaste 'huidige' versie en zonder echte achtergrond-sync."""
+    monkeypatch.setattr(store, "STORE_PATH", str(tmp_path / "dashboard.duckdb"))
+    monkeypatch.setattr(store, "STORE_ENABLED", True)
+    monkeypatch.setattr(store, "_reader", {"connection": None, "identity": None, "failed_at": None})
+    versions = {"invoices": None}
+    synced = []
+    monkeypatch.setattr(store, "current_versions", lambda tables: {t: versions.get(t) for t in tables})
+    monkeypatch.setattr(store, "_sync_in_background", synced.append)
+
+    def write(df, version):
+        with store._writer(wait=True) as cur:
+            store._load_frame(cur, "invoices", df, "CREATE OR REPLACE TABLE {table} AS SELECT * FROM incoming")
+            store._mark_synced(cur, "invoices", "postgres", version)
+
+    return versions, synced, write
+
+
+def test_store_serves_rows_at_current_version(local_store):
+    versions, synced, write = local_store
+    write(pd.DataFrame({"id": [1, 2], "totalpayed": [10.0, 20.0]}), version=3)
+    versions["invoices"] = 3
+
+    df = store.query_store("invoices", aggregates={"totaal": ("sum", "totalpayed")})
+
+    assert df["totaal"].tolist() == [30.0]
+    assert synced == []
+
+
+def test_store_behind_known_version_falls_back_to_postgres(local_store):
+    versions, synced, write = local_store
+    write(pd.DataFrame({"id": [1], "totalpayed": [10.0]}), version=3)
+    # Een load heeft invoices naar versie 4 gebracht; de store staat nog op 3
+    versions["invoices"] = 4
+
+    assert store.query_store("invoices") is None
+    assert synced == ["invoices"]
+
+
+def test_store_ahead_of_local_version_is_served(local_store):
+    # Een ander proces heeft al naar versie 5 gesynct terwijl dit proces de NOTIFY nog niet zag
+    versions, synced, write = local_store
+    write(pd.DataFrame({"id": [1]}), version=5)
+    versions["invoices"] = 4
+
+    assert store.query_store("invoices", columns=["id"])["id"].tolist() == [1]
+    assert synced == []
+
+
+def test_reader_picks_up_swapped_store(local_store):
+    versions, synced, write = local_store
+    write(pd.DataFrame({"id": [1]}), version=None)
+    assert store.query_store("invoices", columns=["id"])["id"].tolist() == [1]
+
+    write(pd.DataFrame({"id": [1, 2]}), version=None)
+
+    assert store.query_store("invoices", columns=["id"])["id"].tolist() == [1, 2]
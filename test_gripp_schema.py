@@ -0,0 +1,32 @@
+import pandas as pd
+
+from utils.gripp_schema import parse_gripp_dates
+
+
+def test_parse_gripp_dates_mixed_formats():
+    values = pd.Series([
+        "2024-03-05 14:30:00.000000",   # Gripp-formaat
+        "2024-02-29 00:00:00.500000",   # schrikkeldag, microseconden
+        "2024-04-01",                   # al ISO-datum: via de ISO8601-terugval
+        "2024-04-02T08:15:00",
+        None,
+        "geen datum",
+    ], index=[10, 11, 12, 13, 14, 15])
+
+    parsed = parse_gripp_dates(values)
+
+    assert parsed.index.tolist() == values.index.tolist()
+    assert parsed.tolist()[:4] == [
+        pd.Timestamp("2024-03-05 14:30:00"),
+        pd.Timestamp("2024-02-29 00:00:00.5"),
+        pd.Timestamp("2024-04-01"),
+        pd.Timestamp("2024-04-02 08:15:00"),
+    ]
+    assert parsed.iloc[4:].isna().all()
+
+
+def test_parse_gripp_dates_only_gripp_format():
+    parsed = parse_gripp_dates(pd.Series(["2023-12-31 23:59:59.999999", "2024-01-01 00:00:00.000000"]))
+
+    assert parsed.dt.date.astype(str).tolist() == ["2023-12-31", "2024-01-01"]
+    assert parsed.iloc[0] == pd.Timestamp("2023-12-31 23:59:59.999999")
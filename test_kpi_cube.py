@@ -0,0 +1,154 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+import utils.kpi_cube as kpi_cube
+from utils.migrations import migrate_rollup_tables
+
+# (bedrijf, dag, uren, gefactureerd); bedrijf 7 heeft lege dagen tussen 3 en 10 januari
+CELLS = [
+    (7, "2024-01-01", 1.0, 10.0),
+    (7, "2024-01-03", 2.0, 20.0),
+    (7, "2024-01-10", 4.0, 40.0),
+    (3, "2024-01-02", 8.0, 0.0),
+    (9, "2023-12-31", 16.0, 100.0),
+]
+TOTALS = pd.DataFrame({
+    "company_id": [7, 11],
+    "planned_revenue": [500.0, 100.0],
+    "undated_hours": [0.5, 1.0],
+    "undated_invoiced": [5.0, 2.0],
+})
+
+
+@pytest.fixture
+def cube(monkeypatch):
+    """Lege kubus per test; refresh_cube doet niets zodat de lookups alleen de arrays lezen."""
+    for key, value in list(kpi_cube._cube.items()):
+        monkeypatch.setitem(kpi_cube._cube, key, value)
+    monkeypatch.setattr(kpi_cube, "refresh_cube", lambda force=False: None)
+    return kpi_cube._cube
+
+
+def _fill(cells, totals=TOTALS):
+    cells = pd.DataFrame(cells, columns=["company_id", "day", *kpi_cube.MEASURES])
+    kpi_cube._store(*kpi_cube._as_arrays(cells))
+    kpi_cube._cube["totals"] = totals
+
+
+def _sums(start, end):
+    df = kpi_cube.period_sums(start, end)
+    return {int(c): (h, i) for c, h, i in df[["company_id", *kpi_cube.MEASURES]].itertuples(index=False)}
+
+
+def test_period_sums_over_gaps_and_open_bounds(cube):
+    _fill(CELLS)
+
+    # 7: alleen 3 januari valt in de periode; 9 heeft geen cellen erin en ontbreekt
+    assert _sums(date(2024, 1, 2), date(2024, 1, 9)) == {3: (8.0, 0.0), 7: (2.0, 20.0)}
+    # Alleen lege dagen
+    assert _sums(date(2024, 1, 4), date(2024, 1, 9)) == {}
+    # Grenzen zijn inclusief
+    assert _sums(date(2024, 1, 3), date(2024, 1, 10)) == {7: (6.0, 60.0)}
+    assert _sums(None, date(2024, 1, 1)) == {7: (1.0, 10.0), 9: (16.0, 100.0)}
+    assert _sums(date(2024, 1, 4), None) == {7: (4.0, 40.0)}
+    assert _sums(None, None) == {3: (8.0, 0.0), 7: (7.0, 70.0), 9: (16.0, 100.0)}
+
+
+def test_period_sums_on_empty_cube(cube):
+    _fill([])
+
+    df = kpi_cube.period_sums(date(2024, 1, 1), date(2024, 12, 31))
+
+    assert df.empty
+    assert list(df.columns) == ["company_id", *kpi_cube.MEASURES]
+
+
+def _kpis(start, end):
+    df = kpi_cube.company_period_kpis(start, end).sort_values("bedrijf_id")
+    return [tuple(r) for r in df.itertuples(index=False)]
+
+
+def test_company_period_kpis(cube):
+    _fill(CELLS)
+
+    # Periode: uren zonder datum tellen mee, facturen zonder rapportdatum niet.
+    # 11 heeft alleen totalen, 9 valt buiten de periode.
+    assert _kpis(date(2024, 1, 2), date(2024, 1, 9)) == [
+        (3, 8.0, 0.0, 0.0),
+        (7, 2.5, 20.0, 500.0),
+        (11, 1.0, 0.0, 100.0),
+    ]
+    # All-time: ook de facturen zonder rapportdatum
+    assert _kpis(None, None) == [
+        (3, 8.0, 0.0, 0.0),
+        (7, 7.5, 75.0, 500.0),
+        (9, 16.0, 100.0, 0.0),
+        (11, 1.0, 2.0, 100.0),
+    ]
+    # Een open grens telt als geen periode (zelfde gedrag als load_company_kpis)
+    assert _kpis(date(2024, 1, 2), None) == _kpis(None, None)
+
+
+load_dotenv()
+POSTGRES_URL = os.getenv("POSTGRES_URL")
+
+
+@pytest.fixture
+def conn():
+    if not POSTGRES_URL:
+        pytest.skip("POSTGRES_URL is not set")
+    engine = create_engine(POSTGRES_URL)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        connection.execute(text("CREATE SCHEMA test_kpi_cube"))
+        connection.execute(text("SET LOCAL search_path TO test_kpi_cube"))
+        migrate_rollup_tables(connection)
+        try:
+            yield connection
+        finally:
+            transaction.rollback()
+    engine.dispose()
+
+
+def _insert_cells(conn, cells, updated_at):
+    for company_id, day, hours, invoiced in cells:
+        conn.execute(text("""
+            INSERT INTO kpi_company_daily (company_id, day, hours, invoiced, updated_at)
+            VALUES (:c, :d, :h, :i, :u)
+        """), {"c": company_id, "d": day, "h": hours, "i": invoiced, "u": updated_at})
+
+
+def test_incremental_reloads_only_changed_companies(cube, conn, monkeypatch):
+    _insert_cells(conn, [c for c in CELLS if c[0] != 7], "2024-05-01 12:00+00")
+    _insert_cells(conn, [c for c in CELLS if c[0] == 7], "2024-06-01 12:00+00")
+    kpi_cube._full_reload(conn)
+    assert _sums(None, None) == {3: (8.0, 0.0), 7: (7.0, 70.0), 9: (16.0, 100.0)}
+
+    # Nieuwe load voor bedrijf 7: 10 januari verdwijnt, 5 januari komt erbij
+    conn.execute(text("DELETE FROM kpi_company_daily WHERE company_id = 7"))
+    _insert_cells(conn, [(7, "2024-01-01", 1.0, 10.0), (7, "2024-01-05", 3.0, 30.0)], "2024-06-02 12:00+00")
+    fetched = []
+    fetch_cells = kpi_cube._fetch_cells
+    monkeypatch.setattr(kpi_cube, "_fetch_cells", lambda c, ids=None: fetched.append(ids) or fetch_cells(c, ids))
+
+    assert kpi_cube._incremental(conn)
+
+    assert fetched == [[7]]
+    assert _sums(date(2024, 1, 2), date(2024, 1, 9)) == {3: (8.0, 0.0), 7: (3.0, 30.0)}
+    assert _sums(None, None) == {3: (8.0, 0.0), 7: (4.0, 40.0), 9: (16.0, 100.0)}
+    assert kpi_cube._cube["watermark"] == pd.Timestamp("2024-06-02 12:00", tz="UTC")
+
+    # Alle cellen van bedrijf 3 weg: geen updated_at om op te vangen, dus het aantal klopt niet meer
+    conn.execute(text("DELETE FROM kpi_company_daily WHERE company_id = 3"))
+    assert not kpi_cube._incremental(conn)
+
+
+def test_incremental_without_watermark_asks_for_full_reload(cube):
+    cube["watermark"] = None
+    # Zonder watermerk valt er niets te vergelijken: geen query, meteen volledige herlaad
+    assert not kpi_cube._incremental(conn=None)
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from utils.migrations import migrate_table, is_partitioned, _KNOWN_PARTITIONS
+from utils.kpi_rollup import ensure_rollups
+from utils.kpi_engine import _PROJECTLINE_SQL
+
+# Draait tegen een echte Postgres (POSTGRES_URL) in een eigen schema; alles wordt teruggerold
+load_dotenv()
+POSTGRES_URL = os.getenv("POSTGRES_URL")
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason="POSTGRES_URL is not set")
+
+# Tabellen zoals de oude loader ze aanmaakte (df.head(0).to_sql): lege object-kolommen werden TEXT
+LEGACY_TABLES = {
+    "invoices": "id BIGINT, company_id TEXT, reportdate_date TEXT, date_date TEXT, totalpayed TEXT, status_searchname TEXT",
+    "projectlines_per_company": "id BIGINT, bedrijf_id TEXT, offerprojectbase_id TEXT, createdon_date TEXT, "
+                                "amount TEXT, amountwritten TEXT, sellingprice TEXT, unit_searchname TEXT, hidefortimewriting TEXT",
+    "projects": "id BIGINT, company_id TEXT, totalinclvat TEXT",
+}
+
+
+@pytest.fixture
+def conn():
+    engine = create_engine(POSTGRES_URL)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        connection.execute(text("CREATE SCHEMA test_migrations"))
+        connection.execute(text("SET LOCAL search_path TO test_migrations"))
+        for table_name, columns in LEGACY_TABLES.items():
+            connection.execute(text(f"CREATE TABLE {table_name} ({columns})"))
+        _KNOWN_PARTITIONS.clear()
+        try:
+            yield connection
+        finally:
+            transaction.rollback()
+            _KNOWN_PARTITIONS.clear()
+    engine.dispose()
+
+
+def _column_type(conn, table_name, column):
+    return conn.execute(text("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :t AND column_name = :c
+    """), {"t": table_name, "c": column}).scalar()
+
+
+def test_text_partition_key_is_converted_before_partitioning(conn):
+    conn.execute(text("""
+        INSERT INTO invoices VALUES
+            (1, '10.0', '2024-03-05 00:00:00.000000', '2024-03-01', '100.50', 'Betaald'),
+            (2, '11', '2024-04-01', '', '', 'Concept'),
+            (3, NULL, '', NULL, 'nan', NULL)
+    """))
+
+    migrate_table(conn, "invoices")
+
+    assert is_partitioned(conn, "invoices")
+    assert _column_type(conn, "invoices", "reportdate_date") == "date"
+    assert _column_type(conn, "invoices", "date_date") == "date"
+    assert _column_type(conn, "invoices", "totalpayed") == "numeric"
+    assert _column_type(conn, "invoices", "company_id") == "bigint"
+    assert _column_type(conn, "invoices", "status_searchname") == "text"
+    rows = conn.execute(text(
+        "SELECT id, company_id, CAST(reportdate_date AS TEXT), CAST(totalpayed AS FLOAT) FROM invoices ORDER BY id"
+    )).fetchall()
+    assert [tuple(r) for r in rows] == [(1, 10, "2024-03-05", 100.5), (2, 11, "2024-04-01", None), (3, None, None, None)]
+    partitions = {r[0] for r in conn.execute(text("SELECT tableoid::regclass::text FROM invoices"))}
+    assert partitions == {"invoices_2024_03", "invoices_2024_04", "invoices_default"}
+
+
+def test_rollups_build_on_legacy_text_columns(conn):
+    conn.execute(text("""
+        INSERT INTO invoices VALUES (1, '10', '2024-03-05', NULL, '200', 'Betaald'),
+                                    (2, '10', '', NULL, '50', 'Betaald')
+    """))
+    conn.execute(text("""
+        INSERT INTO projectlines_per_company VALUES
+            (1, '10', '5', '2024-03-05 10:00:00.000000', '8', '4', '75', 'uur', 'False'),
+            (2, '10', '5', '', '1', '2.5', '20', 'uur', 'True')
+    """))
+    conn.execute(text("INSERT INTO projects VALUES (5, '10', '1000')"))
+
+    assert ensure_rollups(conn)
+
+    daily = conn.execute(text(
+        "SELECT company_id, CAST(day AS TEXT), hours, CAST(invoiced AS FLOAT) FROM kpi_company_daily"
+    )).fetchall()
+    assert [tuple(r) for r in daily] == [(10, "2024-03-05", 4.0, 200.0)]
+    totals = conn.execute(text("""
+        SELECT company_id, CAST(planned_revenue AS FLOAT), undated_hours, CAST(undated_invoiced AS FLOAT)
+        FROM kpi_company_totals
+    """)).fetchall()
+    assert [tuple(r) for r in totals] == [(10, 1000.0, 2.5, 50.0)]
+
+
+def test_projectline_scan_on_migrated_text_columns(conn):
+    conn.execute(text("""
+        INSERT INTO projectlines_per_company VALUES
+            (1, '10', '5', '2024-03-05', '8', '4', '75', 'uur', 'False'),
+            (2, '10', '5', '2024-03-06', '2', '1', '25', 'Uur', 'False'),
+            (3, '10', '5', '', '3', '', '10', 'stuk', 'True'),
+            (4, '10', '6', '', '1', '', '500', 'uur', 'False')
+    """))
+    conn.execute(text("INSERT INTO projects VALUES (5, '10', '1000')"))
+    # Zoals de loader: ensure_rollups zet de bronkolommen om vóór het dashboard ze leest
+    ensure_rollups(conn)
+
+    rows = conn.execute(text(_PROJECTLINE_SQL)).fetchall()
+    # Project 6 bestaat niet: regel 4 telt niet mee. Tarief alleen over de 'uur'-regels.
+    assert [(r[0], float(r[1]), float(r[2])) for r in rows] == [(10, 50.0, 8 * 75 + 2 * 25 + 3 * 10)]
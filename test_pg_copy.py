@@ -0,0 +1,82 @@
+import os
+import struct
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from utils.pg_copy import _encode_numeric_value, _encode_column, encode_binary_copy, NULL_FIELD
+
+
+def _numeric(ndigits, weight, sign, dscale, *digits):
+    payload = struct.pack(f">hhHH{len(digits)}H", ndigits, weight, sign, dscale, *digits)
+    return struct.pack(">i", len(payload)) + payload
+
+
+@pytest.mark.parametrize("value, expected", [
+    # 123.45 -> base-10000 groepen [0123][.4500]
+    (Decimal("123.45"), _numeric(2, 0, 0x0000, 2, 123, 4500)),
+    # -0.5 -> alleen een fractiegroep [5000] met weight -1
+    (-0.5, _numeric(1, -1, 0x4000, 1, 5000)),
+    # 10000 -> [0001][0000], nullen achteraan vallen weg
+    (10000, _numeric(1, 1, 0x0000, 0, 1)),
+    (0, _numeric(0, 0, 0x0000, 0)),
+    # float via repr: 0.1 blijft 0.1 (geen 0.1000000000000000055...)
+    (0.1, _numeric(1, -1, 0x0000, 1, 1000)),
+    ("1234567.000089", _numeric(4, 1, 0x0000, 6, 123, 4567, 0, 8900)),
+    (float("nan"), _numeric(0, 0, 0xC000, 0)),
+])
+def test_encode_numeric_value(value, expected):
+    assert _encode_numeric_value(value) == expected
+
+
+def test_bigint_ids_above_2_53_are_exact():
+    big = 2 ** 53 + 1
+    for values in (pd.Series([big, None], dtype="Int64"), pd.Series([str(big), None])):
+        fields = _encode_column(values.rename("id"), "bigint")
+        assert fields == [struct.pack(">iq", 8, big), NULL_FIELD]
+
+
+def test_unparseable_dates_and_timestamps_become_null():
+    dates = _encode_column(pd.Series(["2000-01-03", "geen datum", None], name="d"), "date")
+    assert dates == [struct.pack(">ii", 4, 2), NULL_FIELD, NULL_FIELD]
+    stamps = _encode_column(pd.Series(["2000-01-01 00:00:01", "nope"], name="ts"), "timestamp without time zone")
+    assert stamps == [struct.pack(">iq", 8, 1_000_000), NULL_FIELD]
+
+
+load_dotenv()
+POSTGRES_URL = os.getenv("POSTGRES_URL")
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="POSTGRES_URL is not set")
+def test_binary_copy_round_trip():
+    column_types = {
+        "id": "bigint", "amount": "double precision", "price": "numeric", "day": "date",
+        "seen": "timestamp without time zone", "ok": "boolean", "name": "text",
+    }
+    df = pd.DataFrame({
+        "id": pd.Series([2 ** 53 + 1, 2], dtype="Int64"),
+        "amount": [1.5, np.nan],
+        "price": [Decimal("-1234.5600"), None],
+        "day": ["2024-03-05 00:00:00.000000", "kapot"],
+        "seen": [datetime(2024, 3, 5, 10, 30), None],
+        "ok": pd.Series([True, None], dtype="boolean"),
+        "name": ["Überstunden", None],
+    })
+    engine = create_engine(POSTGRES_URL)
+    with engine.connect() as conn, conn.begin() as transaction:
+        conn.execute(text(f"CREATE TEMP TABLE copy_test ({', '.join(f'{c} {t}' for c, t in column_types.items())})"))
+        conn.connection.cursor().copy_expert(
+            f"COPY copy_test ({', '.join(column_types)}) FROM STDIN WITH BINARY", encode_binary_copy(df, column_types)
+        )
+        rows = [tuple(r) for r in conn.execute(text("SELECT * FROM copy_test ORDER BY id"))]
+        transaction.rollback()
+    engine.dispose()
+    assert rows == [
+        (2, None, None, None, None, None, None),
+        (2 ** 53 + 1, 1.5, Decimal("-1234.5600"), date(2024, 3, 5), datetime(2024, 3, 5, 10, 30), True, "Überstunden"),
+    ]
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+import utils.result_cache as result_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(result_cache, "current_versions", lambda tables: {t: 1 for t in tables})
+    return tmp_path
+
+
+def test_cold_and_warm_calls_share_the_read_only_contract(cache_dir):
+    calls = []
+
+    @result_cache.arrow_cache(tables=["invoices"])
+    def load(n):
+        calls.append(n)
+        return pd.DataFrame({"id": range(n), "totalpayed": [float(i) for i in range(n)]})
+
+    cold, warm = load(3), load(3)
+
+    assert calls == [3]
+    pd.testing.assert_frame_equal(cold, warm)
+    for df in (cold, warm):
+        # Zero-copy uit de mapping: waarden in place aanpassen mag niet, kolommen vervangen wel
+        with pytest.raises(ValueError, match="read-only"):
+            df.loc[df["id"] > 0, "totalpayed"] = 0.0
+        df["totalpayed"] = df["totalpayed"] * 2
+        writable = df.copy()
+        writable.loc[writable["id"] > 0, "id"] = 0
+        assert writable["id"].tolist() == [0, 0, 0]
+
+
+def test_new_version_gives_new_key(cache_dir, monkeypatch):
+    calls = []
+
+    @result_cache.arrow_cache(tables=["invoices"])
+    def load():
+        calls.append(1)
+        return pd.DataFrame({"id": [len(calls)]})
+
+    assert load()["id"].tolist() == [1]
+    monkeypatch.setattr(result_cache, "current_versions", lambda tables: {t: 2 for t in tables})
+    assert load()["id"].tolist() == [2]
+    assert len(calls) == 2
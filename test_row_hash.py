@@ -0,0 +1,34 @@
+import pandas as pd
+import pyarrow as pa
+
+from utils.gripp_schema import add_row_hash, add_row_hash_arrow, enforce_schema, enforce_arrow_schema, ROW_HASH_COLUMN
+
+# Dezelfde Gripp-rijen, zoals de pandas-loader (gripp_api) en de Arrow-loader (gripp_arrow) ze krijgen
+RECORDS = [
+    {"id": 1, "amount": 1.5, "date_date": "2024-03-01 00:00:00.000000", "employee_id": 7,
+     "status_searchname": "Gefiatteerd", "description": "Overleg"},
+    {"id": 2, "amount": 2, "date_date": "2024-03-02 00:00:00.000000", "employee_id": None,
+     "status_searchname": "Concept", "description": None},
+]
+
+
+def test_row_hash_equal_for_pandas_and_arrow():
+    df = enforce_schema(pd.DataFrame(RECORDS), "urenregistratie")
+    table = enforce_arrow_schema(pa.Table.from_pylist(RECORDS), "urenregistratie")
+
+    pandas_hashes = add_row_hash(df)[ROW_HASH_COLUMN].tolist()
+    arrow_hashes = add_row_hash_arrow(table).column(ROW_HASH_COLUMN).to_pylist()
+
+    assert pandas_hashes == arrow_hashes
+
+
+def test_row_hash_ignores_column_order():
+    df = pd.DataFrame(RECORDS)
+    reordered = df[list(reversed(df.columns))]
+    assert add_row_hash(df)[ROW_HASH_COLUMN].tolist() == add_row_hash(reordered)[ROW_HASH_COLUMN].tolist()
+
+
+if __name__ == "__main__":
+    test_row_hash_equal_for_pandas_and_arrow()
+    test_row_hash_ignores_column_order()
+    print("✅ Row hashes gelijk voor pandas en Arrow")
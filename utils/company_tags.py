@@ -0,0 +1,99 @@
+"""
+Genormaliseerde bedrijfstags: tabel company_tags (company_id, tag_id, tag_name) en een
+in-memory index tag -> set van bedrijf-id's.
+
+De loader vult company_tags bij ingestie uit de gestructureerde Gripp-tags (niet uit de
+komma-gescheiden tag_names) en hoogt daarna de dataversie op. De dashboards filteren op
+bedrijfstype met een set-lookup (company_ids_with_tag) in plaats van tag_names per rij te
+splitsen; de index wordt alleen opnieuw opgebouwd als de versie van company_tags verandert.
+"""
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.data_loaders import load_data_df
+from utils.data_versions import bump_versions, current_versions
+from utils.migrations import migrate_company_tags
+
+# Primaire tags achter de filters 'Eigen bedrijven' en 'Klanten'
+EIGEN_TAG = "1 | Eigen webshop(s) / bedrijven"
+KLANT_TAG = "1 | Externe opdrachten / contracten"
+
+_UNSET = object()
+_index = {"version": _UNSET, "tags": {}}
+_index_lock = threading.Lock()
+
+
+def company_tag_frame(companies: pd.DataFrame) -> pd.DataFrame:
+    """Eén rij per (bedrijf, tag) uit de gestructureerde kolom 'tags' (lijst van {id, searchname})."""
+    if "tags" not in companies.columns:
+        return pd.DataFrame(columns=["company_id", "tag_id", "tag_name"])
+    # explode werkt voor lijsten en voor numpy-arrays (uit de parquet-cache)
+    rows = companies[["id", "tags"]].explode("tags").dropna(subset=["tags"])
+    tags = rows["tags"]
+    frame = pd.DataFrame({
+        "company_id": rows["id"],
+        "tag_id": tags.map(lambda t: t.get("id") if isinstance(t, dict) else None),
+        "tag_name": tags.map(lambda t: t.get("searchname") if isinstance(t, dict) else None),
+    })
+    return frame.dropna().drop_duplicates(subset=["company_id", "tag_id"])
+
+
+def write_company_tags(conn, tags: pd.DataFrame, company_ids) -> int:
+    """
+    Vervangt de tags van de geladen bedrijven door `tags` (zelfde transactie) en hoogt de
+    versie van company_tags op. Bedrijven zonder tags houden zo ook geen oude tags over.
+    """
+    migrate_company_tags(conn)
+    company_ids = sorted({int(c) for c in pd.Series(company_ids).dropna()})
+    conn.execute(text("DELETE FROM company_tags WHERE company_id = ANY(CAST(:ids AS BIGINT[]))"), {"ids": company_ids})
+    conn.execute(text("""
+        INSERT INTO company_tags (company_id, tag_id, tag_name)
+        SELECT * FROM unnest(CAST(:company_ids AS BIGINT[]), CAST(:tag_ids AS BIGINT[]), CAST(:tag_names AS TEXT[]))
+        ON CONFLICT (company_id, tag_id) DO UPDATE SET tag_name = EXCLUDED.tag_name
+    """), {
+        "company_ids": [int(c) for c in tags["company_id"]],
+        "tag_ids": [int(t) for t in tags["tag_id"]],
+        "tag_names": [str(n).strip() for n in tags["tag_name"]],
+    })
+    bump_versions(conn, ["company_tags"])
+    print(f"🏷️ company_tags bijgewerkt: {len(tags)} tags voor {len(company_ids)} bedrijven")
+    return len(tags)
+
+
+def _tags_from_companies() -> pd.DataFrame:
+    """Terugval als company_tags ontbreekt of leeg is: tag_names één keer (kolomsgewijs) splitsen."""
+    df = load_data_df("companies", columns=["id", "tag_names"], typed=False)
+    df = df.assign(tag_name=df["tag_names"].str.split(",")).explode("tag_name")
+    df["tag_name"] = df["tag_name"].str.strip()
+    df = df[df["tag_name"].notna() & (df["tag_name"] != "")]
+    return df.rename(columns={"id": "company_id"})[["company_id", "tag_name"]]
+
+
+def _build_index() -> dict:
+    try:
+        df = load_data_df("company_tags", columns=["company_id", "tag_name"], typed=False)
+    except Exception as e:
+        print(f"⚠️ company_tags niet te laden, index uit companies.tag_names: {e}")
+        df = _tags_from_companies()
+    else:
+        if df.empty:
+            # Tabel bestaat (migratie gedraaid) maar de loader heeft hem nog niet gevuld
+            print("ℹ️ company_tags is leeg, index uit companies.tag_names")
+            df = _tags_from_companies()
+    return {tag: frozenset(int(c) for c in ids) for tag, ids in df.groupby("tag_name")["company_id"]}
+
+
+def tag_index() -> dict:
+    """{tag_name: frozenset(company_id)}, per proces gedeeld en herbouwd bij een nieuwe dataversie."""
+    version = current_versions(["company_tags"])["company_tags"]
+    with _index_lock:
+        if _index["version"] is _UNSET or _index["version"] != version:
+            _index["tags"] = _build_index()
+            _index["version"] = version
+        return _index["tags"]
+
+
+def company_ids_with_tag(tag_name: str) -> frozenset:
+    return tag_index().get(tag_name, frozenset())
@@ -1,10 +1,16 @@
 import pandas as pd
+import numpy as np
 from typing import Callable, Union, Generator, Iterator
 import os
+import re
 from pathlib import Path
 import time
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, table, column, func, any_, bindparam, literal_column, cast, BigInteger, Text, Date
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import BindParameter
 from dotenv import load_dotenv
+from utils.gripp_schema import enforce_schema
 
 DATA_DIR = Path(__file__).resolve().parent.parent / "data_cache"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -22,25 +28,117 @@ def get_engine():
         _engine = create_engine(POSTGRES_URL, pool_pre_ping=True, pool_size=5, max_overflow=10)
     return _engine
 
-# Universele data loader met kolomselectie en optionele query
-# Gebruik deze in alle scripts
+# Kolom- en aliasnamen worden als identifier in de query gezet en dus gevalideerd;
+# alle waarden gaan als bind-parameter mee
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+AGGREGATES = {
+    "sum": func.sum,
+    "avg": func.avg,
+    "min": func.min,
+    "max": func.max,
+    "count": func.count,
+    "count_distinct": lambda col: func.count(col.distinct()),
+}
+
+
+def _identifier(name: str) -> str:
+    if not isinstance(name, str) or not _IDENTIFIER.match(name):
+        raise ValueError(f"Ongeldige kolom- of tabelnaam: {name!r}")
+    return name
+
+
+def _array_param(name: str, values) -> BindParameter:
+    """Lijst als één array-parameter: 'kolom = ANY(:p)' houdt de SQL-tekst gelijk, hoe lang de lijst ook is."""
+    values = [v.item() if hasattr(v, "item") else v for v in values if not pd.isna(v)]
+    # Id's uit float-kolommen (na NaN) weer als gehele getallen
+    values = [int(v) if isinstance(v, float) and v.is_integer() else v for v in values]
+    element_type = BigInteger() if all(isinstance(v, int) and not isinstance(v, bool) for v in values) else Text()
+    return bindparam(name, value=values, type_=ARRAY(element_type))
+
+
+def _as_date(value):
+    return pd.Timestamp(value).date() if isinstance(value, str) else value
+
+
+def build_query(table_name, columns=None, filters=None, date_range=None, aggregates=None,
+                group_by=None, order_by=None, limit=None) -> Select:
+    """
+    Geparametriseerde SELECT op één tabel, opgebouwd met SQLAlchemy Core:
+
+    - columns:    kolomprojectie (default alle kolommen, of alleen group_by + aggregates)
+    - filters:    {kolom: waarde}; lijst/tuple/set/array -> kolom = ANY(:p), None -> IS NULL
+    - date_range: {kolom: (start, eind)}, inclusief; een open grens is None
+    - aggregates: {alias: (functie, kolom)} met functie uit AGGREGATES, bv. {"totaal_uren": ("sum", "amountwritten")}
+    - group_by / order_by: kolomnamen (order_by met '-' ervoor is aflopend)
+
+    Alle waarden zijn bind-parameters; de SQL-tekst hangt alleen af van de vorm van de
+    query, zodat SQLAlchemy de gecompileerde statement hergebruikt.
+    """
+    source = table(_identifier(table_name))
+    group_by = [column(_identifier(c)) for c in (group_by or [])]
+    selected = [column(_identifier(c)) for c in columns] if columns else list(group_by)
+    for alias, (func_name, col) in (aggregates or {}).items():
+        if func_name not in AGGREGATES:
+            raise ValueError(f"Onbekende aggregatie '{func_name}', kies uit {', '.join(AGGREGATES)}")
+        target = literal_column("*") if col == "*" else column(_identifier(col))
+        selected.append(AGGREGATES[func_name](target).label(_identifier(alias)))
+    query = select(*selected).select_from(source) if selected else select(literal_column("*")).select_from(source)
+
+    for i, (col, value) in enumerate((filters or {}).items()):
+        target = column(_identifier(col))
+        if value is None:
+            query = query.where(target.is_(None))
+        elif isinstance(value, (list, tuple, set, frozenset, np.ndarray, pd.Index, pd.Series)):
+            query = query.where(target == any_(_array_param(f"{col}_{i}", list(value))))
+        else:
+            query = query.where(target == bindparam(f"{col}_{i}", value=value.item() if hasattr(value, "item") else value))
+    for col, (start, end) in (date_range or {}).items():
+        # CAST naar DATE: op een DATE-kolom laat Postgres de cast weg (index en partition pruning
+        # blijven werken); een TEXT-kolom uit de oude loader (vóór migrate_column_types) vergelijkt
+        # zo als datum in plaats van 'operator does not exist: text >= date' te geven
+        target = cast(column(_identifier(col)), Date())
+        if start is not None:
+            query = query.where(target >= bindparam(f"{col}_start", value=_as_date(start), type_=Date()))
+        if end is not None:
+            query = query.where(target <= bindparam(f"{col}_end", value=_as_date(end), type_=Date()))
 
-def load_data(table_name, columns=None, where=None, group_by=None, limit=None, streaming: bool = False, chunksize: int = 10000) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
-    engine = get_engine()
-    if columns:
-        col_str = ", ".join(columns)
-    else:
-        col_str = "*"
-    query = f"SELECT {col_str} FROM {table_name}"
-    if where:
-        query += f" WHERE {where}"
     if group_by:
-        query += f" GROUP BY {group_by}"
+        query = query.group_by(*group_by)
+    for col in order_by or []:
+        query = query.order_by(column(_identifier(col[1:])).desc() if col.startswith("-") else column(_identifier(col)))
     if limit:
-        query += f" LIMIT {limit}"
+        query = query.limit(bindparam("row_limit", value=int(limit)))
+    return query
+
+
+# Universele data loader met kolomselectie en filters in de database
+# Gebruik deze in alle scripts
+
+def load_data(table_name, columns=None, filters=None, date_range=None, aggregates=None, group_by=None,
+              order_by=None, limit=None, streaming: bool = False, chunksize: int = 10000,
+              typed: bool = True) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Laadt (een deel van) een tabel via build_query; zie daar voor filters, datumbereik en aggregaties.
+    Eerst uit de lokale DuckDB-store (utils/duckdb_store.py), met Postgres als terugval.
+    """
+    if not streaming:
+        from utils.duckdb_store import query_store  # Lazy: duckdb_store importeert deze module
+        df = query_store(table_name, columns, filters=filters, date_range=date_range, aggregates=aggregates,
+                         group_by=group_by, order_by=order_by, limit=limit)
+        if df is not None:
+            return enforce_schema(df, table_name) if typed else df
+    engine = get_engine()
+    query = build_query(table_name, columns, filters=filters, date_range=date_range, aggregates=aggregates,
+                        group_by=group_by, order_by=order_by, limit=limit)
     if streaming:
-        return pd.read_sql(query, con=engine, chunksize=chunksize)
-    return pd.read_sql(query, con=engine)
+        chunks = pd.read_sql(query, con=engine, chunksize=chunksize)
+        if not typed:
+            return chunks
+        return (enforce_schema(chunk, table_name) for chunk in chunks)
+    df = pd.read_sql(query, con=engine)
+    # Compacte types (Int64 ids, categoricals, date32) volgens het schema-register
+    return enforce_schema(df, table_name) if typed else df
 
 def load_data_df(*args, **kwargs) -> pd.DataFrame:
     df = load_data(*args, **kwargs)
@@ -54,7 +152,7 @@ def save_to_parquet(df: pd.DataFrame, name: str):
         print(f"⚠️ Waarschuwing: DataFrame '{name}' is leeg en wordt niet opgeslagen.")
         return
     path = DATA_DIR / f"{name}.parquet"
-    df.to_parquet(path, index=False)
+    enforce_schema(df, name).to_parquet(path, index=False)
     print(f"✅ Data opgeslagen naar: {path}")
 
 def load_from_parquet(name: str) -> pd.DataFrame:
@@ -0,0 +1,107 @@
+"""
+Dataversies per tabel (data_versions) met LISTEN/NOTIFY.
+
+De loader hoogt na elke geslaagde load de versie van de geschreven tabellen op en meldt dat
+op het kanaal 'data_versions' (NOTIFY gaat pas uit bij COMMIT). De dashboards nemen de
+versies op in hun cachesleutels: een cache blijft geldig tot de data van díe tabel echt
+verandert, zonder TTL en zonder de andere tabellen mee te verversen.
+
+Per proces houdt één achtergrondthread de versies bij via LISTEN. Valt die verbinding weg,
+dan worden de versies elke POLL_SECONDS opnieuw gelezen tot LISTEN weer loopt.
+"""
+import json
+import select
+import threading
+import time
+
+from sqlalchemy import text
+
+from utils.data_loaders import get_engine
+from utils.migrations import migrate_data_versions
+
+CHANNEL = "data_versions"
+POLL_SECONDS = 30
+RECONNECT_SECONDS = 10
+
+_versions = {}
+_versions_lock = threading.Lock()
+_listener = None
+_listening = threading.Event()
+_last_poll = 0.0
+
+
+def bump_versions(conn, tables) -> dict:
+    """
+    Hoogt binnen de transactie van de loader de versie van `tables` op en stuurt één NOTIFY
+    met {tabel: versie}. Geeft de nieuwe versies terug.
+    """
+    tables = sorted(set(tables))
+    if not tables:
+        return {}
+    migrate_data_versions(conn)
+    result = conn.execute(text("""
+        INSERT INTO data_versions (table_name, version, updated_at)
+        SELECT t, 1, now() FROM unnest(CAST(:tables AS TEXT[])) AS t
+        ON CONFLICT (table_name) DO UPDATE
+        SET version = data_versions.version + 1, updated_at = now()
+        RETURNING table_name, version
+    """), {"tables": tables})
+    versions = {name: version for name, version in result}
+    conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps(versions)})
+    print(f"🔖 Dataversies opgehoogd: {versions}")
+    return versions
+
+
+def _poll_versions():
+    global _last_poll
+    try:
+        with get_engine().connect() as conn:
+            rows = conn.execute(text("SELECT table_name, version FROM data_versions")).fetchall()
+        with _versions_lock:
+            _versions.update({name: version for name, version in rows})
+    except Exception as e:
+        print(f"⚠️ Dataversies niet op te halen, vorige versies blijven gelden: {e}")
+    _last_poll = time.time()
+
+
+def _listen_forever():
+    """LISTEN op een eigen (uit de pool losgemaakte) verbinding; bij een fout opnieuw verbinden."""
+    while True:
+        try:
+            raw = get_engine().raw_connection()
+            raw.detach()  # Nooit terug in de pool: deze verbinding blijft open voor LISTEN
+            pg = raw.dbapi_connection
+            pg.autocommit = True
+            pg.cursor().execute(f"LISTEN {CHANNEL}")
+            # Versies van vóór de LISTEN niet missen
+            _poll_versions()
+            _listening.set()
+            while True:
+                if select.select([pg], [], [], 60) == ([], [], []):
+                    continue
+                pg.poll()
+                while pg.notifies:
+                    notify = pg.notifies.pop(0)
+                    with _versions_lock:
+                        _versions.update(json.loads(notify.payload))
+        except Exception as e:
+            _listening.clear()
+            print(f"⚠️ LISTEN {CHANNEL} onderbroken, opnieuw verbinden over {RECONNECT_SECONDS}s: {e}")
+            time.sleep(RECONNECT_SECONDS)
+
+
+def _ensure_listener():
+    global _listener
+    with _versions_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen_forever, name="data-versions-listener", daemon=True)
+            _listener.start()
+
+
+def current_versions(tables) -> dict:
+    """Huidige versie per tabel (None als de loader de tabel nog nooit heeft opgehoogd)."""
+    _ensure_listener()
+    if not _listening.is_set() and time.time() - _last_poll > POLL_SECONDS:
+        _poll_versions()
+    with _versions_lock:
+        return {table: _versions.get(table) for table in sorted(tables)}
@@ -0,0 +1,392 @@
+"""
+Embedded DuckDB-kopie van de dashboardtabellen (data_cache/dashboard.duckdb).
+
+utils/data_loaders.load_data vraagt eerst deze lokale store; Postgres is de terugval als
+duckdb niet geïnstalleerd is, een tabel nog niet lokaal staat of de query faalt.
+Verversen gebeurt per tabel:
+
+- delta sync vanuit Postgres: alleen id's waarvan de row_hash anders is (of die nieuw/weg zijn)
+  worden opgehaald of verwijderd; tabellen zonder row_hash worden volledig herladen;
+- of volledig vanuit de parquet-output van de ingestie (data_cache/<tabel>.parquet).
+
+Een tabel waarvan de dataversie (utils/data_versions.py) veranderd is, of zonder bekende versie
+ouder is dan STORE_MAX_AGE_MINUTES, wordt op de achtergrond gesynct. Loopt de store achter op een
+bekende versie, dan gaan de queries tot die sync klaar is naar Postgres: de resultaatcache slaat
+resultaten op onder de huidige versie en mag dus nooit data van een oudere versie krijgen. Zonder
+bekende versie serveert de store de bestaande data zolang de sync loopt.
+
+DuckDB staat maar één proces met een schrijfverbinding toe. De dashboards (ook met meerdere
+Streamlit-workers) openen het bestand daarom alleen-lezen. Er is per keer één schrijver (lockbestand
+naast de store): die synct in een kopie en zet die met een atomaire rename op zijn plek, waarna
+de lezers bij hun volgende query het nieuwe bestand openen.
+
+Handmatig: python -m utils.duckdb_store [--parquet]
+"""
+import fcntl
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from utils.data_loaders import DATA_DIR, AGGREGATES, get_engine, _identifier
+from utils.gripp_schema import ROW_HASH_COLUMN
+from utils.data_versions import current_versions
+
+try:
+    import duckdb
+except ImportError:  # Optioneel: zonder duckdb gaat alles rechtstreeks naar Postgres
+    duckdb = None
+
+STORE_PATH = os.getenv("DUCKDB_STORE_PATH", str(DATA_DIR / "dashboard.duckdb"))
+STORE_ENABLED = duckdb is not None and os.getenv("DUCKDB_STORE", "1") != "0"
+STORE_MAX_AGE_MINUTES = int(os.getenv("DUCKDB_STORE_MAX_AGE_MINUTES", "30"))
+
+STORE_TABLES = [
+    "projects", "projectlines_per_company", "invoices", "companies",
+    "employees", "urenregistratie", "tasks", "tasktypes",
+]
+
+# Aantal id's per delta-fetch uit Postgres
+DELTA_CHUNK = 5000
+
+_DUCKDB_AGGREGATES = {
+    "sum": "SUM({})",
+    "avg": "AVG({})",
+    "min": "MIN({})",
+    "max": "MAX({})",
+    "count": "COUNT({})",
+    "count_distinct": "COUNT(DISTINCT {})",
+}
+
+# Na een mislukte open wordt de store zo lang overgeslagen (geen poging en melding per query)
+STORE_RETRY_SECONDS = int(os.getenv("DUCKDB_STORE_RETRY_SECONDS", "60"))
+
+_reader = {"connection": None, "identity": None, "failed_at": None}
+_reader_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_pending = set()
+_sync_thread = None
+
+
+def _file_identity():
+    """(inode, mtime) van het storebestand; verandert bij elke swap door de schrijver."""
+    try:
+        st = os.stat(STORE_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _connect():
+    """
+    Read-only cursor op de store. Alleen-lezen verbindingen van meerdere processen sluiten
+    elkaar niet uit; na een swap door de schrijver wordt het nieuwe bestand geopend. None als
+    er (nog) geen store is of het openen recent mislukte.
+    """
+    with _reader_lock:
+        identity = _file_identity()
+        if identity is None:
+            return None
+        if _reader["failed_at"] is not None and time.time() - _reader["failed_at"] < STORE_RETRY_SECONDS:
+            return None
+        if _reader["connection"] is None or _reader["identity"] != identity:
+            if _reader["connection"] is not None:
+                # DuckDB hergebruikt per pad de open database: zonder close blijft het oude bestand
+                # in beeld. Een query die nu nog op de oude verbinding loopt valt één keer terug op Postgres.
+                _reader["connection"].close()
+                _reader["connection"] = None
+            try:
+                _reader["connection"] = duckdb.connect(STORE_PATH, read_only=True)
+            except Exception as e:
+                _reader["failed_at"] = time.time()
+                print(f"⚠️ DuckDB-store niet te openen, {STORE_RETRY_SECONDS}s terugval op Postgres: {e}")
+                return None
+            _reader.update(identity=identity, failed_at=None)
+        return _reader["connection"].cursor()
+
+
+@contextmanager
+def _writer(wait: bool = False):
+    """
+    De enige schrijver: werkt op een kopie (STORE_PATH.build) en zet die na afloop met een
+    atomaire os.replace op zijn plek. Een lockbestand zorgt dat er per machine één schrijver
+    tegelijk is; zonder wait levert een bezette lock None op (een ander proces synct al).
+    """
+    os.makedirs(os.path.dirname(STORE_PATH) or ".", exist_ok=True)
+    lock_file = open(f"{STORE_PATH}.lock", "w")
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield None
+            return
+        build_path = f"{STORE_PATH}.build"
+        for stale in (build_path, f"{build_path}.wal"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        if os.path.exists(STORE_PATH):
+            shutil.copyfile(STORE_PATH, build_path)
+        connection = duckdb.connect(build_path)
+        try:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS _store_sync (
+                    table_name VARCHAR PRIMARY KEY, synced_at TIMESTAMP, source VARCHAR
+                )
+            """)
+            connection.execute("ALTER TABLE _store_sync ADD COLUMN IF NOT EXISTS version BIGINT")
+            yield connection.cursor()
+            connection.execute("CHECKPOINT")
+        finally:
+            connection.close()
+        os.replace(build_path, STORE_PATH)
+    finally:
+        lock_file.close()
+
+
+def _has_table(cur, table_name: str) -> bool:
+    return cur.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table_name]
+    ).fetchone()[0] > 0
+
+
+def _mark_synced(cur, table_name: str, source: str, version=None):
+    cur.execute("DELETE FROM _store_sync WHERE table_name = ?", [table_name])
+    cur.execute(
+        "INSERT INTO _store_sync (table_name, synced_at, source, version) VALUES (?, ?, ?, ?)",
+        [table_name, datetime.now(), source, version],
+    )
+
+
+def _sync_state(cur, table_name: str):
+    """(synced_at, version) van de laatste sync, of (None, None)."""
+    if not _has_table(cur, "_store_sync"):
+        return (None, None)
+    row = cur.execute("SELECT synced_at, version FROM _store_sync WHERE table_name = ?", [table_name]).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def _load_frame(cur, table_name: str, df: pd.DataFrame, statement: str):
+    # Categoricals als tekst: een DuckDB ENUM zou latere delta-inserts met nieuwe waarden weigeren
+    df = df.astype({c: "string" for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    cur.register("incoming", df)
+    cur.execute(statement.format(table=table_name))
+    cur.unregister("incoming")
+
+
+def _refresh_from_parquet(cur, table_name: str, path=None) -> int:
+    path = str(path or DATA_DIR / f"{_identifier(table_name)}.parquet")
+    cur.execute("BEGIN TRANSACTION")
+    cur.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM read_parquet(?)", [path])
+    _mark_synced(cur, table_name, "parquet")
+    cur.execute("COMMIT")
+    return cur.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+
+def refresh_from_parquet(table_name: str, path=None) -> int:
+    """Vervangt een tabel in de store door de parquet-output van de ingestie; geeft het aantal rijen terug."""
+    with _writer(wait=True) as cur:
+        return _refresh_from_parquet(cur, table_name, path)
+
+
+def _sync_table(cur, table_name: str, engine) -> dict:
+    _identifier(table_name)
+    # Versie vóór het lezen: een load die tijdens de sync binnenkomt geeft daarna opnieuw een sync
+    version = current_versions([table_name])[table_name]
+    with engine.connect() as conn:
+        remote_columns = [row[0] for row in conn.execute(text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = :table_name ORDER BY ordinal_position
+        """), {"table_name": table_name})]
+        local_columns = (
+            [row[0] for row in cur.execute(f"DESCRIBE {table_name}").fetchall()]
+            if _has_table(cur, table_name) else []
+        )
+        if ROW_HASH_COLUMN not in remote_columns or "id" not in remote_columns or local_columns != remote_columns:
+            df = pd.read_sql(text(f"SELECT * FROM {table_name}"), conn)
+            cur.execute("BEGIN TRANSACTION")
+            _load_frame(cur, table_name, df, "CREATE OR REPLACE TABLE {table} AS SELECT * FROM incoming")
+            _mark_synced(cur, table_name, "postgres", version)
+            cur.execute("COMMIT")
+            return {"table": table_name, "mode": "volledig", "rows": len(df)}
+
+        remote = pd.read_sql(text(f"SELECT id, {ROW_HASH_COLUMN} FROM {table_name}"), conn)
+        local = cur.execute(f"SELECT id, {ROW_HASH_COLUMN} FROM {table_name}").df()
+        merged = remote.merge(local, on="id", how="outer", suffixes=("_remote", "_local"), indicator=True)
+        changed = merged[
+            (merged["_merge"] == "left_only")
+            | ((merged["_merge"] == "both")
+               & (merged[f"{ROW_HASH_COLUMN}_remote"] != merged[f"{ROW_HASH_COLUMN}_local"]))
+        ]["id"].astype("int64").tolist()
+        removed = merged[merged["_merge"] == "right_only"]["id"].astype("int64").tolist()
+
+        fetched = [
+            pd.read_sql(text(f"SELECT * FROM {table_name} WHERE id = ANY(:ids)"), conn,
+                        params={"ids": changed[i:i + DELTA_CHUNK]})
+            for i in range(0, len(changed), DELTA_CHUNK)
+        ]
+
+    cur.execute("BEGIN TRANSACTION")
+    if changed or removed:
+        cur.execute(f"DELETE FROM {table_name} WHERE list_contains(?, id)", [changed + removed])
+    for df in fetched:
+        _load_frame(cur, table_name, df, "INSERT INTO {table} SELECT * FROM incoming")
+    _mark_synced(cur, table_name, "postgres", version)
+    cur.execute("COMMIT")
+    return {"table": table_name, "mode": "delta", "changed": len(changed), "removed": len(removed)}
+
+
+def sync_table(table_name: str, engine=None) -> dict:
+    """
+    Delta sync van één tabel vanuit Postgres op basis van (id, row_hash). Bij een nieuwe tabel,
+    een gewijzigde kolomset of een tabel zonder row_hash wordt de tabel volledig herladen.
+    """
+    return sync_tables([table_name], engine, wait=True)[0]
+
+
+def sync_tables(table_names, engine=None, wait: bool = False) -> list:
+    """Synct de tabellen in één schrijfsessie (één kopie en één swap); [] als een ander proces al schrijft."""
+    engine = engine or get_engine()
+    with _writer(wait=wait) as cur:
+        if cur is None:
+            return []
+        return [_sync_table(cur, table_name, engine) for table_name in table_names]
+
+
+def _sync_in_background(table_name: str):
+    """
+    Zet de tabel op de wachtrij van de achtergrond-sync van dit proces. Die draait als enige
+    schrijver; is de lock bezet, dan synct een ander proces al en pakt dit proces de nieuwe store
+    vanzelf op. Fouten (bv. Postgres onbereikbaar) laten de store ongemoeid.
+    """
+    global _sync_thread
+    with _sync_lock:
+        _pending.add(table_name)
+        if _sync_thread is not None and _sync_thread.is_alive():
+            return
+
+        def run():
+            while True:
+                with _sync_lock:
+                    tables = sorted(_pending)
+                    _pending.clear()
+                if not tables:
+                    return
+                try:
+                    sync_tables(tables)
+                except Exception as e:
+                    print(f"⚠️ DuckDB-sync van {', '.join(tables)} mislukt, store blijft op de vorige stand: {e}")
+                    return
+
+        _sync_thread = threading.Thread(target=run, name="duckdb-sync", daemon=True)
+        _sync_thread.start()
+
+
+def _render(table_name, columns, filters, date_range, aggregates, group_by, order_by, limit):
+    """Dezelfde query-specificatie als data_loaders.build_query, als DuckDB-SQL met ?-parameters."""
+    params = []
+    group_by = [_identifier(c) for c in (group_by or [])]
+    selected = [_identifier(c) for c in columns] if columns else list(group_by)
+    for alias, (func_name, col) in (aggregates or {}).items():
+        if func_name not in _DUCKDB_AGGREGATES:
+            raise ValueError(f"Onbekende aggregatie '{func_name}', kies uit {', '.join(AGGREGATES)}")
+        target = "*" if col == "*" else _identifier(col)
+        selected.append(f"{_DUCKDB_AGGREGATES[func_name].format(target)} AS {_identifier(alias)}")
+
+    conditions = []
+    for col, value in (filters or {}).items():
+        col = _identifier(col)
+        if value is None:
+            conditions.append(f"{col} IS NULL")
+        elif isinstance(value, (list, tuple, set, frozenset, np.ndarray, pd.Index, pd.Series)):
+            values = [v.item() if hasattr(v, "item") else v for v in list(value) if not pd.isna(v)]
+            conditions.append(f"list_contains(?, {col})")
+            params.append([int(v) if isinstance(v, float) and v.is_integer() else v for v in values])
+        else:
+            conditions.append(f"{col} = ?")
+            params.append(value.item() if hasattr(value, "item") else value)
+    for col, (start, end) in (date_range or {}).items():
+        col = f"CAST({_identifier(col)} AS DATE)"
+        if start is not None:
+            conditions.append(f"{col} >= CAST(? AS DATE)")
+            params.append(str(start))
+        if end is not None:
+            conditions.append(f"{col} <= CAST(? AS DATE)")
+            params.append(str(end))
+
+    sql = f"SELECT {', '.join(selected) or '*'} FROM {_identifier(table_name)}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if group_by:
+        sql += " GROUP BY " + ", ".join(group_by)
+    if order_by:
+        sql += " ORDER BY " + ", ".join(
+            f"{_identifier(c[1:])} DESC" if c.startswith("-") else _identifier(c) for c in order_by
+        )
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return sql, params
+
+
+def query_store(table_name, columns=None, filters=None, date_range=None, aggregates=None,
+                group_by=None, order_by=None, limit=None) -> pd.DataFrame | None:
+    """
+    Voert de query uit op de lokale store. None betekent 'vraag Postgres': store uit, tabel nog
+    niet aanwezig (de eerste sync start dan op de achtergrond) of een fout in DuckDB.
+    """
+    if not STORE_ENABLED or table_name not in STORE_TABLES:
+        return None
+    try:
+        cur = _connect()
+        if cur is None:
+            if _file_identity() is None:
+                _sync_in_background(table_name)
+            return None
+        synced_at, synced_version = _sync_state(cur, table_name) if _has_table(cur, table_name) else (None, None)
+        version = current_versions([table_name])[table_name]
+        if version is not None:
+            behind = synced_version is None or synced_version < version
+            if behind:
+                # Achter op een bekende versie: niet de oude data teruggeven, want de aanroeper
+                # (bv. @arrow_cache) bewaart het resultaat onder de nieuwe versie en ververst dan nooit meer
+                _sync_in_background(table_name)
+                return None
+        elif synced_at is None or (datetime.now() - synced_at).total_seconds() > STORE_MAX_AGE_MINUTES * 60:
+            # Zonder versie: de bestaande data serveren zolang de sync op de achtergrond loopt
+            _sync_in_background(table_name)
+        if synced_at is None:
+            return None
+        sql, params = _render(table_name, columns, filters, date_range, aggregates, group_by, order_by, limit)
+        return cur.execute(sql, params).df()
+    except Exception as e:
+        print(f"⚠️ DuckDB-query op '{table_name}' mislukt, terugval op Postgres: {e}")
+        return None
+
+
+def main():
+    if duckdb is None:
+        raise SystemExit("duckdb is niet geïnstalleerd: pip install duckdb")
+    from_parquet = "--parquet" in sys.argv
+    engine = get_engine()
+    # Eén schrijfsessie voor alle tabellen; wacht als een dashboard-proces net synct
+    with _writer(wait=True) as cur:
+        for table_name in STORE_TABLES:
+            start = time.perf_counter()
+            if from_parquet:
+                if not (DATA_DIR / f"{table_name}.parquet").exists():
+                    print(f"⚠️ Geen parquet voor '{table_name}', overgeslagen.")
+                    continue
+                result = {"table": table_name, "mode": "parquet", "rows": _refresh_from_parquet(cur, table_name)}
+            else:
+                result = _sync_table(cur, table_name, engine)
+            print(f"✅ {result} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
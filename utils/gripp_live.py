@@ -0,0 +1,104 @@
+import os
+import time
+from datetime import date
+
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+
+from utils.gripp_schema import enforce_schema
+
+BASE_URL = "https://api.gripp.com/public/api3.php"
+
+# Alleen de velden die werkverdeling nodig heeft; houdt de live call klein
+LIVE_HOUR_FIELDS = [
+    "id", "amount", "description", "date",
+    "employee", "offerprojectbase", "task", "status",
+]
+
+# Boven dit aantal projecten filteren we lokaal i.p.v. een grote 'in' filter te sturen
+MAX_PROJECT_FILTER_IDS = 200
+
+
+def _get_headers() -> dict:
+    load_dotenv()
+    api_key = os.getenv("GRIPP_API_KEY")
+    if not api_key:
+        raise ValueError("GRIPP_API_KEY is not set in the environment.")
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def _post(payload: list, headers: dict, max_retries: int = 3) -> requests.Response:
+    """POST naar Gripp met een korte retry bij 429 (een dashboard mag niet minuten blokkeren)."""
+    response = requests.post(BASE_URL, headers=headers, json=payload, timeout=15)
+    for _ in range(max_retries):
+        if response.status_code != 429:
+            break
+        time.sleep(2)
+        response = requests.post(BASE_URL, headers=headers, json=payload, timeout=15)
+    response.raise_for_status()
+    return response
+
+
+def _nested_value(x, key):
+    return x.get(key) if isinstance(x, dict) else None
+
+
+def fetch_live_hours(project_ids: list, day: date | None = None) -> pd.DataFrame:
+    """
+    Haalt alleen de urenregels van één dag (standaard vandaag) op via hour.get,
+    gefilterd op datum en projecten. Geeft dezelfde kolommen terug als de
+    urenregistratie-query in werkverdeling, plus 'id' en 'status_searchname'.
+    """
+    columns = ["id", "employee_id", "task_id", "offerprojectbase_id", "amount", "date_date", "description", "status_searchname"]
+    if not project_ids:
+        return pd.DataFrame(columns=columns)
+
+    day = day or date.today()
+    filters = [{"field": "hour.date", "operator": "equals", "value": day.strftime("%Y-%m-%d")}]
+    if len(project_ids) <= MAX_PROJECT_FILTER_IDS:
+        filters.append({"field": "hour.offerprojectbase", "operator": "in", "value": [int(pid) for pid in project_ids]})
+
+    headers = _get_headers()
+    all_rows = []
+    start = 0
+    max_results = 250
+    watchdog = 20
+    while watchdog > 0:
+        payload = [{
+            "id": 1,
+            "method": "hour.get",
+            "params": [
+                filters,
+                {
+                    "paging": {"firstresult": start, "maxresults": max_results},
+                    "fields": LIVE_HOUR_FIELDS,
+                }
+            ]
+        }]
+        data = _post(payload, headers).json()
+        result = data[0].get("result", {})
+        all_rows.extend(result.get("rows", []))
+        if not result.get("more_items_in_collection", False):
+            break
+        start = result.get("next_start", start + max_results)
+        watchdog -= 1
+
+    if not all_rows:
+        return pd.DataFrame(columns=columns)
+
+    raw = pd.DataFrame(all_rows)
+    df = pd.DataFrame({
+        "id": raw["id"],
+        "employee_id": raw["employee"].apply(lambda x: _nested_value(x, "id")),
+        "task_id": raw["task"].apply(lambda x: _nested_value(x, "id")),
+        "offerprojectbase_id": raw["offerprojectbase"].apply(lambda x: _nested_value(x, "id")),
+        "amount": pd.to_numeric(raw["amount"], errors="coerce"),
+        "date_date": raw["date"].apply(lambda x: _nested_value(x, "date")),
+        "description": raw.get("description"),
+        "status_searchname": raw["status"].apply(lambda x: _nested_value(x, "searchname")),
+    })
+    # Veiligheidsnet voor de ongefilterde variant en voor afwijkende API-filters
+    df = df[df["offerprojectbase_id"].isin(project_ids)]
+    # Parseert date_date één keer met het vaste Gripp-formaat naar date32
+    return enforce_schema(df.reset_index(drop=True), "urenregistratie")
@@ -0,0 +1,390 @@
+import json
+from datetime import date, datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Vaste datumnotatie van Gripp, bv. '2019-12-06 10:03:47.000000'
+GRIPP_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Per Gripp-endpoint: welke kolommen geneste objecten bevatten (dicts zoals
+# {'id': .., 'searchname': ..} of {'date': .., 'timezone_type': .., 'timezone': ..})
+# en welke geflatte kolommen een andere naam krijgen. 'scalar_key' bepaalt onder welk
+# subveld een losse (niet-dict) waarde terechtkomt; standaard is dat 'id'. Kolommen in
+# 'keep' worden nooit geflat.
+# Subvelden worden geflat naar '<kolom>_<subveld>', bv. 'task' -> 'task_id', 'task_searchname'.
+GRIPP_ENDPOINTS = {
+    "project.get": {
+        "nested": ["company", "phase", "accountmanager", "contact", "identity",
+                   "startdate", "deadline", "enddate", "createdon", "updatedon"],
+    },
+    "employee.get": {
+        "nested": ["department", "role", "identity", "employeesince", "createdon", "updatedon"],
+    },
+    "company.get": {
+        "nested": ["accountmanager", "identity", "createdon", "updatedon"],
+    },
+    "invoice.get": {
+        "nested": ["company", "client", "identity", "status", "date", "reportdate",
+                   "expirydate", "createdon", "updatedon"],
+    },
+    "invoiceline.get": {
+        "nested": ["invoice", "product", "createdon", "updatedon"],
+    },
+    "hour.get": {
+        "nested": ["employee", "offerprojectbase", "task", "status", "authorizedby",
+                   "date", "definitiveon", "createdon", "updatedon"],
+    },
+    "tasktype.get": {
+        "nested": ["createdon", "updatedon"],
+    },
+    "task.get": {
+        "nested": [],
+        # 'type' blijft bewust een object: werkverdeling leest het als dict-string
+        "keep": ["type"],
+    },
+    "offerprojectline.get": {
+        "nested": ["unit", "product", "offerprojectbase", "rowtype", "invoicebasis", "vat",
+                   "groupcategory", "convertto", "contractline", "status", "createdon", "updatedon",
+                   "amountwritten"],
+        "scalar_key": {"amountwritten": "value"},
+        "rename": {"amountwritten_value": "amountwritten"},
+    },
+}
+
+
+def _first_valid(values: pd.Series):
+    idx = values.first_valid_index()
+    return None if idx is None else values[idx]
+
+
+def _unnest_column(values: pd.Series, col: str, scalar_key: str = "id") -> pd.DataFrame:
+    """
+    Zet één kolom met geneste objecten om naar losse kolommen '<col>_<subveld>'.
+    Gebruikt Arrow struct-unnesting (kolomsgewijs); valt terug op pd.json_normalize
+    als de kolom gemengde types bevat (bv. soms een dict, soms een los id).
+    """
+    try:
+        arr = pa.array(values.tolist(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        arr = None
+
+    if arr is not None and pa.types.is_struct(arr.type):
+        children = arr.flatten()
+        data = {f"{col}_{arr.type.field(i).name}": child.to_pandas().set_axis(values.index) for i, child in enumerate(children)}
+        return pd.DataFrame(data, index=values.index)
+
+    # Fallback: losse waarden (geen dict) komen onder scalar_key terecht
+    records = [
+        x if isinstance(x, dict) else ({} if x is None or (isinstance(x, float) and pd.isna(x)) else {scalar_key: x})
+        for x in values.tolist()
+    ]
+    expanded = pd.json_normalize(records, max_level=0)
+    expanded.index = values.index
+    expanded.columns = [f"{col}_{subcol}" for subcol in expanded.columns]
+    return expanded
+
+
+def flatten_gripp_frame(df: pd.DataFrame, method: str | None = None) -> pd.DataFrame:
+    """
+    Flat alle geneste kolommen van een Gripp-response in één keer.
+    Eerst de kolommen die in GRIPP_ENDPOINTS voor `method` staan (zodra er ergens een dict
+    in staat), daarna (voor onbekende velden) elke object-kolom waarvan de eerste waarde een dict is.
+    Idempotent: een al geflatte DataFrame komt ongewijzigd terug.
+    """
+    if df.empty:
+        return df
+
+    schema = GRIPP_ENDPOINTS.get(method or "", {})
+    keep = schema.get("keep", [])
+    nested = [c for c in schema.get("nested", []) if c in df.columns]
+    # Onbekende dict-kolommen: check alleen de eerste geldige waarde i.p.v. een apply over alle rijen
+    for col in df.columns:
+        if col in nested or col in keep or df[col].dtype != object:
+            continue
+        if isinstance(_first_valid(df[col]), dict):
+            nested.append(col)
+
+    if not nested:
+        return df.rename(columns=schema.get("rename", {}))
+
+    scalar_keys = schema.get("scalar_key", {})
+    declared = set(schema.get("nested", []))
+    expanded = []
+    unnested = []
+    for col in nested:
+        if col in declared:
+            # Gedeclareerde kolommen kunnen gemengd zijn (bv. amountwritten: soms '1.5', soms
+            # {'value': '2.0'}): uitpakken zodra er ergens een dict in staat, losse waarden via scalar_key
+            if not any(isinstance(x, dict) for x in df[col].tolist()):
+                continue
+        elif not isinstance(_first_valid(df[col]), dict):
+            # Kolom bevat geen objecten (bv. al geflat uit cache of overal leeg)
+            continue
+        expanded.append(_unnest_column(df[col], col, scalar_keys.get(col, "id")))
+        unnested.append(col)
+
+    # Geflatte kolommen overschrijven eventuele bestaande kolommen met dezelfde naam
+    new_cols = [c for e in expanded for c in e.columns]
+    base = df.drop(columns=unnested + [c for c in new_cols if c in df.columns and c not in unnested])
+    result = pd.concat([base, *expanded], axis=1)
+    return result.rename(columns=schema.get("rename", {}))
+
+
+# === Typed schema registry per databasetabel ===
+# Types: 'id' (Int64), 'int32' (Int32), 'money'/'float' (float64), 'category',
+# 'date' (Arrow date32) en 'bool' (nullable boolean). Kolommen die hier niet
+# staan (vrije tekst) blijven ongewijzigd, behalve '*_date' kolommen: die zijn altijd 'date'.
+PANDAS_DTYPES = {
+    "id": pd.Int64Dtype(),
+    "int32": pd.Int32Dtype(),
+    "money": "float64",
+    "float": "float64",
+    "category": "category",
+    "date": pd.ArrowDtype(pa.date32()),
+    "bool": pd.BooleanDtype(),
+}
+
+TABLE_SCHEMAS = {
+    "projects": {
+        "id": "id", "number": "int32",
+        "totalinclvat": "money", "totalexclvat": "money", "archived": "bool",
+        "startdate_date": "date", "deadline_date": "date", "enddate_date": "date", "updatedon_date": "date",
+        "accountmanager_id": "id", "phase_id": "id", "phase_searchname": "category",
+        "company_id": "id", "contact_id": "id",
+    },
+    "employees": {
+        "id": "id", "active": "bool", "employeesince_date": "date",
+        "department_id": "id", "role_id": "id", "updatedon_date": "date", "identity_id": "id",
+    },
+    "companies": {
+        "id": "id", "accountmanager_id": "id", "createdon_date": "date", "updatedon_date": "date",
+    },
+    "tasktypes": {
+        "id": "id", "createdon_date": "date", "updatedon_date": "date",
+    },
+    "tasks": {
+        "id": "id", "number": "int32", "estimatedhours": "float",
+    },
+    "urenregistratie": {
+        "id": "id", "amount": "float", "date_date": "date",
+        "employee_id": "id", "offerprojectbase_id": "id", "task_id": "id",
+        "status_id": "id", "status_searchname": "category",
+        "authorizedby_id": "id", "definitiveon_date": "date", "updatedon_date": "date",
+    },
+    "invoices": {
+        "id": "id", "reportdate_date": "date", "date_date": "date",
+        "status_id": "id", "status_searchname": "category",
+        "totalinclvat": "money", "totalpayed": "money",
+        "company_id": "id", "client_id": "id", "identity_searchname": "category",
+    },
+    "projectlines_per_company": {
+        "id": "id", "_ordering": "int32",
+        "amount": "float", "amountwritten": "float",
+        "sellingprice": "money", "buyingprice": "money", "discount": "float",
+        "hidefortimewriting": "bool", "hidedetails": "bool",
+        "createdon_date": "date", "updatedon_date": "date",
+        "unit_id": "id", "unit_searchname": "category",
+        "product_id": "id", "rowtype_id": "id", "rowtype_searchname": "category",
+        "invoicebasis_id": "id", "invoicebasis_searchname": "category",
+        "vat_id": "id", "status_searchname": "category",
+        "offerprojectbase_id": "id", "bedrijf_id": "id",
+    },
+}
+
+
+def parse_gripp_dates(values: pd.Series) -> pd.Series:
+    """
+    Parse Gripp-datumstrings in één vectorized pass met de vaste GRIPP_DATE_FORMAT.
+    Alleen waarden die niet in dat formaat staan (bv. al 'YYYY-MM-DD') gaan via ISO8601.
+    """
+    ts = pd.to_datetime(values, format=GRIPP_DATE_FORMAT, errors="coerce")
+    missed = ts.isna() & values.notna()
+    if missed.any():
+        ts[missed] = pd.to_datetime(values[missed], format="ISO8601", errors="coerce")
+    return ts
+
+
+def _to_date32(values: pd.Series) -> pd.Series:
+    first = _first_valid(values)
+    if isinstance(first, date) and not isinstance(first, datetime):
+        # Python date-objecten (bv. uit Postgres DATE): direct naar Arrow, geen parsing nodig
+        arr = pa.array(values.tolist(), type=pa.date32(), from_pandas=True)
+    else:
+        ts = parse_gripp_dates(values) if isinstance(first, str) else pd.to_datetime(values, errors="coerce")
+        arr = pa.array(ts.dt.normalize(), from_pandas=True).cast(pa.date32())
+    return pd.Series(pd.arrays.ArrowExtensionArray(arr), index=values.index, name=values.name)
+
+
+def month_key(dates: pd.Series) -> pd.Series:
+    """'YYYY-MM' label voor een date32-kolom, kolomsgewijs via Arrow (zonder opnieuw te parsen)."""
+    if not isinstance(dates.dtype, pd.ArrowDtype):
+        dates = _to_date32(dates)
+    arr = pa.Table.from_pandas(dates.to_frame(), preserve_index=False).column(0).cast(pa.timestamp("s"))
+    return pd.Series(pc.strftime(arr, format="%Y-%m").to_pandas().to_numpy(), index=dates.index, name=dates.name)
+
+
+def _cast_column(values: pd.Series, type_key: str) -> pd.Series:
+    dtype = PANDAS_DTYPES[type_key]
+    if values.dtype == dtype:
+        return values
+    if type_key == "date":
+        return _to_date32(values)
+    if type_key in ("id", "int32"):
+        return pd.to_numeric(values, errors="coerce").astype(dtype)
+    if type_key in ("money", "float"):
+        return pd.to_numeric(values, errors="coerce").astype(dtype)
+    return values.astype(dtype)
+
+
+def enforce_schema(df: pd.DataFrame, table_name: str) -> pd.DataFrame:
+    """
+    Zet de kolommen van `df` om naar de compacte types uit TABLE_SCHEMAS[table_name].
+    Alleen kolommen die in zowel de DataFrame als het schema staan worden aangepast;
+    een kolom die niet te converteren is blijft ongewijzigd (met een waarschuwing).
+    """
+    schema = dict(TABLE_SCHEMAS.get(table_name, {}))
+    # Datumkolommen worden hier één keer geparsed; downstream hoeft niemand dat opnieuw te doen
+    schema.update({c: "date" for c in df.columns if c.endswith("_date") and c not in schema})
+    if not schema or df.empty:
+        return df
+    df = df.copy()
+    for col, type_key in schema.items():
+        if col not in df.columns:
+            continue
+        try:
+            df[col] = _cast_column(df[col], type_key)
+        except (TypeError, ValueError, pa.ArrowException) as e:
+            print(f"⚠️ Kolom '{table_name}.{col}' kon niet naar '{type_key}' worden omgezet: {e}")
+    return df
+
+
+# === Arrow-varianten van het schema-register (voor de Arrow-ingestie in gripp_arrow.py) ===
+ARROW_TYPES = {
+    "id": pa.int64(),
+    "int32": pa.int32(),
+    "money": pa.float64(),
+    "float": pa.float64(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "date": pa.date32(),
+    "bool": pa.bool_(),
+}
+
+
+def flatten_arrow_table(table: pa.Table, method: str | None = None) -> pa.Table:
+    """
+    Arrow-tegenhanger van flatten_gripp_frame: struct-kolommen worden kolomsgewijs
+    uitgepakt naar '<kolom>_<subveld>' (zonder pandas), met dezelfde 'keep'/'rename' regels.
+    """
+    schema = GRIPP_ENDPOINTS.get(method or "", {})
+    keep = schema.get("keep", [])
+    rename = schema.get("rename", {})
+    names, columns = [], []
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_struct(column.type) and name not in keep:
+            for i, child in enumerate(column.flatten()):
+                names.append(f"{name}_{column.type.field(i).name}")
+                columns.append(child)
+        else:
+            names.append(name)
+            columns.append(column)
+    names = [rename.get(n, n) for n in names]
+    return pa.Table.from_arrays(columns, names=names)
+
+
+def _arrow_to_date32(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    if pa.types.is_date32(column.type):
+        return column
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        # Gripp-formaat 'YYYY-MM-DD HH:MM:SS.ffffff': de eerste 10 tekens zijn de ISO-datum
+        return pc.cast(pc.utf8_slice_codeunits(column, 0, 10), pa.date32())
+    return pc.cast(column, pa.date32())
+
+
+def enforce_arrow_schema(table: pa.Table, table_name: str) -> pa.Table:
+    """Cast de kolommen van een Arrow-tabel volgens TABLE_SCHEMAS, net als enforce_schema voor pandas."""
+    schema = dict(TABLE_SCHEMAS.get(table_name, {}))
+    schema.update({c: "date" for c in table.column_names if c.endswith("_date") and c not in schema})
+    for col, type_key in schema.items():
+        if col not in table.column_names:
+            continue
+        idx = table.column_names.index(col)
+        column = table.column(idx)
+        try:
+            if type_key == "date":
+                cast = _arrow_to_date32(column)
+            elif type_key == "category":
+                cast = pc.dictionary_encode(pc.cast(column, pa.string()))
+            elif pa.types.is_null(column.type):
+                cast = pa.nulls(len(column), ARROW_TYPES[type_key])
+            else:
+                cast = pc.cast(column, ARROW_TYPES[type_key])
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            print(f"⚠️ Kolom '{table_name}.{col}' kon niet naar '{type_key}' worden omgezet: {e}")
+            continue
+        table = table.set_column(idx, col, cast)
+    return table
+
+
+# === Content-hash per rij: de merge werkt alleen rijen bij waarvan de hash veranderd is ===
+ROW_HASH_COLUMN = "row_hash"
+
+
+def _canonical_text(column) -> pa.Array:
+    """
+    Eén tekstweergave per waarde, gelijk voor een pandas- en een Arrow-kolom met dezelfde inhoud:
+    getallen als float64 (int/float-verschillen tellen niet), tijdstempels in microseconden,
+    categorieën gedecodeerd en geneste waarden (lists/structs) als JSON.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        column = pc.cast(column, pa.float64(), safe=False)
+    elif pa.types.is_timestamp(column.type):
+        column = pc.cast(column, pa.timestamp("us", tz=column.type.tz), safe=False)
+    elif pa.types.is_nested(column.type):
+        return pa.array(
+            [None if v is None else json.dumps(v, default=str) for v in column.to_pylist()], type=pa.string()
+        )
+    return pc.cast(column, pa.string())
+
+
+def _pandas_to_arrow(values: pd.Series) -> pa.Array:
+    try:
+        return pa.Array.from_pandas(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Gemengde object-kolom: als tekst, ontbrekende waarden blijven null
+        return pa.array(values.astype(str).where(values.notna(), None), type=pa.string(), from_pandas=True)
+
+
+def _hash_text_columns(columns: dict, index) -> pd.Series:
+    content = pd.DataFrame({name: columns[name].to_pandas() for name in sorted(columns)})
+    hashes = pd.util.hash_pandas_object(content, index=False)
+    # uint64 -> int64 zodat het in een Postgres BIGINT past
+    return pd.Series(hashes.to_numpy().view("int64"), index=index, name=ROW_HASH_COLUMN)
+
+
+def add_row_hash(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Voegt een deterministische 64-bit content-hash per rij toe (kolomvolgorde-onafhankelijk).
+    Gehasht wordt een canonieke tekstvorm, zodat add_row_hash_arrow voor dezelfde rij
+    dezelfde hash geeft: wisselen van loader herschrijft dan geen ongewijzigde rijen.
+    """
+    columns = {
+        c: _canonical_text(_pandas_to_arrow(df[c])) for c in df.columns if c != ROW_HASH_COLUMN
+    }
+    df = df.copy()
+    df[ROW_HASH_COLUMN] = _hash_text_columns(columns, df.index)
+    return df
+
+
+def add_row_hash_arrow(table: pa.Table) -> pa.Table:
+    """Arrow-variant van add_row_hash, over dezelfde canonieke tekstvorm."""
+    if ROW_HASH_COLUMN in table.column_names:
+        table = table.drop_columns([ROW_HASH_COLUMN])
+    columns = {name: _canonical_text(table.column(name)) for name in table.column_names}
+    hashes = _hash_text_columns(columns, pd.RangeIndex(table.num_rows))
+    return table.append_column(ROW_HASH_COLUMN, pa.array(hashes.to_numpy(), type=pa.int64()))
@@ -0,0 +1,67 @@
+"""
+SCD2-historie van de Gripp-tabellen (gripp_<tabel>_history).
+
+Per run worden alleen rijen met een andere row_hash als nieuwe versie opgeslagen: de lopende
+versie krijgt valid_to = runmoment, de nieuwe versie valid_from = runmoment. Rijen die niet
+meer in de volledige snapshot zitten worden afgesloten. Laden gaat via binary COPY.
+
+Stand op moment t:
+    SELECT * FROM gripp_invoices_history
+    WHERE valid_from <= :t AND (valid_to IS NULL OR valid_to > :t)
+"""
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.gripp_schema import add_row_hash, ROW_HASH_COLUMN
+from utils.migrations import migrate_history_table
+from utils.pg_copy import encode_binary_copy
+
+
+def write_history(conn, source_table: str, df: pd.DataFrame, run_at: datetime | None = None) -> dict:
+    """
+    Verwerkt een volledige snapshot van source_table in gripp_<source_table>_history binnen de
+    transactie van conn. Geeft het aantal nieuwe, gewijzigde en afgesloten rijen terug.
+    """
+    history_table = f"gripp_{source_table}_history"
+    run_at = run_at or datetime.now(timezone.utc)
+    df = add_row_hash(df.drop_duplicates(subset="id"))
+    migrate_history_table(conn, history_table, source_table, df.head(0))
+
+    result = conn.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_name = :table_name ORDER BY ordinal_position
+    """), {"table_name": history_table})
+    column_types = {name: data_type for name, data_type in result if name in df.columns}
+    columns = list(column_types)
+    column_list = ", ".join(columns)
+
+    staging = f"tmp_{history_table}"
+    conn.execute(text(f"CREATE TEMP TABLE {staging} (LIKE {history_table} INCLUDING DEFAULTS) ON COMMIT DROP"))
+    conn.connection.cursor().copy_expert(
+        f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT binary)",
+        encode_binary_copy(df[columns], column_types),
+    )
+
+    # Lopende versies afsluiten: gewijzigd, of niet meer in de snapshot
+    changed = conn.execute(text(f"""
+        UPDATE {history_table} h SET valid_to = :run_at
+        FROM {staging} s
+        WHERE h.id = s.id AND h.valid_to IS NULL AND h.{ROW_HASH_COLUMN} IS DISTINCT FROM s.{ROW_HASH_COLUMN}
+    """), {"run_at": run_at}).rowcount
+    closed = conn.execute(text(f"""
+        UPDATE {history_table} h SET valid_to = :run_at
+        WHERE h.valid_to IS NULL AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.id = h.id)
+    """), {"run_at": run_at}).rowcount
+    # Nieuwe versies voor alles zonder lopende versie (nieuw of zojuist afgesloten)
+    inserted = conn.execute(text(f"""
+        INSERT INTO {history_table} ({column_list}, valid_from)
+        SELECT {", ".join(f"s.{c}" for c in columns)}, :run_at
+        FROM {staging} s
+        WHERE NOT EXISTS (SELECT 1 FROM {history_table} h WHERE h.id = s.id AND h.valid_to IS NULL)
+    """), {"run_at": run_at}).rowcount
+
+    stats = {"new": inserted - changed, "changed": changed, "closed": closed}
+    print(f"🕓 {history_table}: {stats['new']} nieuw, {changed} gewijzigd, {closed} afgesloten ({len(df)} rijen in snapshot)")
+    return stats
@@ -0,0 +1,192 @@
+"""
+Prefix-som-kubus over kpi_company_daily voor willekeurige periodes zonder databasescan.
+
+Per proces staan alle dagcellen in numpy-arrays, gesorteerd op (bedrijf, dag), met daarnaast
+de cumulatieve som van uren en gefactureerd. Omdat de cellen van één bedrijf
+aaneengesloten liggen, is het totaal van een bedrijf over [start, eind] cum[hi] - cum[lo],
+met lo en hi via twee searchsorted-lookups op de sleutel (bedrijf << 20 | dag). Een periode
+kost zo O(bedrijven · log cellen), hoe lang de historie ook is. Alleen gevulde cellen staan
+in het geheugen (geen bedrijf × dag-matrix).
+
+Verversen gebeurt als de dataversie van de rollups verandert: alleen de bedrijven met cellen
+die sinds de vorige keer zijn bijgewerkt (updated_at) worden opnieuw opgehaald en hun segment
+vervangen; daarna wordt de cumulatieve som opnieuw berekend (één np.cumsum). Klopt het aantal
+cellen daarna niet met de database (bv. een bedrijf waarvan alle cellen verdwenen), dan volgt
+een volledige herlaad.
+"""
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from utils.data_loaders import get_engine
+from utils.data_versions import POLL_SECONDS, current_versions
+
+ROLLUP_TABLES = ["kpi_company_daily", "kpi_company_totals"]
+MEASURES = ["hours", "invoiced"]
+
+# Dagen sinds 1970 passen ruim in 20 bits; de bedrijfsindex komt daarboven in de sleutel
+DAY_BITS = 20
+
+# updated_at is het begin van de loadtransactie (now()); een transactie die later commit dan
+# onze vorige lezing valt zo toch binnen het venster
+REFRESH_OVERLAP = timedelta(hours=1)
+
+_UNSET = object()
+_cube = {
+    "versions": _UNSET,
+    "checked_at": 0.0,
+    "watermark": None,
+    "company": np.empty(0, dtype=np.int64),
+    "day": np.empty(0, dtype=np.int32),
+    "values": np.empty((0, len(MEASURES))),
+    "segments": np.empty(0, dtype=np.int64),
+    "keys": np.empty(0, dtype=np.int64),
+    "cum": np.zeros((1, len(MEASURES))),
+    "totals": pd.DataFrame(),
+}
+_cube_lock = threading.Lock()
+
+
+def _epoch_days(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype("datetime64[D]").astype(np.int32)
+
+
+def _fetch_cells(conn, company_ids=None) -> pd.DataFrame:
+    query = f"SELECT company_id, day, {', '.join(MEASURES)}, updated_at FROM kpi_company_daily"
+    params = {}
+    if company_ids is not None:
+        query += " WHERE company_id = ANY(CAST(:ids AS BIGINT[]))"
+        params["ids"] = [int(c) for c in company_ids]
+    return pd.read_sql(text(query), conn, params=params)
+
+
+def _fetch_totals(conn) -> pd.DataFrame:
+    totals = pd.read_sql(text("""
+        SELECT company_id, planned_revenue, undated_hours, undated_invoiced
+        FROM kpi_company_totals
+    """), conn)
+    for col in totals.columns.drop("company_id"):
+        totals[col] = pd.to_numeric(totals[col], errors="coerce").fillna(0).astype("float64")
+    totals["company_id"] = totals["company_id"].astype("int64")
+    return totals
+
+
+def _store(company: np.ndarray, day: np.ndarray, values: np.ndarray):
+    """Sorteert op (bedrijf, dag) en bouwt sleutels en de cumulatieve som opnieuw op."""
+    order = np.lexsort((day, company))
+    company, day, values = company[order], day[order], values[order]
+    segments, seg_index = np.unique(company, return_inverse=True)
+    _cube.update(
+        company=company,
+        day=day,
+        values=values,
+        segments=segments,
+        keys=(seg_index.astype(np.int64) << DAY_BITS) | day.astype(np.int64),
+        cum=np.vstack([np.zeros((1, len(MEASURES))), np.cumsum(values, axis=0)]),
+    )
+
+
+def _as_arrays(cells: pd.DataFrame):
+    values = np.column_stack([
+        pd.to_numeric(cells[m], errors="coerce").fillna(0).to_numpy(dtype="float64") for m in MEASURES
+    ]) if len(cells) else np.empty((0, len(MEASURES)))
+    return cells["company_id"].to_numpy(dtype=np.int64), _epoch_days(cells["day"]), values
+
+
+def _full_reload(conn):
+    cells = _fetch_cells(conn)
+    _store(*_as_arrays(cells))
+    _cube["watermark"] = cells["updated_at"].max() if len(cells) else None
+    print(f"🧊 KPI-kubus opgebouwd: {len(cells)} dagcellen, {len(_cube['segments'])} bedrijven")
+
+
+def _incremental(conn) -> bool:
+    """Vervangt alleen de segmenten van gewijzigde bedrijven; False als een volledige herlaad nodig is."""
+    if _cube["watermark"] is None:
+        return False
+    since = _cube["watermark"] - REFRESH_OVERLAP
+    dirty = conn.execute(text("""
+        SELECT company_id FROM kpi_company_daily WHERE updated_at > :since
+        UNION
+        SELECT company_id FROM kpi_company_totals WHERE updated_at > :since
+    """), {"since": since}).scalars().all()
+    if dirty:
+        cells = _fetch_cells(conn, dirty)
+        keep = ~np.isin(_cube["company"], np.asarray(dirty, dtype=np.int64))
+        company, day, values = _as_arrays(cells)
+        _store(
+            np.concatenate([_cube["company"][keep], company]),
+            np.concatenate([_cube["day"][keep], day]),
+            np.vstack([_cube["values"][keep], values]),
+        )
+        if len(cells):
+            _cube["watermark"] = max(_cube["watermark"], cells["updated_at"].max())
+    expected = conn.execute(text("SELECT COUNT(*) FROM kpi_company_daily")).scalar() or 0
+    if expected != len(_cube["keys"]):
+        return False
+    if dirty:
+        print(f"🧊 KPI-kubus bijgewerkt: {len(dirty)} bedrijven opnieuw geladen")
+    return True
+
+
+def refresh_cube(force: bool = False):
+    """Brengt de kubus bij als de rollups een nieuwe dataversie hebben (of force=True)."""
+    versions = current_versions(ROLLUP_TABLES)
+    with _cube_lock:
+        unversioned = any(v is None for v in versions.values())
+        if not force and _cube["versions"] == versions and not (
+            unversioned and time.time() - _cube["checked_at"] > POLL_SECONDS
+        ):
+            return
+        with get_engine().connect() as conn:
+            if force or _cube["versions"] is _UNSET or not _incremental(conn):
+                _full_reload(conn)
+            _cube["totals"] = _fetch_totals(conn)
+        _cube["versions"] = versions
+        _cube["checked_at"] = time.time()
+
+
+def period_sums(start: date | None = None, end: date | None = None) -> pd.DataFrame:
+    """
+    Som van uren en gefactureerd per bedrijf over [start, end] (inclusief;
+    None is open). Alleen bedrijven met ten minste één cel in de periode.
+    """
+    refresh_cube()
+    with _cube_lock:
+        segments, keys, cum = _cube["segments"], _cube["keys"], _cube["cum"]
+    first = np.int64(0 if start is None else _epoch_days([start])[0])
+    last = np.int64((1 << DAY_BITS) - 1 if end is None else _epoch_days([end])[0])
+    seg = np.arange(len(segments), dtype=np.int64) << DAY_BITS
+    lo = np.searchsorted(keys, seg | first, side="left")
+    hi = np.searchsorted(keys, seg | last, side="right")
+    sums = cum[hi] - cum[lo]
+    present = hi > lo
+    df = pd.DataFrame(sums[present], columns=MEASURES)
+    df.insert(0, "company_id", segments[present])
+    return df
+
+
+def company_period_kpis(start: date | None = None, end: date | None = None) -> pd.DataFrame:
+    """
+    Zelfde uitkomst als kpi_rollup.load_company_kpis (alle bedrijven), maar uit de kubus:
+    met een periode de dagcellen in [start, end] plus de uren zonder datum; zonder periode
+    alles all-time, inclusief facturen zonder rapportdatum.
+    """
+    period = start is not None and end is not None
+    daily = period_sums(start, end) if period else period_sums()
+    with _cube_lock:
+        totals = _cube["totals"]
+    df = daily.merge(totals, on="company_id", how="outer").fillna(0)
+    result = pd.DataFrame({
+        "bedrijf_id": df["company_id"].astype("Int64"),
+        "totaal_uren": df["hours"] + df["undated_hours"],
+        "totalpayed": df["invoiced"] + (0 if period else df["undated_invoiced"]),
+        "geplande_omzet": df["planned_revenue"],
+    })
+    for col in ["totaal_uren", "totalpayed", "geplande_omzet"]:
+        result[col] = result[col].astype("float64")
+    return result
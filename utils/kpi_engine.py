@@ -0,0 +1,77 @@
+"""
+Gedeelde KPI-engine per bedrijf voor app.py en pages/projectrendement.py.
+
+Eén functie, company_kpis(), levert per bedrijf:
+    totaal_uren, totalpayed, geplande_omzet   (uit de KPI-kubus over de rollups)
+    tarief_werkelijk, tarief_gepland           (omzet / uren)
+    gemiddeld_tarief, verwachte_opbrengst      (uit projectlines)
+    realisatie_marge, % tijdsbesteding         (afgeleid)
+
+De periodecijfers komen uit de prefix-som-kubus (utils/kpi_cube.py): een andere periode kost
+alleen twee lookups per bedrijf. De projectlines-scan staat per dataversie in de gedeelde
+Arrow-resultaatcache (utils/result_cache.py) voor álle bedrijven, zodat een andere
+bedrijfsselectie geen nieuwe query geeft. Filteren en afleiden gebeurt daarna vectorieel.
+"""
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.data_loaders import get_engine
+from utils.kpi_cube import company_period_kpis
+from utils.result_cache import arrow_cache
+
+PROJECTLINE_TABLES = ["projectlines_per_company", "projects"]
+
+# Per bedrijf in één scan: gemiddeld verkooptarief van de zichtbare urenregels en de
+# verwachte opbrengst (sellingprice * amount) van alle regels van bestaande projecten
+_PROJECTLINE_SQL = """
+    SELECT bedrijf_id,
+           AVG(sellingprice) FILTER (WHERE lower(unit_searchname) = 'uur' AND hidefortimewriting = FALSE) AS gemiddeld_tarief,
+           SUM(sellingprice * amount) AS verwachte_opbrengst
+    FROM projectlines_per_company
+    WHERE bedrijf_id IS NOT NULL
+      AND offerprojectbase_id IN (SELECT id FROM projects)
+    GROUP BY bedrijf_id
+"""
+
+
+@arrow_cache(tables=PROJECTLINE_TABLES)
+def _projectline_scan() -> pd.DataFrame:
+    with get_engine().connect() as conn:
+        df = pd.read_sql(text(_PROJECTLINE_SQL), conn)
+    df["bedrijf_id"] = df["bedrijf_id"].astype("Int64")
+    for col in ["gemiddeld_tarief", "verwachte_opbrengst"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df
+
+
+def _per_hour(amount: pd.Series, hours: pd.Series) -> pd.Series:
+    return amount.div(hours.where(hours != 0)).fillna(0)
+
+
+def company_kpis(start: date | str | None = None, end: date | str | None = None, company_ids=None) -> pd.DataFrame:
+    """
+    KPI's per bedrijf. Met start en eind tellen de dagcellen in die periode plus de regels zonder
+    datum; zonder periode is alles all-time. company_ids beperkt de bedrijven (en daarmee de
+    noemer van '% tijdsbesteding').
+    """
+    if start is None or end is None:
+        start = end = None
+    kpis = company_period_kpis(
+        date.fromisoformat(start) if isinstance(start, str) else start,
+        date.fromisoformat(end) if isinstance(end, str) else end,
+    )
+    kpis = kpis.merge(_projectline_scan(), on="bedrijf_id", how="left")
+    if company_ids is not None:
+        kpis = kpis[kpis["bedrijf_id"].isin(company_ids)]
+    kpis = kpis.copy()
+
+    kpis["tarief_werkelijk"] = _per_hour(kpis["totalpayed"], kpis["totaal_uren"])
+    kpis["tarief_gepland"] = _per_hour(kpis["geplande_omzet"], kpis["totaal_uren"])
+    kpis["verwachte_opbrengst"] = kpis["verwachte_opbrengst"].fillna(0)
+    verwacht = kpis["verwachte_opbrengst"].where(kpis["verwachte_opbrengst"] != 0)
+    kpis["realisatie_marge"] = ((kpis["totalpayed"] - verwacht) / verwacht).round(2)
+    totale_uren = kpis["totaal_uren"].sum()
+    kpis["% tijdsbesteding"] = (kpis["totaal_uren"] / totale_uren * 100).round(1) if totale_uren else 0.0
+    return kpis.reset_index(drop=True)
@@ -0,0 +1,227 @@
+"""
+KPI-rollups per bedrijf, incrementeel bijgehouden door de loader.
+
+kpi_company_daily  (company_id, day): uren ('uur'-regels) en gefactureerd (totalpayed) per dag.
+kpi_company_totals (company_id):      geplande omzet (projects.totalinclvat) en de regels
+                   zonder datum, die in de pagina's altijd meetellen.
+
+Tijdens elke merge worden de (bedrijf, dag)-cellen van nieuwe/gewijzigde rijen verzameld,
+zowel de oude als de nieuwe waarden (een rij kan van dag of bedrijf wisselen). Alleen die
+cellen worden daarna opnieuw uit de brontabellen berekend, in dezelfde transactie als de merge.
+
+Volledig opnieuw opbouwen: python -m utils.kpi_rollup
+"""
+import os
+from datetime import date
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, text
+
+from utils.gripp_schema import ROW_HASH_COLUMN
+from utils.migrations import migrate_column_types, migrate_rollup_tables
+
+# Brontabel -> (bedrijfskolom, dagkolom); projects heeft geen dag en telt alleen in de totalen
+ROLLUP_SOURCES = {
+    "projectlines_per_company": ("bedrijf_id", "createdon_date"),
+    "invoices": ("company_id", "reportdate_date"),
+    "projects": ("company_id", None),
+}
+
+DIRTY_TABLE = "tmp_kpi_dirty"
+
+# Eén herberekening tegelijk: parallelle loads van projectlines en invoices raken dezelfde cellen
+_ROLLUP_LOCK = "SELECT pg_advisory_xact_lock(hashtext('kpi_rollup'))"
+
+# Per bron de bijdrage aan een dagcel; de *_filter-plekken beperken tot de gewijzigde cellen
+_DAILY_SQL = """
+INSERT INTO kpi_company_daily (company_id, day, hours, invoiced, updated_at)
+SELECT company_id, day, SUM(hours), SUM(invoiced), now()
+FROM (
+    SELECT pl.bedrijf_id AS company_id, pl.createdon_date AS day,
+           CASE WHEN lower(pl.unit_searchname) = 'uur' THEN COALESCE(pl.amountwritten, 0) ELSE 0 END AS hours,
+           CAST(0 AS NUMERIC) AS invoiced
+    FROM projectlines_per_company pl
+    WHERE pl.bedrijf_id IS NOT NULL AND pl.createdon_date IS NOT NULL {pl_filter}
+    UNION ALL
+    SELECT i.company_id, i.reportdate_date, 0, COALESCE(i.totalpayed, 0)
+    FROM invoices i
+    WHERE i.company_id IS NOT NULL AND i.reportdate_date IS NOT NULL {invoice_filter}
+) cells
+GROUP BY company_id, day
+"""
+
+_TOTALS_SQL = """
+INSERT INTO kpi_company_totals
+    (company_id, planned_revenue, undated_hours, undated_invoiced, updated_at)
+SELECT company_id, SUM(planned), SUM(hours), SUM(invoiced), now()
+FROM (
+    SELECT p.company_id, CAST(COALESCE(p.totalinclvat, 0) AS NUMERIC) AS planned,
+           CAST(0 AS DOUBLE PRECISION) AS hours, CAST(0 AS NUMERIC) AS invoiced
+    FROM projects p
+    WHERE p.company_id IS NOT NULL {project_filter}
+    UNION ALL
+    SELECT pl.bedrijf_id, 0,
+           CASE WHEN lower(pl.unit_searchname) = 'uur' THEN COALESCE(pl.amountwritten, 0) ELSE 0 END, 0
+    FROM projectlines_per_company pl
+    WHERE pl.bedrijf_id IS NOT NULL AND pl.createdon_date IS NULL {pl_filter}
+    UNION ALL
+    SELECT i.company_id, 0, 0, COALESCE(i.totalpayed, 0)
+    FROM invoices i
+    WHERE i.company_id IS NOT NULL AND i.reportdate_date IS NULL {invoice_filter}
+) totals
+GROUP BY company_id
+"""
+
+
+def rollups_exist(conn) -> bool:
+    inspector = inspect(conn)
+    return inspector.has_table("kpi_company_daily") and inspector.has_table("kpi_company_totals")
+
+
+def ensure_rollups(conn, rebuild: bool = False) -> bool:
+    """
+    Zorgt dat de rolluptabellen bestaan en gevuld zijn. Nieuwe of lege tabellen (en rebuild=True,
+    bv. na een volledige refresh) worden volledig opgebouwd; daarna houdt de loader ze bij.
+    """
+    conn.execute(text(_ROLLUP_LOCK))
+    # De rollup-SQL rekent met getypeerde bronkolommen; oude TEXT-kolommen eerst omzetten
+    for table_name in ROLLUP_SOURCES:
+        if inspect(conn).has_table(table_name):
+            migrate_column_types(conn, table_name)
+    created = migrate_rollup_tables(conn)
+    empty = not conn.execute(text("SELECT EXISTS (SELECT 1 FROM kpi_company_totals)")).scalar()
+    if created or empty or rebuild:
+        return rebuild_rollups(conn)
+    return False
+
+
+def rebuild_rollups(conn) -> bool:
+    """Berekent beide rolluptabellen volledig opnieuw uit de brontabellen."""
+    missing = [t for t in ROLLUP_SOURCES if not inspect(conn).has_table(t)]
+    if missing:
+        print(f"⚠️ KPI-rollups niet opgebouwd, brontabellen ontbreken: {', '.join(missing)}")
+        return False
+    conn.execute(text(_ROLLUP_LOCK))
+    conn.execute(text("TRUNCATE kpi_company_daily, kpi_company_totals"))
+    no_filter = {"pl_filter": "", "invoice_filter": "", "project_filter": ""}
+    conn.execute(text(_DAILY_SQL.format(**no_filter)))
+    conn.execute(text(_TOTALS_SQL.format(**no_filter)))
+    print("📊 KPI-rollups volledig opgebouwd")
+    return True
+
+
+def capture_changed_keys(conn, meta: dict, columns: list):
+    """
+    Verzamelt vóór de merge de (bedrijf, dag)-cellen die de staging table gaat raken: de nieuwe
+    waarden van nieuwe/gewijzigde rijen en de huidige waarden van de rijen die overschreven worden.
+    """
+    table_name, staging_table = meta["table"], meta["staging_table"]
+    company_col, day_col = ROLLUP_SOURCES[table_name]
+    staged_day = f"s.{day_col}" if day_col else "CAST(NULL AS DATE)"
+    current_day = f"t.{day_col}" if day_col else "CAST(NULL AS DATE)"
+
+    if meta["merge"] == "ignore":
+        # Bestaande rijen blijven staan: alleen nieuwe id's tellen
+        changed, overwritten = "t.id IS NULL", None
+    elif ROW_HASH_COLUMN in columns:
+        changed = f"t.id IS NULL OR t.{ROW_HASH_COLUMN} IS DISTINCT FROM s.{ROW_HASH_COLUMN}"
+        overwritten = f"t.{ROW_HASH_COLUMN} IS DISTINCT FROM s.{ROW_HASH_COLUMN}"
+    else:
+        changed, overwritten = "TRUE", "TRUE"
+
+    conn.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {DIRTY_TABLE} (company_id BIGINT, day DATE) ON COMMIT DROP"))
+    query = f"""
+        INSERT INTO {DIRTY_TABLE} (company_id, day)
+        SELECT s.{company_col}, {staged_day}
+        FROM {staging_table} s LEFT JOIN {table_name} t ON t.id = s.id
+        WHERE {changed}
+    """
+    if overwritten:
+        query += f"""
+        UNION
+        SELECT t.{company_col}, {current_day}
+        FROM {table_name} t JOIN {staging_table} s ON t.id = s.id
+        WHERE {overwritten}
+        """
+    conn.execute(text(query))
+
+
+def refresh_changed_keys(conn) -> int:
+    """Herberekent na de merge alleen de verzamelde cellen; geeft het aantal geraakte bedrijven terug."""
+    conn.execute(text(_ROLLUP_LOCK))
+    dirty_days = f"(SELECT company_id, day FROM {DIRTY_TABLE} WHERE day IS NOT NULL)"
+    dirty_companies = f"(SELECT company_id FROM {DIRTY_TABLE})"
+
+    conn.execute(text(f"""
+        DELETE FROM kpi_company_daily k
+        WHERE (k.company_id, k.day) IN {dirty_days}
+    """))
+    conn.execute(text(_DAILY_SQL.format(
+        pl_filter=f"AND (pl.bedrijf_id, pl.createdon_date) IN {dirty_days}",
+        invoice_filter=f"AND (i.company_id, i.reportdate_date) IN {dirty_days}",
+    )))
+
+    conn.execute(text(f"DELETE FROM kpi_company_totals WHERE company_id IN {dirty_companies}"))
+    conn.execute(text(_TOTALS_SQL.format(
+        project_filter=f"AND p.company_id IN {dirty_companies}",
+        pl_filter=f"AND pl.bedrijf_id IN {dirty_companies}",
+        invoice_filter=f"AND i.company_id IN {dirty_companies}",
+    )))
+
+    companies = conn.execute(text(f"SELECT COUNT(DISTINCT company_id) FROM {DIRTY_TABLE}")).scalar() or 0
+    conn.execute(text(f"TRUNCATE {DIRTY_TABLE}"))
+    return companies
+
+
+def load_company_kpis(engine, start: date | None = None, end: date | None = None, company_ids=None) -> pd.DataFrame:
+    """
+    KPI's per bedrijf uit de rollups: totaal_uren, totalpayed en geplande_omzet.
+    Met een periode tellen de dagcellen in [start, end] plus de uren zonder datum (zoals app.py);
+    zonder periode is alles all-time, inclusief facturen zonder rapportdatum.
+    """
+    params = {}
+    day_filter, undated_invoiced = "", "t.undated_invoiced"
+    if start is not None and end is not None:
+        day_filter = "WHERE day BETWEEN :start AND :end"
+        params.update(start=start, end=end)
+        undated_invoiced = "0"
+    company_filter = ""
+    if company_ids is not None:
+        company_filter = "WHERE bedrijf_id = ANY(:company_ids)"
+        params["company_ids"] = [int(c) for c in company_ids]
+
+    query = f"""
+        SELECT company_id AS bedrijf_id,
+               COALESCE(d.hours, 0) + COALESCE(t.undated_hours, 0) AS totaal_uren,
+               COALESCE(d.invoiced, 0) + COALESCE({undated_invoiced}, 0) AS totalpayed,
+               COALESCE(t.planned_revenue, 0) AS geplande_omzet
+        FROM (
+            SELECT company_id, SUM(hours) AS hours, SUM(invoiced) AS invoiced
+            FROM kpi_company_daily {day_filter}
+            GROUP BY company_id
+        ) d
+        FULL OUTER JOIN kpi_company_totals t USING (company_id)
+    """
+    query = f"SELECT * FROM ({query}) kpis {company_filter}"
+    with engine.connect() as conn:
+        df = pd.read_sql(text(query), conn, params=params)
+    for col in ["totaal_uren", "totalpayed", "geplande_omzet"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("float64")
+    df["bedrijf_id"] = df["bedrijf_id"].astype("Int64")
+    return df
+
+
+def main():
+    load_dotenv()
+    postgres_url = os.getenv("POSTGRES_URL")
+    if not postgres_url:
+        raise ValueError("POSTGRES_URL is not set in the environment.")
+    engine = create_engine(postgres_url)
+    with engine.begin() as conn:
+        ensure_rollups(conn, rebuild=True)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
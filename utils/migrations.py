@@ -0,0 +1,400 @@
+"""
+DDL en migraties voor de Gripp-tabellen.
+
+Deze module is eigenaar van de tabelstructuur: primary key op id, de indexes die de
+dashboardpagina's nodig hebben, additieve kolom-evolutie, het eenmalig omzetten van TEXT-kolommen
+uit de oude loader naar hun schematype en ANALYZE na het laden.
+De loader (gripp_api.py) roept migrate_table() één keer per tabel per run aan.
+
+Los draaien (bv. na een deploy): python -m utils.migrations
+"""
+import os
+from datetime import date
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, text
+
+from utils.gripp_schema import TABLE_SCHEMAS, ROW_HASH_COLUMN
+
+# Type-sleutels uit het schema-register -> Postgres-typen voor nieuwe kolommen
+PG_TYPES = {
+    "id": "BIGINT",
+    "int32": "INTEGER",
+    "money": "NUMERIC",
+    "float": "DOUBLE PRECISION",
+    "category": "TEXT",
+    "date": "DATE",
+    "bool": "BOOLEAN",
+}
+
+# Per maand range-gepartitioneerde tabellen en hun partitiesleutel
+PARTITIONED_TABLES = {
+    "urenregistratie": "date_date",
+    "invoices": "reportdate_date",
+}
+
+# Per proces bekende maandpartities (zie ensure_partitions)
+_KNOWN_PARTITIONS = {}
+
+# Indexes per tabel, afgestemd op de filters en joins in app.py en pages/
+TABLE_INDEXES = {
+    "projects": {
+        "projects_company_id_idx": "(company_id)",
+        "projects_active_idx": "(id) WHERE archived = FALSE",
+    },
+    "projectlines_per_company": {
+        "projectlines_per_company_bedrijf_id_idx": "(bedrijf_id)",
+        "projectlines_per_company_offerprojectbase_id_idx": "(offerprojectbase_id)",
+        # Uren per bedrijf (projectrendement): alleen de 'uur'-regels, amountwritten in de index
+        "projectlines_per_company_uur_idx": "(bedrijf_id) INCLUDE (amountwritten) WHERE lower(unit_searchname) = 'uur'",
+    },
+    "urenregistratie": {
+        "urenregistratie_date_date_idx": "(date_date)",
+        "urenregistratie_offerprojectbase_id_idx": "(offerprojectbase_id)",
+    },
+    "invoices": {
+        "invoices_company_id_idx": "(company_id)",
+        "invoices_reportdate_date_idx": "(reportdate_date)",
+        "invoices_date_date_idx": "(date_date)",
+    },
+    "companies": {},
+    "employees": {},
+    "tasktypes": {},
+    "tasks": {},
+}
+
+# Vooraf geaggregeerde KPI's per bedrijf (bijgehouden door utils/kpi_rollup.py)
+ROLLUP_TABLES = {
+    "kpi_company_daily": """
+        company_id BIGINT NOT NULL,
+        day DATE NOT NULL,
+        hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+        invoiced NUMERIC NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (company_id, day)
+    """,
+    "kpi_company_totals": """
+        company_id BIGINT PRIMARY KEY,
+        planned_revenue NUMERIC NOT NULL DEFAULT 0,
+        undated_hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+        undated_invoiced NUMERIC NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    """,
+}
+
+
+def pg_type_for(table_name: str, column: str, dtype) -> str:
+    """Postgres-type voor een (nieuwe) kolom: eerst het schema-register, anders afgeleid van de pandas dtype."""
+    type_key = TABLE_SCHEMAS.get(table_name, {}).get(column)
+    if type_key is None and column.endswith("_date"):
+        type_key = "date"
+    if type_key:
+        return PG_TYPES[type_key]
+    if column == ROW_HASH_COLUMN:
+        return "BIGINT"
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+
+def _existing_columns(conn, table_name: str) -> set:
+    result = conn.execute(text("""
+        SELECT column_name FROM information_schema.columns WHERE table_name = :table_name
+    """), {"table_name": table_name})
+    return {row[0] for row in result}
+
+
+def _has_primary_key(conn, table_name: str) -> bool:
+    result = conn.execute(text("""
+        SELECT COUNT(*) FROM pg_constraint
+        WHERE conrelid = CAST(:table_name AS regclass) AND contype = 'p'
+    """), {"table_name": table_name})
+    return (result.scalar() or 0) > 0
+
+
+def _remove_duplicate_ids(conn, table_name: str):
+    # Oude tabellen (to_sql zonder PK + INSERT IGNORE) kunnen dubbele id's bevatten: de laatste rij blijft
+    removed = conn.execute(text(f"""
+        DELETE FROM {table_name} a USING {table_name} b
+        WHERE a.id = b.id AND a.ctid < b.ctid
+    """)).rowcount
+    removed += conn.execute(text(f"DELETE FROM {table_name} WHERE id IS NULL")).rowcount
+    if removed:
+        print(f"🧹 {removed} dubbele/lege id's verwijderd uit '{table_name}'")
+
+
+def _ensure_primary_key(conn, table_name: str):
+    if _has_primary_key(conn, table_name):
+        return
+    _remove_duplicate_ids(conn, table_name)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_pkey PRIMARY KEY (id)"))
+    print(f"🔑 Primary key op '{table_name}.id' aangemaakt")
+
+
+# Omzetting van een TEXT-kolom (tabellen van de oude loader: df.head(0).to_sql maakte lege
+# object-kolommen TEXT) naar het type uit het schema-register. Lege strings en 'nan' worden NULL.
+_TEXT_VALUE = "NULLIF(NULLIF(lower(trim({col})), ''), 'nan')"
+_FROM_TEXT = {
+    "id": "CAST(CAST({value} AS NUMERIC) AS BIGINT)",
+    "int32": "CAST(CAST({value} AS NUMERIC) AS INTEGER)",
+    "money": "CAST({value} AS NUMERIC)",
+    "float": "CAST({value} AS DOUBLE PRECISION)",
+    # Gripp-formaat 'YYYY-MM-DD HH:MM:SS.ffffff' of al 'YYYY-MM-DD': de eerste 10 tekens zijn de datum
+    "date": "CAST(left({value}, 10) AS DATE)",
+    "bool": "CAST({value} AS BOOLEAN)",
+}
+
+
+def _column_types(conn, table_name: str) -> dict:
+    result = conn.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table_name
+    """), {"table_name": table_name})
+    return {row[0]: row[1] for row in result}
+
+
+def migrate_column_types(conn, table_name: str) -> list:
+    """
+    Zet TEXT-kolommen die in het schema-register een ander type hebben om naar dat type
+    (eenmalig per kolom; een al getypeerde kolom wordt niet aangeraakt). Geeft de omgezette kolommen terug.
+    """
+    current = _column_types(conn, table_name)
+    schema = dict(TABLE_SCHEMAS.get(table_name, {}))
+    schema.update({c: "date" for c in current if c.endswith("_date") and c not in schema})
+    converted = []
+    for col, type_key in schema.items():
+        if current.get(col) != "text" or type_key not in _FROM_TEXT:
+            continue
+        using = _FROM_TEXT[type_key].format(value=_TEXT_VALUE.format(col=col))
+        conn.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {col} TYPE {PG_TYPES[type_key]} USING {using}"))
+        converted.append(col)
+    if converted:
+        print(f"🔧 '{table_name}': kolommen van TEXT naar het schematype omgezet: {', '.join(converted)}")
+    return converted
+
+
+def migrate_table(conn, table_name: str, template: pd.DataFrame | None = None):
+    """
+    Brengt een tabel op de gedeclareerde structuur: aanmaken met PK (op basis van template),
+    ontbrekende kolommen toevoegen, PK op id afdwingen en de indexes aanmaken. Idempotent.
+    """
+    columns = dict(template.dtypes) if template is not None else {}
+    if "id" in columns or template is None:
+        columns.setdefault(ROW_HASH_COLUMN, "int64")
+
+    partition_key = PARTITIONED_TABLES.get(table_name)
+    if not inspect(conn).has_table(table_name):
+        if template is None:
+            print(f"⚠️ Tabel '{table_name}' bestaat niet en er is geen template; migratie overgeslagen.")
+            return
+        column_defs = ", ".join(f"{col} {pg_type_for(table_name, col, dtype)}" for col, dtype in columns.items())
+        if partition_key:
+            conn.execute(text(f"CREATE TABLE {table_name} ({column_defs}) PARTITION BY RANGE ({partition_key})"))
+            conn.execute(text(f"CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT"))
+        else:
+            pk = ", PRIMARY KEY (id)" if "id" in columns else ""
+            conn.execute(text(f"CREATE TABLE {table_name} ({column_defs}{pk})"))
+        print(f"✅ Tabel '{table_name}' aangemaakt.")
+    else:
+        # Additieve evolutie: nieuwe kolommen erbij, bestaande kolommen blijven ongemoeid
+        existing = _existing_columns(conn, table_name)
+        for col, dtype in columns.items():
+            if col not in existing:
+                conn.execute(text(
+                    f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {col} {pg_type_for(table_name, col, dtype)}"
+                ))
+                print(f"➕ Kolom '{table_name}.{col}' toegevoegd")
+        # Vóór het partitioneren: de partitiesleutel moet een DATE zijn, geen TEXT
+        migrate_column_types(conn, table_name)
+        if partition_key and not is_partitioned(conn, table_name):
+            _convert_to_partitioned(conn, table_name, partition_key)
+        elif not partition_key and ("id" in existing or "id" in columns):
+            _ensure_primary_key(conn, table_name)
+
+    if partition_key:
+        # Een unieke sleutel op een gepartitioneerde tabel moet de partitiesleutel bevatten
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_id_key ON {table_name} (id, {partition_key})"
+        ))
+    for index_name, definition in TABLE_INDEXES.get(table_name, {}).items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} {definition}"))
+
+
+def is_partitioned(conn, table_name: str) -> bool:
+    result = conn.execute(text("""
+        SELECT COUNT(*) FROM pg_partitioned_table WHERE partrelid = CAST(:table_name AS regclass)
+    """), {"table_name": table_name})
+    return (result.scalar() or 0) > 0
+
+
+def ensure_partitions(conn, table_name: str, months):
+    """
+    Maakt de maandpartities ('YYYY-MM') aan die een load nodig heeft. Rijen zonder datum
+    vallen in de DEFAULT-partitie. Al bekende partities worden per proces onthouden.
+    """
+    for month in sorted(set(months) - _KNOWN_PARTITIONS.get(table_name, set())):
+        year, mon = map(int, month.split("-"))
+        start = date(year, mon, 1)
+        end = date(year + mon // 12, mon % 12 + 1, 1)
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {table_name}_{year:04d}_{mon:02d}
+            PARTITION OF {table_name} FOR VALUES FROM ('{start}') TO ('{end}')
+        """))
+        _KNOWN_PARTITIONS.setdefault(table_name, set()).add(month)
+
+
+def _convert_to_partitioned(conn, table_name: str, partition_key: str):
+    """Zet een bestaande gewone tabel eenmalig om naar een per maand gepartitioneerde tabel."""
+    old = f"{table_name}_unpartitioned"
+    print(f"🗂️ '{table_name}' wordt omgezet naar maandpartities op {partition_key}...")
+    _remove_duplicate_ids(conn, table_name)
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {old}"))
+    conn.execute(text(f"CREATE TABLE {table_name} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({partition_key})"))
+    conn.execute(text(f"CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT"))
+    result = conn.execute(text(f"""
+        SELECT DISTINCT to_char({partition_key}, 'YYYY-MM') FROM {old} WHERE {partition_key} IS NOT NULL
+    """))
+    ensure_partitions(conn, table_name, [row[0] for row in result])
+    moved = conn.execute(text(f"INSERT INTO {table_name} SELECT * FROM {old}")).rowcount
+    # Oude tabel weg vóór de indexes, zodat de indexnamen weer vrij zijn
+    conn.execute(text(f"DROP TABLE {old}"))
+    print(f"✅ '{table_name}' gepartitioneerd ({moved} rijen verplaatst)")
+
+
+def create_shadow_table(conn, table_name: str) -> str:
+    """Lege schaduwkopie (zelfde kolommen en defaults, nog zonder indexes) voor een volledige refresh."""
+    shadow = f"{table_name}_shadow"
+    conn.execute(text(f"DROP TABLE IF EXISTS {shadow}"))
+    conn.execute(text(f"CREATE TABLE {shadow} (LIKE {table_name} INCLUDING DEFAULTS)"))
+    return shadow
+
+
+def build_shadow_indexes(conn, table_name: str, shadow: str):
+    """PK en indexes op de gevulde schaduwtabel (in één keer bouwen is goedkoper dan tijdens het laden)."""
+    conn.execute(text(f"ALTER TABLE {shadow} ADD CONSTRAINT {shadow}_pkey PRIMARY KEY (id)"))
+    for index_name, definition in TABLE_INDEXES.get(table_name, {}).items():
+        conn.execute(text(f"CREATE INDEX {index_name}_shadow ON {shadow} {definition}"))
+
+
+def swap_shadow_table(conn, table_name: str, shadow: str):
+    """
+    Wisselt de schaduwtabel atomair in (in de transactie van conn): lezers zien óf de oude,
+    óf de volledig geladen en geïndexeerde nieuwe tabel. Index- en constraintnamen worden
+    teruggezet naar de vaste namen uit TABLE_INDEXES.
+    """
+    conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {table_name}_old"))
+    conn.execute(text(f"ALTER TABLE {shadow} RENAME TO {table_name}"))
+    conn.execute(text(f"DROP TABLE {table_name}_old"))
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME CONSTRAINT {shadow}_pkey TO {table_name}_pkey"))
+    for index_name in TABLE_INDEXES.get(table_name, {}):
+        conn.execute(text(f"ALTER INDEX {index_name}_shadow RENAME TO {index_name}"))
+
+
+def migrate_history_table(conn, history_table: str, source_table: str, template: pd.DataFrame):
+    """
+    SCD2-historietabel: dezelfde kolommen als de bron plus valid_from/valid_to. Eén versie per
+    (id, valid_from); de huidige versie heeft valid_to IS NULL en is uniek per id.
+    """
+    columns = dict(template.dtypes)
+    columns.setdefault(ROW_HASH_COLUMN, "int64")
+    if not inspect(conn).has_table(history_table):
+        column_defs = ", ".join(f"{col} {pg_type_for(source_table, col, dtype)}" for col, dtype in columns.items())
+        conn.execute(text(f"""
+            CREATE TABLE {history_table} (
+                {column_defs},
+                valid_from TIMESTAMPTZ NOT NULL,
+                valid_to TIMESTAMPTZ,
+                PRIMARY KEY (id, valid_from)
+            )
+        """))
+        print(f"✅ Historietabel '{history_table}' aangemaakt.")
+    else:
+        existing = _existing_columns(conn, history_table)
+        for col, dtype in columns.items():
+            if col not in existing:
+                conn.execute(text(
+                    f"ALTER TABLE {history_table} ADD COLUMN IF NOT EXISTS {col} {pg_type_for(source_table, col, dtype)}"
+                ))
+    conn.execute(text(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {history_table}_current_idx ON {history_table} (id) WHERE valid_to IS NULL"
+    ))
+    # Point-in-time: WHERE id = ... AND valid_from <= t AND (valid_to IS NULL OR valid_to > t)
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {history_table}_validity_idx ON {history_table} (valid_from, valid_to)"
+    ))
+
+
+def migrate_rollup_tables(conn) -> bool:
+    """Maakt de KPI-rolluptabellen aan als ze ontbreken; True als er iets nieuw is (en dus gevuld moet worden)."""
+    created = False
+    for table_name, definition in ROLLUP_TABLES.items():
+        if not inspect(conn).has_table(table_name):
+            conn.execute(text(f"CREATE TABLE {table_name} ({definition})"))
+            print(f"✅ Rolluptabel '{table_name}' aangemaakt.")
+            created = True
+    # Verwachte omzet staat niet (meer) in de rollups: die komt uit de KPI-engine (sellingprice * amount)
+    conn.execute(text("ALTER TABLE kpi_company_daily DROP COLUMN IF EXISTS expected_revenue"))
+    conn.execute(text("ALTER TABLE kpi_company_totals DROP COLUMN IF EXISTS undated_expected_revenue"))
+    # Periodefilter over alle bedrijven: WHERE day BETWEEN ... (de PK begint met company_id)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS kpi_company_daily_day_idx ON kpi_company_daily (day)"))
+    # Incrementele verversing van de prefix-som-kubus (utils/kpi_cube.py): WHERE updated_at > ...
+    conn.execute(text("CREATE INDEX IF NOT EXISTS kpi_company_daily_updated_at_idx ON kpi_company_daily (updated_at)"))
+    return created
+
+
+def migrate_data_versions(conn):
+    """Versieteller per tabel, opgehoogd door de loader na elke geslaagde load (zie utils/data_versions.py)."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def migrate_company_tags(conn):
+    """Genormaliseerde tags per bedrijf (gevuld door de loader, zie utils/company_tags.py)."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS company_tags (
+            company_id BIGINT NOT NULL,
+            tag_id BIGINT NOT NULL,
+            tag_name TEXT NOT NULL,
+            PRIMARY KEY (company_id, tag_id)
+        )
+    """))
+    # Bedrijfstype-filter: WHERE tag_name = ... (de PK begint met company_id)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS company_tags_tag_name_idx ON company_tags (tag_name) INCLUDE (company_id)"))
+
+
+def analyze_tables(conn, table_names):
+    """Ververs de planner-statistieken na het laden, zodat de nieuwe indexes ook gekozen worden."""
+    for table_name in table_names:
+        conn.execute(text(f"ANALYZE {table_name}"))
+    print(f"📈 ANALYZE uitgevoerd op {len(table_names)} tabellen")
+
+
+def main():
+    load_dotenv()
+    postgres_url = os.getenv("POSTGRES_URL")
+    if not postgres_url:
+        raise ValueError("POSTGRES_URL is not set in the environment.")
+    engine = create_engine(postgres_url)
+    with engine.begin() as conn:
+        for table_name in TABLE_INDEXES:
+            migrate_table(conn, table_name)
+        migrate_rollup_tables(conn)
+        migrate_data_versions(conn)
+        migrate_company_tags(conn)
+        analyze_tables(conn, [t for t in TABLE_INDEXES if inspect(conn).has_table(t)])
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import io
+import json
+import struct
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+# PostgreSQL binary COPY: signature, flags en header-extensie (beide 0)
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+NULL_FIELD = struct.pack(">i", -1)
+
+PG_EPOCH = np.datetime64("2000-01-01", "D")
+
+# data_type uit information_schema -> numpy big-endian formaat voor vaste breedte
+FIXED_WIDTH_TYPES = {
+    "smallint": ">i2",
+    "integer": ">i4",
+    "bigint": ">i8",
+    "real": ">f4",
+    "double precision": ">f8",
+}
+INTEGER_TYPES = {"smallint", "integer", "bigint"}
+TEXT_TYPES = {"text", "character varying", "character", "json"}
+
+
+def _with_nulls(encoded: list, null_mask: np.ndarray) -> list:
+    return [NULL_FIELD if is_null else field for field, is_null in zip(encoded, null_mask)]
+
+
+def _coerced_to_null(values: pd.Series, null_mask: np.ndarray, parsed_null: np.ndarray, what: str) -> np.ndarray:
+    """Null-masker na conversie: waarden die niet te converteren waren worden NULL (met een waarschuwing)."""
+    coerced = parsed_null & ~null_mask
+    if coerced.any():
+        print(f"⚠️ Kolom '{values.name}': {int(coerced.sum())} waarden niet als {what} te lezen; als NULL geschreven.")
+    return null_mask | parsed_null
+
+
+def _encode_fixed(values: pd.Series, data_type: str, null_mask: np.ndarray) -> list:
+    fmt = FIXED_WIDTH_TYPES[data_type]
+    if data_type in INTEGER_TYPES:
+        # Nullable dtypes: gehele getallen (ook ids boven 2^53) gaan nooit via float64
+        numbers = pd.to_numeric(values, errors="coerce", dtype_backend="numpy_nullable")
+        null_mask = _coerced_to_null(values, null_mask, numbers.isna().to_numpy(dtype=bool), data_type)
+        if pd.api.types.is_float_dtype(numbers.dtype):
+            fractional = numbers.notna() & (numbers.round() != numbers)
+            if fractional.any():
+                print(f"⚠️ Kolom '{values.name}' bevat decimalen maar is {data_type} in de database; waarden worden afgerond.")
+            numbers = numbers.round()
+        raw = numbers.astype("Int64").to_numpy(dtype="int64", na_value=0).astype(fmt)
+    else:
+        numbers = pd.to_numeric(values, errors="coerce")
+        null_mask = _coerced_to_null(values, null_mask, numbers.isna().to_numpy(dtype=bool), data_type)
+        raw = numbers.to_numpy(dtype="float64", na_value=np.nan).astype(fmt)
+    # Lengteprefix + waarde in één gestructureerde numpy-array, daarna per rij één bytes-object
+    width = raw.dtype.itemsize
+    packed = np.empty(len(raw), dtype=[("len", ">i4"), ("val", fmt)])
+    packed["len"] = width
+    packed["val"] = raw
+    buf = packed.tobytes()
+    step = 4 + width
+    return _with_nulls([buf[i:i + step] for i in range(0, len(buf), step)], null_mask)
+
+
+def _encode_numeric_value(value) -> bytes:
+    """Encodeer één waarde in het binaire NUMERIC-formaat (base-10000 digits), zonder precisieverlies."""
+    d = Decimal(repr(value)) if isinstance(value, float) else Decimal(str(value))
+    if d.is_nan():
+        payload = struct.pack(">hhHH", 0, 0, 0xC000, 0)
+        return struct.pack(">i", len(payload)) + payload
+    sign, digits, exponent = d.as_tuple()
+    digit_str = "".join(map(str, digits))
+    if exponent > 0:
+        digit_str += "0" * exponent
+        exponent = 0
+    dscale = -exponent
+    n_int = len(digit_str) - dscale
+    if n_int < 0:
+        digit_str = "0" * -n_int + digit_str
+        n_int = 0
+    int_part, frac_part = digit_str[:n_int], digit_str[n_int:]
+    int_part = int_part.zfill((len(int_part) + 3) // 4 * 4)
+    frac_part = frac_part.ljust((len(frac_part) + 3) // 4 * 4, "0")
+    groups = [int(int_part[i:i + 4]) for i in range(0, len(int_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(frac_part[i:i + 4]) for i in range(0, len(frac_part), 4)]
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    payload = struct.pack(f">hhHH{len(groups)}H", len(groups), weight, 0x4000 if sign else 0, dscale, *groups)
+    return struct.pack(">i", len(payload)) + payload
+
+
+def _encode_text(value) -> bytes:
+    data = (value if isinstance(value, str) else str(value)).encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def _encode_jsonb(value) -> bytes:
+    text = value if isinstance(value, str) else json.dumps(value.tolist() if isinstance(value, np.ndarray) else value)
+    data = b"\x01" + text.encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def _encode_column(values: pd.Series, data_type: str) -> list:
+    null_mask = values.isna().to_numpy(dtype=bool)
+    if data_type in FIXED_WIDTH_TYPES:
+        return _encode_fixed(values, data_type, null_mask)
+    if data_type == "boolean":
+        flags = values.fillna(False).astype(bool).to_numpy()
+        return _with_nulls([b"\x00\x00\x00\x01\x01" if f else b"\x00\x00\x00\x01\x00" for f in flags], null_mask)
+    if data_type == "date":
+        days = pd.to_datetime(values.astype("object"), errors="coerce").to_numpy("datetime64[D]")
+        # Na de conversie opnieuw maskeren: een niet te parsen waarde is NaT, geen dag-offset
+        null_mask = _coerced_to_null(values, null_mask, np.isnat(days), "datum")
+        offsets = np.where(null_mask, 0, (days - PG_EPOCH).astype("int64"))
+        return _encode_fixed(pd.Series(offsets, name=values.name), "integer", null_mask)
+    if data_type.startswith("timestamp"):
+        ts = pd.to_datetime(values.astype("object"), errors="coerce", utc=data_type.endswith("with time zone"))
+        if ts.dt.tz is not None:
+            ts = ts.dt.tz_convert(None)
+        stamps = ts.to_numpy("datetime64[us]")
+        null_mask = _coerced_to_null(values, null_mask, np.isnat(stamps), "tijdstip")
+        micros = np.where(null_mask, 0, (stamps - PG_EPOCH.astype("datetime64[us]")).astype("int64"))
+        return _encode_fixed(pd.Series(micros, name=values.name), "bigint", null_mask)
+    if data_type == "numeric":
+        return [NULL_FIELD if n else _encode_numeric_value(v) for v, n in zip(values.tolist(), null_mask)]
+    if data_type in TEXT_TYPES:
+        return [NULL_FIELD if n else _encode_text(v) for v, n in zip(values.tolist(), null_mask)]
+    if data_type == "jsonb":
+        return [NULL_FIELD if n else _encode_jsonb(v) for v, n in zip(values.tolist(), null_mask)]
+    raise ValueError(f"Binary COPY ondersteunt type '{data_type}' (kolom '{values.name}') niet")
+
+
+def encode_binary_copy(df: pd.DataFrame, column_types: dict) -> io.BytesIO:
+    """
+    Schrijft een DataFrame in het PostgreSQL binary COPY-formaat, kolomsgewijs vanuit de
+    getypeerde numpy/Arrow-kolommen. column_types is {kolom: information_schema data_type}
+    in de volgorde van de COPY-kolomlijst. Gooit ValueError bij een niet-ondersteund type.
+    """
+    columns = [_encode_column(df[col], column_types[col]) for col in column_types]
+    field_count = struct.pack(">h", len(columns))
+    buffer = io.BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    for fields in zip(*columns):
+        buffer.write(field_count)
+        buffer.write(b"".join(fields))
+    buffer.write(PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,112 @@
+"""
+Profiler per stap voor de Streamlit-pagina's.
+
+Zet in de sidebar '⏱️ Profiler' aan en elke stap die met `stage()` is omhuld wordt getimed,
+met het aantal rijen en het geheugengebruik van het resultaat. De stappen van de laatste run
+staan in een tabel in de sidebar en worden als JSON-regel weggeschreven naar
+data_cache/profiler.log (pad via PROFILER_LOG). Staat het paneel uit, dan doet stage() niets:
+geen timing, geen memory_usage, geen debug-queries.
+
+Gebruik:
+    profiler_toggle()                      # vroeg in de pagina, vóór de eerste stage
+    with stage("Facturen laden") as s:
+        df_invoices = load_filtered_invoices(...)
+        s["df"] = df_invoices              # optioneel: rijen + geheugen vastleggen
+    ...
+    render_profiler()                      # onderaan de pagina
+
+    if profiler_enabled():
+        ...                                # alleen-debug werk (extra queries, uitleg)
+"""
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from utils.data_loaders import DATA_DIR
+
+LOG_PATH = Path(os.getenv("PROFILER_LOG", str(DATA_DIR / "profiler.log")))
+
+_ENABLED_KEY = "profiler_enabled"
+_STAGES_KEY = "profiler_stages"
+
+
+def profiler_enabled() -> bool:
+    return bool(st.session_state.get(_ENABLED_KEY, False))
+
+
+def profiler_toggle(page: str = "app") -> bool:
+    """Sidebar-schakelaar; begint bij elke volledige run een nieuwe lijst stappen."""
+    enabled = st.sidebar.toggle("⏱️ Profiler", key=_ENABLED_KEY, help="Tijd, rijen en geheugen per stap")
+    st.session_state[_STAGES_KEY] = {"page": page, "run": datetime.now().isoformat(timespec="seconds"), "stages": []}
+    return enabled
+
+
+def _frame_stats(df) -> dict:
+    if isinstance(df, pd.DataFrame):
+        return {"rows": len(df), "mem_mb": round(df.memory_usage(deep=True).sum() / 1024 / 1024, 2)}
+    if isinstance(df, pd.Series):
+        return {"rows": len(df), "mem_mb": round(df.memory_usage(deep=True) / 1024 / 1024, 2)}
+    return {}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB op Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _log(record: dict):
+    try:
+        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        print(f"⚠️ Profiler-log niet te schrijven naar {LOG_PATH}: {e}")
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Meet één stap. Zet `s["df"] = resultaat` in het blok om rijen en geheugen mee te nemen.
+    Uit: levert een leeg dict op en meet niets.
+    """
+    entry = {}
+    if not profiler_enabled():
+        yield entry
+        return
+    started = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        run = st.session_state.get(_STAGES_KEY) or {"page": "app", "run": None, "stages": []}
+        record = {
+            "page": run["page"],
+            "run": run["run"],
+            "stage": name,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            **_frame_stats(entry.pop("df", None)),
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        run["stages"].append(record)
+        st.session_state[_STAGES_KEY] = run
+        _log(record)
+
+
+def render_profiler():
+    """Tabel met de stappen van de laatste run in de sidebar (alleen als de profiler aan staat)."""
+    if not profiler_enabled():
+        return
+    stages = (st.session_state.get(_STAGES_KEY) or {}).get("stages", [])
+    with st.sidebar.expander("⏱️ Profiler: laatste run", expanded=True):
+        if not stages:
+            st.caption("Nog geen stappen gemeten.")
+            return
+        df = pd.DataFrame(stages).drop(columns=["page", "run"])
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        st.caption(f"Totaal {df['ms'].sum():,.0f} ms · log: {LOG_PATH}")
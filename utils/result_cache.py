@@ -0,0 +1,133 @@
+"""
+Gedeelde resultaatcache op schijf als Arrow IPC-bestanden (data_cache/result_cache).
+
+In plaats van een gepickelde kopie per Streamlit-worker (@st.cache_data) staat elk
+queryresultaat één keer op schijf, gesleuteld op functie + argumenten + dataversie van de
+onderliggende tabellen (data_versions, zie utils/data_versions.py). Lezen gaat via memory-mapping:
+numerieke en datumkolommen worden zonder kopie uit de page cache van het OS gelezen, die alle
+workers delen. Een koude sessie vindt zo de warme resultaten van andere workers.
+
+Contract: het resultaat is read-only. Kolommen toevoegen of vervangen (df["x"] = ...) en filteren
+kan gewoon; waarden in place aanpassen (df.loc[mask, "x"] = ..., fillna(inplace=True)) niet. Wie
+dat nodig heeft maakt eerst zelf een .copy(). Ook bij een cache-miss komt het resultaat uit het
+bestand, zodat een koude aanroep zich hetzelfde gedraagt als een warme.
+
+De map is begrensd op RESULT_CACHE_MAX_MB; de minst recent gelezen bestanden gaan eerst weg.
+
+Gebruik:
+    @arrow_cache(tables=["invoices"])
+    def load_filtered_invoices(start_date_str, end_date_str, bedrijf_ids): ...
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+from utils.data_loaders import DATA_DIR
+from utils.data_versions import current_versions
+
+CACHE_DIR = DATA_DIR / "result_cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+MAX_CACHE_BYTES = int(os.getenv("RESULT_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+def _normalize(value):
+    """Argumenten stabiel serialiseerbaar maken (sets gesorteerd, numpy-scalars als Python-waarden)."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(_normalize(v) for v in value)
+    if isinstance(value, (list, tuple, pd.Index, pd.Series)):
+        return [_normalize(v) for v in list(value)]
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def cache_key(name: str, args, kwargs, versions: dict) -> str:
+    payload = json.dumps(
+        {"name": name, "args": _normalize(args), "kwargs": {k: _normalize(v) for k, v in sorted(kwargs.items())},
+         "versions": versions},
+        default=str, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_result(key: str) -> pd.DataFrame | None:
+    path = CACHE_DIR / f"{key}.arrow"
+    try:
+        # Geen context manager: de buffers van het resultaat verwijzen naar de mapping
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        os.utime(path)  # LRU: mtime is het moment van laatste gebruik
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    # split_blocks: numerieke kolommen zonder nulls blijven views op de mapping (read-only, zie contract)
+    return table.to_pandas(split_blocks=True)
+
+
+def write_result(key: str, df: pd.DataFrame) -> bool:
+    path = CACHE_DIR / f"{key}.arrow"
+    tmp_path = CACHE_DIR / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)  # Atomisch: andere workers zien nooit een half bestand
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        print(f"⚠️ Resultaat niet als Arrow te cachen: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return False
+    evict()
+    return True
+
+
+def evict(max_bytes: int = MAX_CACHE_BYTES):
+    """Verwijdert de minst recent gebruikte bestanden tot de cache onder max_bytes zit."""
+    entries = []
+    for path in CACHE_DIR.glob("*.arrow"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        # Een worker die dit bestand nog gemapt heeft houdt zijn data (Linux unlink-semantiek)
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def clear_cache():
+    for path in CACHE_DIR.glob("*.arrow"):
+        path.unlink(missing_ok=True)
+
+
+def arrow_cache(tables):
+    """
+    Decorator voor functies die een DataFrame teruggeven. De sleutel bevat de functienaam,
+    de argumenten en de dataversies van `tables`, dus nieuwe data geeft vanzelf een nieuwe sleutel.
+    Het resultaat is read-only (zie de moduledocstring); pas waarden alleen aan op een .copy().
+    """
+    def decorator(fn):
+        # Streamlit draait elke pagina als __main__: het bestandspad maakt de naam uniek
+        name = f"{fn.__code__.co_filename}:{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = cache_key(name, args, kwargs, current_versions(tables))
+            df = read_result(key)
+            if df is None:
+                df = fn(*args, **kwargs)
+                # Terug uit het bestand: koud en warm geven dezelfde (read-only) frame
+                if write_result(key, df):
+                    cached = read_result(key)
+                    if cached is not None:
+                        df = cached
+            return df
+
+        wrapper.clear = clear_cache
+        return wrapper
+    return decorator